@@ -3,13 +3,34 @@ import argparse
 import logging
 import os
 import signal
-from asyncio import get_event_loop, sleep
+from asyncio import (Task, gather, get_event_loop, new_event_loop,
+                     set_event_loop, sleep)
+from math import ceil
+from multiprocessing import Queue
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import toml
 from cerberus import Validator
 
+from carbon.ledger.backends import StorageBackend, get_backend
+from carbon.ledger.cache import BlockCache
+from carbon.ledger.checkpoints import (BackendCheckpointStore, Checkpoint,
+                                       CheckpointStore, StateFile)
+from carbon.ledger.compaction import Compactor, RetentionPolicy
 from carbon.ledger.connectors import Stream, get_connector
+from carbon.ledger.nodes import NodePool
+from carbon.ledger.polling import PollingInterval
 from carbon.ledger.protocols import get_protocol_parser
+from carbon.ledger.rollups import RESOLUTIONS, RollupStore
+from carbon.ledger.scheduler import Scheduler
+from carbon.ledger.segments import SegmentArchive
+from carbon.ledger.server import QueryServer
+from carbon.ledger.verification import DigestVerifier
+from carbon.ledger.wal import WriteAheadLog
+from carbon.ledger.workers import Supervisor, shard
+
+# Id of a worker process, number of workers and queue for their metrics
+Worker = Tuple[int, int, Queue]
 
 
 validator = Validator({
@@ -19,10 +40,96 @@ validator = Validator({
             'type': 'dict', 'schema': {
                 'root_address': {'type': 'string'},
                 'network': {'type': 'string'},
-                'protocol': {'type': 'string'}
+                'protocol': {'type': 'string'},
+                'min_poll_interval': {'type': 'number'},
+                'max_poll_interval': {'type': 'number'},
+                'tag': {'type': 'string'},
+                'addresses': {'type': 'list', 'schema': {'type': 'string'}},
+                'public_key': {'type': 'string'},
+                'retention': {'type': 'number'},
+                'downsample_after': {'type': 'number'},
+                'downsample_interval': {'type': 'integer'}
             }
         }
     },
+    'storage': {
+        'type': 'dict', 'schema': {
+            'backend': {'type': 'string'},
+            'path': {'type': 'string'}
+        }
+    },
+    'cache': {
+        'type': 'dict', 'schema': {
+            'max_entries': {'type': 'integer'},
+            'max_bytes': {'type': 'integer'}
+        }
+    },
+    'nodes': {
+        'type': 'dict', 'schema': {
+            'urls': {'type': 'list', 'schema': {'type': 'string'}},
+            'timeout': {'type': 'number'},
+            'max_connections': {'type': 'integer'},
+            'hedge': {'type': 'boolean'},
+            'rate_limit': {'type': 'number'},
+            'trytes_chunk_size': {'type': 'integer'}
+        }
+    },
+    'scheduler': {
+        'type': 'dict', 'schema': {
+            'max_concurrency': {'type': 'integer'},
+            'follow_reserve': {'type': 'integer'}
+        }
+    },
+    'checkpoints': {
+        'type': 'dict', 'schema': {
+            'path': {'type': 'string'},
+            'interval': {'type': 'number'}
+        }
+    },
+    'verification': {
+        'type': 'dict', 'schema': {
+            'processes': {'type': 'integer'},
+            'batch_size': {'type': 'integer'},
+            'max_delay': {'type': 'number'},
+            'cache_size': {'type': 'integer'}
+        }
+    },
+    'archive': {
+        'type': 'dict', 'schema': {
+            'path': {'type': 'string'},
+            'segment_samples': {'type': 'integer'}
+        }
+    },
+    'compaction': {
+        'type': 'dict', 'schema': {
+            'interval': {'type': 'number'},
+            'target_samples': {'type': 'integer'},
+            'min_segments': {'type': 'integer'},
+            'retention': {'type': 'number'},
+            'downsample_after': {'type': 'number'},
+            'downsample_interval': {'type': 'integer'}
+        }
+    },
+    'rollups': {
+        'type': 'dict', 'schema': {
+            'path': {'type': 'string'},
+            'resolutions': {'type': 'list', 'schema': {'type': 'integer'}},
+            'flush_interval': {'type': 'number'}
+        }
+    },
+    'wal': {
+        'type': 'dict', 'schema': {
+            'path': {'type': 'string'},
+            'commit_delay': {'type': 'number'},
+            'checkpoint_interval': {'type': 'number'}
+        }
+    },
+    'server': {
+        'type': 'dict', 'schema': {
+            'host': {'type': 'string'},
+            'port': {'type': 'integer'}
+        }
+    },
     'ads': {
         'type': 'list',
         'schema': {
@@ -34,6 +141,10 @@ validator = Validator({
 })
 
 
+# Called after the event loop has stopped
+shutdown_hooks = list()  # type: List[Callable[[], None]]
+
+
 def signal_handler() -> None:
     """Kills the event loop."""
     get_event_loop().stop()
@@ -42,59 +153,457 @@ def signal_handler() -> None:
 async def follow_stream(stream: Stream,
                         log: logging.Logger,
                         stop_at_the_end: bool = False) -> None:
-    """Follow a stream."""
-    stream_iterator = iter(stream)
-    while True:
-        try:
-            log.debug(f'Fetching next packet for stream with '
-                      f'root address {stream.root_address}')
-            packet = next(stream_iterator)
-            log.debug(f'Fetched packet for stream with root address '
-                      f'{stream.root_address}: {packet}')
-        except StopIteration:
-            if stop_at_the_end:
-                return
-        except Exception as e:
-            log.error(f'There was an error while trying to fetch the next '
-                      f'packet: {repr(e)}')
-            await sleep(5)
+    """Follow a stream.
+
+    Once the end of the stream is reached, its tail is polled at the interval
+    suggested by the stream, based on how often new blocks show up.
+    """
+    async with stream.follow() as stream_iterator:
+        reached_the_end = False
+        while True:
+            try:
+                log.debug(f'Fetching next packet for stream with '
+                          f'root address {stream.root_address}')
+                packet = await stream_iterator.__anext__()
+                log.debug(f'Fetched packet for stream with root address '
+                          f'{stream.root_address}: {packet}')
+                if reached_the_end:
+                    stream.polling.record_block()
+            except StopAsyncIteration:
+                if stop_at_the_end:
+                    return
+                reached_the_end = True
+                stream.polling.record_miss()
+                log.debug(f'Polling stream with root address '
+                          f'{stream.root_address} again in '
+                          f'{stream.polling.interval:.1f} seconds')
+                await sleep(stream.polling.interval)
+            except Exception as e:
+                log.error(f'There was an error while trying to fetch the '
+                          f'next packet: {repr(e)}')
+                await sleep(5)
 
 
 async def explore_stream_backwards(
     stream: Stream, log: logging.Logger
 ) -> None:
-    """Explore a stream backwards from the root address."""
+    """Explore a stream backwards from the earliest block reached so far."""
     original_root_address = stream.root_address
     log.info(f'Exploring stream with root address'
-             f' {original_root_address} backwards')
-    for _ in reversed(stream):
-        pass
+             f' {original_root_address} backwards from address'
+             f' {stream.earliest_address}')
+    async with stream.async_reversed(stream.earliest_address) as blocks:
+        async for _ in blocks:
+            pass
     log.info(f'Finished exploring stream with original root address'
              f' {original_root_address} backwards')
 
 
-async def schedule_streams(
-    config_file: str, logging_level: str = 'INFO'
-) -> None:
+async def run_stream(stream: Stream, log: logging.Logger,
+                     stream_config: Dict[str, Any],
+                     follow: bool = True) -> None:
+    """Backfill a stream in bulk if possible, then follow and explore it."""
+    if stream_config.get('tag') or stream_config.get('addresses'):
+        try:
+            await stream.backfill(addresses=stream_config.get('addresses', []),
+                                  tag=stream_config.get('tag'))
+        except Exception as e:
+            log.error(f'Could not backfill stream with root address '
+                      f'{stream.root_address}: {repr(e)}')
+    if stream.gaps:
+        try:
+            await stream.fill_gaps()
+        except Exception as e:
+            log.error(f'Could not fill the gaps of stream with root address '
+                      f'{stream.root_address}: {repr(e)}')
+    await gather(follow_stream(stream, log, not follow),
+                 explore_stream_backwards(stream, log))
+
+
+def collect_metrics(cache: BlockCache, scheduler: Scheduler,
+                    streams: List[Stream],
+                    verifier: Optional[DigestVerifier] = None,
+                    wal: Optional[WriteAheadLog] = None,
+                    rollups: Optional[RollupStore] = None) -> Dict[str, Any]:
+    metrics = {'cache': cache.stats, 'scheduler': scheduler.stats,
+               'streams': len(streams),
+               'processed_samples': sum(stream.processed_samples
+                                        for stream in streams)}
+    if verifier is not None:
+        metrics['verification'] = verifier.stats
+    if wal is not None:
+        metrics['wal'] = wal.stats
+    if rollups is not None:
+        metrics['rollups'] = rollups.stats
+    archives = [stream.archive.stats for stream in streams
+                if stream.archive is not None]
+    if archives:
+        metrics['archive'] = {name: sum(stats[name] for stats in archives)
+                              for name in archives[0]}
+    return metrics
+
+
+async def report_metrics(cache: BlockCache, scheduler: Scheduler,
+                         streams: List[Stream], log: logging.Logger,
+                         interval: int = 60,
+                         worker: Optional[Worker] = None,
+                         verifier: Optional[DigestVerifier] = None,
+                         wal: Optional[WriteAheadLog] = None,
+                         rollups: Optional[RollupStore] = None) -> None:
+    """Periodically log the usage of the block cache and the scheduler.
+
+    Workers send their metrics to the supervisor instead, more often so that
+    it can merge recent metrics of all the workers.
+    """
+    while True:
+        if worker is None:
+            await sleep(interval)
+            metrics = collect_metrics(cache, scheduler, streams, verifier,
+                                      wal, rollups)
+            log.info(f'Metrics: {metrics}')
+        else:
+            await sleep(min(interval, 10))
+            worker_id, _, metrics_queue = worker
+            metrics_queue.put((worker_id, collect_metrics(
+                cache, scheduler, streams, verifier, wal, rollups)))
+
+
+def save_checkpoints(streams: List[Stream], store: CheckpointStore,
+                     saved: Dict[str, Checkpoint],
+                     log: logging.Logger) -> None:
+    """Saves the checkpoints of the streams whose frontier has moved."""
+    checkpoints = [stream.checkpoint() for stream in streams]
+    changed = [checkpoint for checkpoint in checkpoints
+               if not checkpoint.same_frontier(saved.get(checkpoint.stream_id))]
+    if not changed:
+        return
+    try:
+        store.save(changed)
+    except Exception as e:
+        log.error(f'Could not save checkpoints: {repr(e)}')
+        return
+    saved.update((checkpoint.stream_id, checkpoint) for checkpoint in changed)
+    log.debug(f'Saved checkpoints of {len(changed)} streams')
+
+
+async def checkpoint_streams(streams: List[Stream], store: CheckpointStore,
+                             saved: Dict[str, Checkpoint],
+                             log: logging.Logger, interval: float = 30) -> None:
+    """Periodically save the checkpoints of the streams."""
+    while True:
+        await sleep(interval)
+        save_checkpoints(streams, store, saved, log)
+
+
+def replay_wal(wal: WriteAheadLog, streams: List[Stream],
+               log: logging.Logger) -> None:
+    """Stores the blocks of the write-ahead log in their streams."""
+    streams_by_id = {stream.stream_id: stream for stream in streams}
+    for stream_id, block in wal.replay():
+        stream = streams_by_id.get(stream_id)
+        if stream is None:
+            log.warning(f'Dropping logged block with address '
+                        f'{block.address} of unknown stream {stream_id}')
+            continue
+        stream.replay(block)
+    if wal.replayed:
+        log.info(f'Replayed {wal.replayed} blocks from the write-ahead log')
+
+
+async def truncate_wal(wal: WriteAheadLog, streams: List[Stream],
+                       log: logging.Logger,
+                       rollups: Optional[RollupStore] = None,
+                       backend: Optional[StorageBackend] = None) -> None:
+    """Flushes the storage and removes the logged blocks it now holds.
+
+    Blocks are committed by the storage backend as they are stored, and
+    rollups every few seconds, but neither are synced to disk until they
+    are flushed. Archived samples are buffered until they are flushed.
+    """
+    try:
+        sequences = await wal.rotate()
+        for stream in streams:
+            if stream.archive is not None:
+                stream.archive.flush()
+        if rollups is not None:
+            rollups.flush(sync=True)
+        if backend is not None:
+            backend.flush()
+        wal.remove(sequences)
+    except Exception as e:
+        log.error(f'Could not truncate the write-ahead log: {repr(e)}')
+        return
+    log.debug(f'Removed {len(sequences)} files of the write-ahead log')
+
+
+async def checkpoint_wal(wal: WriteAheadLog, streams: List[Stream],
+                         log: logging.Logger, interval: float = 60,
+                         rollups: Optional[RollupStore] = None,
+                         backend: Optional[StorageBackend] = None) -> None:
+    """Periodically truncate the write-ahead log."""
+    while True:
+        await sleep(interval)
+        await truncate_wal(wal, streams, log, rollups, backend)
+
+
+async def flush_rollups(rollups: RollupStore, log: logging.Logger,
+                        interval: float = 10) -> None:
+    """Periodically persist the updated rollups."""
+    while True:
+        await sleep(interval)
+        try:
+            rollups.flush()
+        except Exception as e:
+            log.error(f'Could not flush the rollups: {repr(e)}')
+
+
+async def compact_archives(compactors: List[Compactor], log: logging.Logger,
+                           interval: float = 600) -> None:
+    """Periodically compact the archives of the streams.
+
+    Compactions run in a thread, one archive at a time, so that the event
+    loop keeps running meanwhile.
+    """
     event_loop = get_event_loop()
-    # coroutine_registry = dict()  # type: Dict[str, Task]
+    while True:
+        await sleep(interval)
+        for compactor in compactors:
+            try:
+                result = await event_loop.run_in_executor(None,
+                                                          compactor.compact)
+            except Exception as e:
+                log.error(f'Could not compact the archive of stream '
+                          f'{compactor.archive.stream_id}: {repr(e)}')
+                continue
+            if any(result.values()):
+                log.info(f'Compacted the archive of stream '
+                         f'{compactor.archive.stream_id}: {result}')
+
+
+def split_budget(config: Dict[str, Any], keys: List[str], workers: int,
+                 integer: bool = True) -> Dict[str, Any]:
+    """Divides the global limits of a config section between the workers."""
+    config = dict(config)
+    for key in keys:
+        if key in config:
+            share = config[key] / workers
+            config[key] = max(1, ceil(share)) if integer else share
+    return config
+
+
+def setup_logging(logging_level: str,
+                  worker: Optional[Worker] = None) -> logging.Logger:
+    name = 'carbon-ledger' if worker is None else f'carbon-ledger.{worker[0]}'
     logging.basicConfig(level=logging_level.upper(),
                         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    log = logging.getLogger('carbon-ledger')
     logging.getLogger('urllib3').setLevel('ERROR')
+    return logging.getLogger(name)
+
+
+async def schedule_streams(
+    config_file: str, logging_level: str = 'INFO',
+    window_size: Optional[int] = None, follow: bool = True,
+    worker: Optional[Worker] = None, serve: Optional[str] = None
+) -> None:
+    """Schedule the streams of the config file.
+
+    A worker only runs its shard of the streams, and gets its share of the
+    global limits of the config file. The fetched data are served over HTTP
+    if the config file has a port for the server, or if an address is given
+    as HOST:PORT.
+    """
+    event_loop = get_event_loop()
+    # coroutine_registry = dict()  # type: Dict[str, Task]
+    log = setup_logging(logging_level, worker)
     config = toml.load(open(config_file, 'r'))
     if not validator.validate(config):
         log.error(f'Invalid configuration file: {repr(validator.errors)}')
-    for stream_config in config['streams']:
-        LedgerConnector = get_connector(stream_config['network'])
+    workers = worker[1] if worker is not None else 1
+    stream_configs = config['streams']
+    if worker is not None:
+        stream_configs = shard(stream_configs,
+                               lambda stream: stream['root_address'],
+                               workers)[worker[0]]
+    backend = None
+    if 'storage' in config:
+        storage_config = dict(config['storage'])
+        Backend = get_backend(storage_config.pop('backend'))
+        backend = Backend(**storage_config)
+    cache = BlockCache(**split_budget(config.get('cache', {}),
+                                      ['max_entries', 'max_bytes'], workers))
+    scheduler = Scheduler(**split_budget(config.get('scheduler', {}),
+                                         ['max_concurrency', 'follow_reserve'],
+                                         workers))
+    nodes_config = split_budget(config.get('nodes', {}), ['max_connections'],
+                                workers)
+    nodes_config = split_budget(nodes_config, ['rate_limit'], workers,
+                                integer=False)
+    trytes_chunk_size = nodes_config.pop('trytes_chunk_size', 100)
+    node_pool = NodePool(
+        nodes_config.pop('urls', ['https://nodes.thetangle.org']),
+        scheduler=scheduler, **nodes_config)
+    # Close the keep-alive connections to the nodes once the streams stopped
+    shutdown_hooks.append(
+        lambda: event_loop.run_until_complete(node_pool.close()))
+    verifier = None  # type: Optional[DigestVerifier]
+    if any('public_key' in stream_config for stream_config in stream_configs):
+        verifier = DigestVerifier(**split_budget(
+            config.get('verification', {}), ['processes'], workers))
+        shutdown_hooks.append(verifier.close)
+    wal_config = config.get('wal', {})
+    wal = None  # type: Optional[WriteAheadLog]
+    if 'path' in wal_config:
+        # Every worker has its own log
+        wal = WriteAheadLog(
+            wal_config['path'] if worker is None
+            else os.path.join(wal_config['path'], f'worker-{worker[0]}'),
+            wal_config.get('commit_delay', 0.01))
+    rollups_config = config.get('rollups', {})
+    rollups = None  # type: Optional[RollupStore]
+    if 'path' in rollups_config:
+        rollups = RollupStore(rollups_config['path'],
+                              rollups_config.get('resolutions', RESOLUTIONS))
+        # Runs before the write-ahead log is truncated on shutdown
+        shutdown_hooks.append(rollups.close)
+    streams = list()  # type: List[Stream]
+    background_tasks = [event_loop.create_task(
+        report_metrics(cache, scheduler, streams, log, worker=worker,
+                       verifier=verifier, wal=wal, rollups=rollups))]
+    if rollups is not None:
+        background_tasks.append(event_loop.create_task(flush_rollups(
+            rollups, log, rollups_config.get('flush_interval', 10))))
+    checkpoints_config = config.get('checkpoints', {})
+    checkpoint_store = None  # type: Optional[CheckpointStore]
+    if 'path' in checkpoints_config:
+        checkpoint_store = StateFile(checkpoints_config['path'])
+    elif backend is not None:
+        checkpoint_store = BackendCheckpointStore(backend)
+    archive_config = config.get('archive', {})
+    compaction_config = config.get('compaction', {})
+    compactors = list()  # type: List[Compactor]
+    stream_tasks = list()  # type: List[Task]
+    for stream_config in stream_configs:
+        LedgerConnector = get_connector(stream_config['network'],
+                                        asynchronous=True)
         ProtocolParser = get_protocol_parser(stream_config['protocol'])
+        polling = PollingInterval(
+            min_interval=stream_config.get('min_poll_interval', 5),
+            max_interval=stream_config.get('max_poll_interval', 600))
         stream = Stream(
-            ledger_connector=LedgerConnector(protocol=ProtocolParser),
-            root_address=stream_config['root_address'], logger=log)
+            ledger_connector=LedgerConnector(
+                protocol=ProtocolParser, node_pool=node_pool,
+                trytes_chunk_size=trytes_chunk_size),
+            root_address=stream_config['root_address'], logger=log,
+            window_size=window_size, backend=backend, cache=cache,
+            polling=polling, verifier=verifier,
+            public_key=stream_config.get('public_key'),
+            archive=SegmentArchive(
+                archive_config['path'], stream_config['root_address'],
+                archive_config.get('segment_samples', 100000))
+            if 'path' in archive_config else None, wal=wal, rollups=rollups)
+        if stream.archive is not None:
+            # Write the samples that are still buffered when the daemon stops
+            shutdown_hooks.append(stream.archive.flush)
+            policy = {key: stream_config.get(key, compaction_config.get(key))
+                      for key in ['retention', 'downsample_after',
+                                  'downsample_interval']}
+            compactors.append(Compactor(
+                stream.archive,
+                RetentionPolicy(policy['retention'],
+                                policy['downsample_after'],
+                                policy['downsample_interval'] or 3600),
+                compaction_config.get('target_samples', 1000000),
+                compaction_config.get('min_segments', 4)))
+        checkpoint = (checkpoint_store.load(stream.stream_id)
+                      if checkpoint_store is not None else None)
+        if checkpoint is not None:
+            log.info(f'Resuming stream with root address '
+                     f'{stream.root_address} from head {checkpoint.head} '
+                     f'and tail {checkpoint.tail}')
+            stream.restore(checkpoint)
+        streams.append(stream)
         log.info(f'Scheduling coroutines for IOTA stream with root address'
                  f' {stream_config["root_address"]}')
-        event_loop.create_task(follow_stream(stream, log, True))
-        event_loop.create_task(explore_stream_backwards(stream, log))
+        stream_tasks.append(event_loop.create_task(
+            run_stream(stream, log, stream_config, follow)))
+    if compactors:
+        background_tasks.append(event_loop.create_task(compact_archives(
+            compactors, log, compaction_config.get('interval', 600))))
+    if wal is not None:
+        # The streams start once this coroutine yields, after the blocks
+        # that were logged but maybe not stored have been replayed
+        replay_wal(wal, streams, log)
+        background_tasks.append(event_loop.create_task(checkpoint_wal(
+            wal, streams, log, wal_config.get('checkpoint_interval', 60),
+            rollups, backend)))
+
+        def close_wal() -> None:
+            if backend is not None:
+                backend.flush()
+            wal.close(truncate=True)
+
+        # Runs after the archives of the streams and the rollups have been
+        # flushed
+        shutdown_hooks.append(close_wal)
+    if checkpoint_store is not None:
+        saved = dict(())  # type: Dict[str, Checkpoint]
+        background_tasks.append(event_loop.create_task(checkpoint_streams(
+            streams, checkpoint_store, saved, log,
+            checkpoints_config.get('interval', 30))))
+        # Save the frontier one last time when the daemon stops
+        shutdown_hooks.append(
+            lambda: save_checkpoints(streams, checkpoint_store, saved, log))
+    server_config = dict(config.get('server', {}))
+    if serve:
+        host, _, port = serve.rpartition(':')
+        server_config.update(host=host or '127.0.0.1', port=int(port))
+    if 'port' in server_config:
+        # Every worker serves its own shard of the streams on the next port
+        server = QueryServer(
+            streams, log, rollups, server_config.get('host', '127.0.0.1'),
+            server_config['port'] + (worker[0] if worker is not None else 0))
+        await server.start()
+        # Stop answering queries before the storage is closed
+        shutdown_hooks.insert(
+            0, lambda: event_loop.run_until_complete(server.close()))
+    if not follow:
+        # Wait for the streams to reach their ends, then stop
+        await gather(*stream_tasks, return_exceptions=True)
+        for task in background_tasks:
+            task.cancel()
+        await gather(*background_tasks, return_exceptions=True)
+
+
+def run(config_file: str, logging_level: str,
+        window_size: Optional[int] = None, follow: bool = True,
+        worker: Optional[Worker] = None, serve: Optional[str] = None) -> None:
+    """Runs the streams, or the shard of a worker, until they are stopped."""
+    # Initialize event loop
+    event_loop = get_event_loop()
+    event_loop.add_signal_handler(signal.SIGTERM, signal_handler)
+    event_loop.add_signal_handler(signal.SIGINT, signal_handler)
+
+    if not follow:
+        event_loop.run_until_complete(
+            schedule_streams(config_file, logging_level, window_size,
+                             follow=False, worker=worker, serve=serve))
+    else:
+        event_loop.create_task(
+            schedule_streams(config_file, logging_level, window_size,
+                             worker=worker, serve=serve))
+        event_loop.run_forever()
+    for shutdown_hook in shutdown_hooks:
+        shutdown_hook()
+
+
+def run_worker(worker_id: int, workers: int, metrics_queue: Queue,
+               config_file: str, logging_level: str,
+               window_size: Optional[int], follow: bool,
+               serve: Optional[str]) -> None:
+    # Forked workers must not reuse the event loop of the supervisor
+    set_event_loop(new_event_loop())
+    run(config_file, logging_level, window_size, follow,
+        worker=(worker_id, workers, metrics_queue), serve=serve)
 
 
 if __name__ == '__main__':
@@ -102,13 +611,19 @@ if __name__ == '__main__':
         description='Explore Carbon streams from ledgers.')
     parser.add_argument('--config-file', type=str, default='config.example.toml')
     parser.add_argument('--no-follow', action='store_true',
-                        help="Follow a stream but don't wait for it to continue")
+                        help="Follow the streams until their end, then exit")
     parser.add_argument('--stream-window-size', type=int,
-                        help='Size of the buffer used to store data samples '
-                             'of a stream')
+                        help='Maximum number of blocks of a stream that are '
+                             'fetched ahead of the ones being processed')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes the streams are sharded '
+                             'across')
     parser.add_argument('--log-level', type=str, default='INFO',
                         help='Logging level of the application')
-    parser.add_argument('--show-data', type=str, help='')
+    parser.add_argument('--show-data', type=str, metavar='HOST:PORT',
+                        help='Serve the fetched data over HTTP on this '
+                             'address, overriding the server section of the '
+                             'config file')
 
     args = parser.parse_args()
 
@@ -116,12 +631,12 @@ if __name__ == '__main__':
         print('Config file does not exist')
         exit(1)
 
-    # Initialize event loop
-    event_loop = get_event_loop()
-    event_loop.add_signal_handler(signal.SIGTERM, signal_handler)
-
-    if args.no_follow:
-        event_loop.run_until_complete(
-            schedule_streams(args.config_file, args.log_level.upper()))
+    if args.workers > 1:
+        Supervisor(args.workers, run_worker,
+                   args=(args.config_file, args.log_level.upper(),
+                         args.stream_window_size, not args.no_follow,
+                         args.show_data),
+                   log=setup_logging(args.log_level)).run()
     else:
-        event_loop.run_forever()
+        run(args.config_file, args.log_level.upper(), args.stream_window_size,
+            not args.no_follow, serve=args.show_data)
@@ -1,14 +1,19 @@
 #!/usr/bin/env python3
+import codecs
 import statistics
 from collections import Counter
 from datetime import datetime
 from string import ascii_lowercase
-from typing import Dict, Iterable, List, Optional, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
+import numpy as np
 from iota import Transaction
 from iota.api import Iota
 from iota.commands.extended.utils import find_transaction_objects
 
+from carbon.ledger.protocols import HermesPlaintextParser
+from carbon.ledger.trytes import TryteDecoder
+
 
 stream_root_addresses = [
     'OCEXMTLLCLOFZXYBDHPBYJIYYM9XTUALRVHGOEU9UUDDJFABFYEOWOUYUVNMCAEYFVIFVAQREUKKWYFBXYSKFQ9USZ',
@@ -32,46 +37,43 @@ def datetime_to_string(dt):
     return dt.strftime('%Y-%m-%d %H:%M:%S')
 
 
-def process_transaction_bundle_data(transactions: Iterable[Transaction]) -> Tuple[str, str, Iterable[Transaction]]:
-    next_address = ''
-    previous_address = ''
-    previous_tx_hash = ''
-    for transaction in transactions:
-        tx_hash = str(transaction.hash)
-        tx_data = transaction.signature_message_fragment.as_string()
-        if transaction.current_index == 0:
-            fields = (tx_data
-                      .replace('next_address:', '')
-                      .replace('previous_address:', '')
-                      .split('::'))  # type: List[str]
-            next_address = fields[1]
-            previous_address = fields[2]
-            transaction_samples[tx_hash] = fields[3:]  # type: List[str]
-        else:
-            if tx_data.startswith('::'):
-                transaction_samples[tx_hash] += tx_data[2:].split('::')
-            elif tx_data.startswith(':') and transaction_samples[previous_tx_hash][-1].endswith(':'):
-                _monitoring_data = tx_data[1:].split('::')
-                transaction_samples[previous_tx_hash] = (transaction_samples[previous_tx_hash][:-1] +
-                                                         [transaction_samples[previous_tx_hash][-1][:-1]])
-                transaction_samples[tx_hash] = (transaction_samples[previous_tx_hash][:-1] +
-                                                [_monitoring_data[0][1:]] + _monitoring_data[1:])
-            else:
-                _monitoring_data = tx_data.split('::')
-                if len(transaction_samples[previous_tx_hash]) == 0:
-                    transaction_samples[tx_hash] = _monitoring_data
-                elif len(_monitoring_data) == 1:
-                    transaction_samples[tx_hash] = [
-                        transaction_samples[previous_tx_hash][-1] + _monitoring_data[0]]
-                    transaction_samples[previous_tx_hash] = transaction_samples[previous_tx_hash][:-1]
-                else:
-                    transaction_samples[tx_hash] = [
-                        transaction_samples[previous_tx_hash][-1] + _monitoring_data[0]] + _monitoring_data[1:]
-                    transaction_samples[previous_tx_hash] = transaction_samples[previous_tx_hash][:-1]
-
-        previous_tx_hash = tx_hash
-
-    return next_address, previous_address, transactions
+def iota_message_fragments(
+    transactions: Iterable[Transaction]
+) -> Iterator[str]:
+    """Decodes the messages of consecutive transactions piece by piece.
+
+    Every character takes two trytes, so a character can be split across the
+    signature message fragments of two transactions. It is then returned with
+    the second one. Only the last transaction has its padding stripped.
+    """
+    transactions = list(transactions)
+    if not transactions:
+        return
+    fragments = np.frombuffer(
+        b''.join(bytes(transaction.signature_message_fragment)
+                 for transaction in transactions),
+        dtype=np.uint8).reshape(len(transactions), -1)
+    message = TryteDecoder().decode(fragments,
+                                    [np.arange(len(transactions))])[0]
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    start = 0
+    for i in range(1, len(transactions) + 1):
+        # Characters whose trytes are complete by the end of the fragment
+        end = min(i * fragments.shape[1] // 2, len(message))
+        yield text_decoder.decode(message[start:end],
+                                  final=i == len(transactions))
+        start = end
+
+
+def process_transaction_bundle_data(transactions: List[Transaction]) -> Tuple[str, str, Iterable[Transaction]]:
+    """Assigns every sample of a bundle to the transaction that completes it."""
+    parser = HermesPlaintextParser.StreamingParser()
+    fragments = iota_message_fragments(transactions)
+    for transaction, fragment in zip(transactions, fragments):
+        transaction_samples[str(transaction.hash)] = parser.feed(fragment)
+    # The last sample is only complete once all the fragments are consumed
+    transaction_samples[str(transactions[-1].hash)] += parser.close()
+    return parser.next_link, parser.previous_link, transactions
 
 
 def fetch_data_from_address(address: Optional[str]) -> None:
@@ -0,0 +1,220 @@
+from itertools import repeat
+from typing import (Dict, Iterable, List, Optional, Sequence, Tuple,
+                    Union)
+
+import numpy as np
+
+from carbon.ledger.data import TagSet
+
+# Timestamps past the year 9999 in seconds are assumed to be in milliseconds,
+# like in carbon.ledger.protocols.epoch_to_datetime
+MAX_EPOCH_SECONDS = 253402300800
+
+
+class TagDictionary:
+    """Dictionary encoding of the keys of the samples.
+
+    The key of a sample is its metric name together with its tags, as found
+    in the raw sample. Every distinct key gets a small integer id, so that
+    the samples of a batch only store the id of their key, and a parsed tag
+    set that is shared by all the packets with that key. The names and
+    values of the tags are interned, so the memory used by the dictionary
+    depends on the number of distinct tags and not on the number of samples.
+    """
+
+    def __init__(self) -> None:
+        self.keys = list()  # type: List[str]
+        self._ids = dict(())  # type: Dict[str, int]
+        self._tag_sets = list()  # type: List[Optional[TagSet]]
+        self._strings = dict(())  # type: Dict[str, str]
+
+    def encode(self, key: str) -> int:
+        tag_id = self._ids.get(key)
+        if tag_id is None:
+            tag_id = self._ids[key] = len(self.keys)
+            self.keys.append(key)
+            self._tag_sets.append(None)
+        return tag_id
+
+    def encode_many(self, keys: Sequence[str]) -> np.ndarray:
+        ids = self._ids
+        encode = self.encode
+        return np.fromiter((ids[key] if key in ids else encode(key)
+                            for key in keys),
+                           dtype=np.int32, count=len(keys))
+
+    def decode(self, tag_id: int) -> str:
+        return self.keys[tag_id]
+
+    def _intern(self, string: str) -> str:
+        return self._strings.setdefault(string, string)
+
+    def tag_set(self, key: str) -> TagSet:
+        """Returns the shared tag set of a key, parsing it the first time."""
+        tag_id = self.encode(key)
+        tag_set = self._tag_sets[tag_id]
+        if tag_set is None:
+            tag_set = self._tag_sets[tag_id] = TagSet.parse(
+                self.keys[tag_id], self._intern)
+        return tag_set
+
+    def get(self, key: str) -> Optional[int]:
+        return self._ids.get(key)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+
+class SampleBatch:
+    """Columnar representation of a sequence of samples.
+
+    Timestamps are int64 seconds since the epoch, values are float64 and the
+    keys of the samples are stored as ids of a TagDictionary that is shared
+    by all the batches of a stream. Samples that are the mean of several
+    ones, once downsampled, have the number of samples they stand for in
+    counts. Without counts, every sample stands for itself.
+    """
+
+    def __init__(self, timestamps: np.ndarray, values: np.ndarray,
+                 tag_ids: np.ndarray, dictionary: TagDictionary,
+                 counts: Optional[np.ndarray] = None) -> None:
+        self.timestamps = timestamps
+        self.values = values
+        self.tag_ids = tag_ids
+        self.dictionary = dictionary
+        self.counts = counts
+
+    @staticmethod
+    def empty(dictionary: TagDictionary) -> 'SampleBatch':
+        return SampleBatch(np.empty(0, dtype=np.int64),
+                           np.empty(0, dtype=np.float64),
+                           np.empty(0, dtype=np.int32), dictionary)
+
+    @staticmethod
+    def concatenate(batches: Iterable['SampleBatch'],
+                    dictionary: TagDictionary) -> 'SampleBatch':
+        """Joins batches that were encoded with the same dictionary."""
+        batches = list(batches)
+        if not batches:
+            return SampleBatch.empty(dictionary)
+        counts = None  # type: Optional[np.ndarray]
+        if any(batch.counts is not None for batch in batches):
+            counts = np.concatenate([batch.sample_counts
+                                     for batch in batches])
+        return SampleBatch(
+            np.concatenate([batch.timestamps for batch in batches]),
+            np.concatenate([batch.values for batch in batches]),
+            np.concatenate([batch.tag_ids for batch in batches]),
+            dictionary, counts)
+
+    def take(self, indices: Union[np.ndarray, slice]) -> 'SampleBatch':
+        """Returns the samples at some indices, or matching a mask."""
+        return SampleBatch(
+            self.timestamps[indices], self.values[indices],
+            self.tag_ids[indices], self.dictionary,
+            self.counts[indices] if self.counts is not None else None)
+
+    def recode(self, dictionary: TagDictionary) -> 'SampleBatch':
+        """Returns the samples with their keys encoded by another dictionary.
+        """
+        if dictionary is self.dictionary:
+            return self
+        tag_ids, inverse = np.unique(self.tag_ids, return_inverse=True)
+        keys = [self.dictionary.decode(tag_id) for tag_id in tag_ids.tolist()]
+        return SampleBatch(self.timestamps, self.values,
+                           dictionary.encode_many(keys)[inverse.reshape(-1)],
+                           dictionary, self.counts)
+
+    def select(self, key: str) -> 'SampleBatch':
+        """Returns the samples of a single key."""
+        tag_id = self.dictionary.get(key)
+        if tag_id is None:
+            return SampleBatch.empty(self.dictionary)
+        return self.take(self.tag_ids == tag_id)
+
+    def between(self, start: int, end: int) -> 'SampleBatch':
+        """Returns the samples with start <= timestamp < end."""
+        return self.take((self.timestamps >= start)
+                         & (self.timestamps < end))
+
+    def sorted(self) -> 'SampleBatch':
+        """Returns the samples ordered by timestamp."""
+        return self.take(np.argsort(self.timestamps, kind='stable'))
+
+    def latest(self) -> 'SampleBatch':
+        """Returns the sample with the latest timestamp of every key."""
+        if not len(self):
+            return self
+        order = np.lexsort((self.timestamps, self.tag_ids))
+        tag_ids = self.tag_ids[order]
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = tag_ids[1:] != tag_ids[:-1]
+        return self.take(order[last])
+
+    @property
+    def sample_counts(self) -> np.ndarray:
+        """Number of samples every sample stands for."""
+        if self.counts is None:
+            return np.ones(len(self), dtype=np.int64)
+        return self.counts
+
+    @property
+    def keys(self) -> List[str]:
+        return [self.dictionary.decode(tag_id) for tag_id in self.tag_ids]
+
+    @property
+    def nbytes(self) -> int:
+        return (self.timestamps.nbytes + self.values.nbytes
+                + self.tag_ids.nbytes
+                + (self.counts.nbytes if self.counts is not None else 0))
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+
+def split_samples(samples: Sequence[str]
+                  ) -> Tuple[List[str], List[str], List[str]]:
+    """Splits raw samples of the form `key timestamp value` into columns.
+
+    Samples with exactly two spaces are split all at once instead of one by
+    one. Raises ValueError if a sample is malformed.
+    """
+    if set(map(str.count, samples, repeat(' '))) == {2}:
+        # Every sample has exactly three fields
+        fields = ' '.join(samples).split(' ')
+        return fields[0::3], fields[1::3], fields[2::3]
+    # Some samples have extra spaces in their keys or are malformed
+    split_samples = [sample.rsplit(' ', 2) for sample in samples]
+    if any(len(parts) != 3 for parts in split_samples):
+        raise ValueError('Samples must have a key, a timestamp and a '
+                         'value separated by spaces')
+    keys, timestamps, values = map(list, zip(*split_samples))
+    return keys, timestamps, values
+
+
+def parse_timestamps(timestamps: Sequence[str]) -> np.ndarray:
+    """Converts epoch timestamps in seconds or milliseconds to seconds."""
+    epochs = np.array(timestamps, dtype=np.float64)
+    epochs = np.where(epochs >= MAX_EPOCH_SECONDS, epochs / 1000, epochs)
+    return epochs.astype(np.int64)
+
+
+def time_bounds(samples: Sequence[str]) -> Tuple[int, int]:
+    """Returns the first and last timestamps of some raw samples."""
+    epochs = parse_timestamps(split_samples(samples)[1])
+    return int(epochs.min()), int(epochs.max())
+
+
+def parse_samples(samples: Sequence[str],
+                  dictionary: TagDictionary) -> SampleBatch:
+    """Parses raw samples of the form `key timestamp value` into a batch.
+
+    The numeric columns are converted by numpy, without creating an object
+    per sample. Raises ValueError if a sample is malformed.
+    """
+    if not samples:
+        return SampleBatch.empty(dictionary)
+    keys, timestamps, values = split_samples(samples)
+    return SampleBatch(parse_timestamps(timestamps),
+                       np.array(values, dtype=np.float64),
+                       dictionary.encode_many(keys), dictionary)
@@ -1,3 +1,199 @@
-class InMemory:
-    pass
+import json
+import sqlite3
+from abc import ABC
+from enum import Enum
+from time import time
+from typing import (Any, Dict, Iterator, List, Optional, Type,
+                    TYPE_CHECKING)
 
+if TYPE_CHECKING:
+    from carbon.ledger.connectors import Block
+
+
+def checkpoint(db: sqlite3.Connection) -> None:
+    """Copies the write-ahead log of a database into it and syncs both.
+
+    Commits in WAL mode with synchronous=NORMAL survive a crash of the
+    process but not a power failure, until they are checkpointed.
+    """
+    busy, _, _ = db.execute('PRAGMA wal_checkpoint(FULL)').fetchone()
+    if busy:
+        raise sqlite3.OperationalError('Could not checkpoint the database, '
+                                       'it is in use')
+
+
+class Backend(str, Enum):
+    MEMORY = 'MEMORY'
+    SQLITE = 'SQLITE'
+
+
+class StorageBackend(ABC):
+    """Stores the blocks fetched from a ledger indexed by their address.
+
+    Every block is stored together with the id of the stream it belongs to,
+    so that one backend can be shared by all the streams of the process.
+    """
+
+    def get(self, address: str) -> Optional['Block']:
+        raise NotImplemented()
+
+    def put(self, block: 'Block', stream_id: str = '') -> None:
+        raise NotImplemented()
+
+    def count(self, stream_id: str) -> int:
+        raise NotImplemented()
+
+    def blocks(self, stream_id: str) -> Iterator['Block']:
+        """Iterates over the blocks of a stream, in no particular order."""
+        raise NotImplemented()
+
+    def __contains__(self, address: str) -> bool:
+        return self.get(address) is not None
+
+    def get_checkpoint(self, stream_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplemented()
+
+    def put_checkpoints(self, checkpoints: List[Dict[str, Any]]) -> None:
+        """Stores the checkpoints of several streams atomically."""
+        raise NotImplemented()
+
+    def flush(self) -> None:
+        """Makes the blocks stored so far survive a power failure."""
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class InMemory(StorageBackend):
+    def __init__(self) -> None:
+        self._blocks = dict(())  # type: Dict[str, Block]
+        self._stream_ids = dict(())  # type: Dict[str, str]
+        self._counts = dict(())  # type: Dict[str, int]
+        self._checkpoints = dict(())  # type: Dict[str, Dict[str, Any]]
+
+    def get(self, address: str) -> Optional['Block']:
+        return self._blocks.get(address)
+
+    def put(self, block: 'Block', stream_id: str = '') -> None:
+        if block.address not in self._blocks:
+            self._counts[stream_id] = self._counts.get(stream_id, 0) + 1
+        self._blocks[block.address] = block
+        self._stream_ids[block.address] = stream_id
+
+    def count(self, stream_id: str) -> int:
+        return self._counts.get(stream_id, 0)
+
+    def blocks(self, stream_id: str) -> Iterator['Block']:
+        for address, block in list(self._blocks.items()):
+            if self._stream_ids[address] == stream_id:
+                yield block
+
+    def __contains__(self, address: str) -> bool:
+        return address in self._blocks
+
+    def get_checkpoint(self, stream_id: str) -> Optional[Dict[str, Any]]:
+        return self._checkpoints.get(stream_id)
+
+    def put_checkpoints(self, checkpoints: List[Dict[str, Any]]) -> None:
+        for checkpoint in checkpoints:
+            self._checkpoints[checkpoint['stream_id']] = dict(checkpoint)
+
+
+class SQLite(StorageBackend):
+    """Durable block store backed by a local SQLite database.
+
+    Only the headers and the raw samples of a block are stored. The samples
+    are parsed again when the block is loaded.
+    """
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS blocks (
+            address TEXT PRIMARY KEY,
+            stream_id TEXT NOT NULL,
+            next_link TEXT NOT NULL,
+            previous_link TEXT NOT NULL,
+            data TEXT NOT NULL,
+            metadata TEXT NOT NULL,
+            fetched_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS blocks_stream_id ON blocks (stream_id);
+        CREATE TABLE IF NOT EXISTS checkpoints (
+            stream_id TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+    '''
+
+    def __init__(self, path: str = 'carbon-ledger.db') -> None:
+        self._db = sqlite3.connect(path)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SQLite.SCHEMA)
+
+    @staticmethod
+    def _block(row: tuple) -> 'Block':
+        from carbon.ledger.connectors import Block
+        return Block(address=row[0], next_link=row[1], previous_link=row[2],
+                     data=json.loads(row[3]), metadata=json.loads(row[4]))
+
+    def get(self, address: str) -> Optional['Block']:
+        row = self._db.execute(
+            'SELECT address, next_link, previous_link, data, metadata '
+            'FROM blocks WHERE address = ?', (address,)).fetchone()
+        if not row:
+            return None
+        return SQLite._block(row)
+
+    def put(self, block: 'Block', stream_id: str = '') -> None:
+        with self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (block.address, stream_id, block.next_link,
+                 block.previous_link,
+                 json.dumps(dict(block.data, samples=block.raw_samples)),
+                 json.dumps(block.metadata), time()))
+
+    def count(self, stream_id: str) -> int:
+        return self._db.execute(
+            'SELECT COUNT(*) FROM blocks WHERE stream_id = ?',
+            (stream_id,)).fetchone()[0]
+
+    def blocks(self, stream_id: str) -> Iterator['Block']:
+        # Rows are read as they are consumed, not all at once
+        cursor = self._db.execute(
+            'SELECT address, next_link, previous_link, data, metadata '
+            'FROM blocks WHERE stream_id = ?', (stream_id,))
+        for row in cursor:
+            yield SQLite._block(row)
+
+    def __contains__(self, address: str) -> bool:
+        return self._db.execute('SELECT 1 FROM blocks WHERE address = ?',
+                                (address,)).fetchone() is not None
+
+    def get_checkpoint(self, stream_id: str) -> Optional[Dict[str, Any]]:
+        row = self._db.execute(
+            'SELECT state FROM checkpoints WHERE stream_id = ?',
+            (stream_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_checkpoints(self, checkpoints: List[Dict[str, Any]]) -> None:
+        with self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)',
+                [(checkpoint['stream_id'], json.dumps(checkpoint),
+                  checkpoint['created_at']) for checkpoint in checkpoints])
+
+    def flush(self) -> None:
+        checkpoint(self._db)
+
+    def close(self) -> None:
+        self._db.close()
+
+
+def get_backend(backend_id: str) -> Type[StorageBackend]:
+    backend = Backend[backend_id.upper()]
+    if backend == Backend.MEMORY:
+        return InMemory
+    elif backend == Backend.SQLITE:
+        return SQLite
@@ -0,0 +1,142 @@
+from collections import OrderedDict
+from sys import getsizeof
+from time import monotonic
+from typing import Dict, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from carbon.ledger.connectors import Block
+
+
+def estimate_block_size(block: 'Block') -> int:
+    """Rough estimate of the number of bytes held by a block."""
+    size = getsizeof(block) + getsizeof(block.address)
+    size += getsizeof(block.next_link) + getsizeof(block.previous_link)
+    samples = block.data.get('samples', [])
+    size += getsizeof(samples) + sum(map(getsizeof, samples))
+    # Packets share the raw samples of the block until they are released, so
+    # only their own overhead is counted.
+    size += getsizeof(block.samples) + sum(map(getsizeof, block.samples))
+    if block.arrays is not None:
+        size += block.arrays.nbytes
+    return size
+
+
+class BlockCache:
+    """LRU cache of blocks bounded by a number of entries and/or bytes.
+
+    Pinned blocks are never evicted, so the budget can be temporarily
+    exceeded if too many blocks are pinned. Evicted blocks are simply
+    dropped, it's up to the owner of the cache to load them again from a
+    storage backend or the ledger.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._blocks = OrderedDict()  # type: OrderedDict[str, Block]
+        self._sizes = dict(())  # type: Dict[str, int]
+        self._pins = dict(())  # type: Dict[str, int]
+
+    def get(self, address: str) -> Optional['Block']:
+        block = self._blocks.get(address)
+        if block is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._blocks.move_to_end(address)
+        return block
+
+    def put(self, block: 'Block') -> None:
+        address = block.address
+        if address in self._blocks:
+            self.size_bytes -= self._sizes[address]
+        self._blocks[address] = block
+        self._blocks.move_to_end(address)
+        self._sizes[address] = estimate_block_size(block)
+        self.size_bytes += self._sizes[address]
+        self._evict()
+
+    def pin(self, address: str) -> None:
+        self._pins[address] = self._pins.get(address, 0) + 1
+
+    def unpin(self, address: str) -> None:
+        pins = self._pins.get(address, 0) - 1
+        if pins > 0:
+            self._pins[address] = pins
+        else:
+            self._pins.pop(address, None)
+            self._evict()
+
+    def _over_budget(self, skipped: int = 0) -> bool:
+        return ((self.max_entries is not None
+                 and len(self._blocks) + skipped > self.max_entries)
+                or (self.max_bytes is not None
+                    and self.size_bytes > self.max_bytes))
+
+    def _evict(self) -> None:
+        skipped = list()
+        while self._blocks and self._over_budget(len(skipped)):
+            address, block = self._blocks.popitem(last=False)
+            if address in self._pins:
+                skipped.append((address, block))
+                continue
+            self.size_bytes -= self._sizes.pop(address)
+            self.evictions += 1
+        # Put the pinned blocks back where they were in the queue
+        for address, block in reversed(skipped):
+            self._blocks[address] = block
+            self._blocks.move_to_end(address, last=False)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {'entries': len(self._blocks), 'bytes': self.size_bytes,
+                'pinned': len(self._pins), 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+    def __contains__(self, address: str) -> bool:
+        return address in self._blocks
+
+    def __len__(self) -> int:
+        return len(self._blocks)
+
+
+class NegativeCache:
+    """Remembers for a while the addresses that had no data in the ledger.
+
+    Entries expire after their TTL, so that the address is looked up again
+    the next time someone asks for it.
+    """
+
+    def __init__(self, ttl: float = 30, max_entries: int = 100000) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self._expiry = OrderedDict()  # type: OrderedDict[str, float]
+
+    def add(self, address: str, ttl: Optional[float] = None) -> None:
+        self._expiry.pop(address, None)
+        self._expiry[address] = monotonic() + (self.ttl if ttl is None
+                                               else ttl)
+        while len(self._expiry) > self.max_entries:
+            self._expiry.popitem(last=False)
+
+    def discard(self, address: str) -> None:
+        self._expiry.pop(address, None)
+
+    def __contains__(self, address: str) -> bool:
+        expiry = self._expiry.get(address)
+        if expiry is None:
+            return False
+        if expiry <= monotonic():
+            del self._expiry[address]
+            return False
+        self.hits += 1
+        return True
+
+    def __len__(self) -> int:
+        return len(self._expiry)
@@ -0,0 +1,121 @@
+import fcntl
+import json
+import os
+from abc import ABC
+from time import time
+from typing import Any, Dict, Iterable, List, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from carbon.ledger.backends import StorageBackend
+
+
+class Checkpoint:
+    """Frontier of the traversal of a stream.
+
+    The head is the latest block that was processed following the stream
+    and the tail the earliest one reached exploring it backwards. Their
+    positions are relative to the root of the stream. The sample offset is
+    the number of samples processed up to and including the head, and the
+    gaps are the addresses that could not be fetched because of errors.
+    """
+
+    def __init__(self, stream_id: str, head: str, tail: str,
+                 head_position: Optional[int] = None,
+                 tail_position: int = 0, sample_offset: int = 0,
+                 gaps: Iterable[str] = (),
+                 created_at: Optional[float] = None) -> None:
+        self.stream_id = stream_id
+        self.head = head
+        self.tail = tail
+        self.head_position = head_position
+        self.tail_position = tail_position
+        self.sample_offset = sample_offset
+        self.gaps = sorted(gaps)
+        self.created_at = created_at if created_at is not None else time()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'stream_id': self.stream_id, 'head': self.head,
+                'tail': self.tail, 'head_position': self.head_position,
+                'tail_position': self.tail_position,
+                'sample_offset': self.sample_offset, 'gaps': self.gaps,
+                'created_at': self.created_at}
+
+    @staticmethod
+    def from_dict(state: Dict[str, Any]) -> 'Checkpoint':
+        return Checkpoint(**state)
+
+    def same_frontier(self, other: Optional['Checkpoint']) -> bool:
+        if other is None:
+            return False
+        this, that = self.to_dict(), other.to_dict()
+        this.pop('created_at')
+        that.pop('created_at')
+        return this == that
+
+
+class CheckpointStore(ABC):
+    """Stores the latest checkpoint of every stream."""
+
+    def load(self, stream_id: str) -> Optional[Checkpoint]:
+        raise NotImplemented()
+
+    def save(self, checkpoints: Iterable[Checkpoint]) -> None:
+        """Saves the checkpoints of several streams atomically."""
+        raise NotImplemented()
+
+    def close(self) -> None:
+        pass
+
+
+class StateFile(CheckpointStore):
+    """Keeps the checkpoints in a local JSON file.
+
+    The file is rewritten as a whole through a temporary file that replaces
+    it, so a crash never leaves a partially written state behind. Several
+    processes can share the file: saves are serialized with a lock and only
+    replace the checkpoints of the streams being saved.
+    """
+
+    def __init__(self, path: str = 'carbon-ledger.state') -> None:
+        self.path = path
+        self._checkpoints = self._read()
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return dict(())
+        with open(self.path, 'r') as state_file:
+            return json.load(state_file)
+
+    def load(self, stream_id: str) -> Optional[Checkpoint]:
+        state = self._checkpoints.get(stream_id)
+        return Checkpoint.from_dict(state) if state else None
+
+    def save(self, checkpoints: Iterable[Checkpoint]) -> None:
+        with open(f'{self.path}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # Keep the checkpoints saved by other processes meanwhile
+            self._checkpoints = self._read()
+            for checkpoint in checkpoints:
+                self._checkpoints[checkpoint.stream_id] = checkpoint.to_dict()
+            temporary_path = f'{self.path}.tmp'
+            with open(temporary_path, 'w') as state_file:
+                json.dump(self._checkpoints, state_file)
+                state_file.flush()
+                os.fsync(state_file.fileno())
+            os.replace(temporary_path, self.path)
+
+
+class BackendCheckpointStore(CheckpointStore):
+    """Keeps the checkpoints in the storage backend, next to the blocks."""
+
+    def __init__(self, backend: 'StorageBackend') -> None:
+        self._backend = backend
+
+    def load(self, stream_id: str) -> Optional[Checkpoint]:
+        state = self._backend.get_checkpoint(stream_id)
+        return Checkpoint.from_dict(state) if state else None
+
+    def save(self, checkpoints: Iterable[Checkpoint]) -> None:
+        states = [checkpoint.to_dict()
+                  for checkpoint in checkpoints]  # type: List[Dict[str, Any]]
+        self._backend.put_checkpoints(states)
@@ -0,0 +1,262 @@
+import os
+from time import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from carbon.ledger.arrays import SampleBatch, TagDictionary
+from carbon.ledger.segments import (SegmentArchive, SegmentReader,
+                                    SegmentWriter)
+
+
+def deduplicate(batch: SampleBatch) -> SampleBatch:
+    """Drops the samples repeated with the same key, timestamp, value and
+    count.
+
+    Reattachments of a bundle and blocks replayed from the write-ahead log
+    are archived more than once, with the exact same samples. The samples
+    that are kept are sorted by key and timestamp.
+    """
+    if not len(batch):
+        return batch
+    bits = batch.values.view(np.uint64)
+    counts = batch.sample_counts
+    order = np.lexsort((counts, bits, batch.timestamps, batch.tag_ids))
+    tag_ids, timestamps, bits, counts = (batch.tag_ids[order],
+                                         batch.timestamps[order],
+                                         bits[order], counts[order])
+    unique = np.ones(len(order), dtype=bool)
+    unique[1:] = ((tag_ids[1:] != tag_ids[:-1])
+                  | (timestamps[1:] != timestamps[:-1])
+                  | (bits[1:] != bits[:-1])
+                  | (counts[1:] != counts[:-1]))
+    return batch.take(order[unique])
+
+
+def downsample(batch: SampleBatch, interval: int,
+               before: Optional[int] = None) -> SampleBatch:
+    """Replaces the samples of every key by their mean in every interval.
+
+    The mean is timestamped at the start of the interval and counts the
+    samples it stands for. Means that are downsampled again are weighted by
+    their counts, so samples that arrive late for an interval that was
+    already downsampled are merged into its mean as if they had been there
+    from the start. Only the samples before a timestamp are downsampled, if
+    one is given.
+    """
+    old = (np.ones(len(batch), dtype=bool) if before is None
+           else batch.timestamps < before)
+    if not old.any():
+        return batch
+    buckets = batch.timestamps[old] // interval * interval
+    tag_ids = batch.tag_ids[old]
+    values = batch.values[old]
+    weights = batch.sample_counts[old]
+    order = np.lexsort((buckets, tag_ids))
+    buckets, tag_ids, values, weights = (buckets[order], tag_ids[order],
+                                         values[order], weights[order])
+    starts = np.flatnonzero(np.concatenate((
+        [True], (buckets[1:] != buckets[:-1])
+        | (tag_ids[1:] != tag_ids[:-1]))))
+    counts = np.add.reduceat(weights, starts)
+    means = np.add.reduceat(values * weights, starts) / counts
+    recent = ~old
+    return SampleBatch(
+        np.concatenate((buckets[starts], batch.timestamps[recent])),
+        np.concatenate((means, batch.values[recent])),
+        np.concatenate((tag_ids[starts], batch.tag_ids[recent])),
+        batch.dictionary,
+        np.concatenate((counts, batch.sample_counts[recent])))
+
+
+class RetentionPolicy:
+    """How long the samples of a stream are kept, and at which resolution.
+
+    Samples older than the retention are dropped, and samples older than
+    downsample_after are replaced by their mean every downsample_interval.
+    Durations are in seconds, and None keeps samples forever or at their
+    original resolution.
+    """
+
+    def __init__(self, retention: Optional[float] = None,
+                 downsample_after: Optional[float] = None,
+                 downsample_interval: int = 3600) -> None:
+        self.retention = retention
+        self.downsample_after = downsample_after
+        self.downsample_interval = downsample_interval
+
+    def expires_before(self, now: float) -> Optional[int]:
+        return int(now - self.retention) if self.retention else None
+
+    def downsamples_before(self, now: float) -> Optional[int]:
+        if not self.downsample_after:
+            return None
+        # Align with the intervals, so that only complete intervals are
+        # downsampled
+        before = int(now - self.downsample_after)
+        return before // self.downsample_interval * self.downsample_interval
+
+    def apply(self, batch: SampleBatch, now: float) -> SampleBatch:
+        expires_before = self.expires_before(now)
+        if expires_before is not None:
+            batch = batch.between(expires_before, np.iinfo(np.int64).max)
+        downsamples_before = self.downsamples_before(now)
+        if downsamples_before is not None:
+            batch = downsample(batch, self.downsample_interval,
+                               downsamples_before)
+        return batch
+
+
+class Compactor:
+    """Compacts the segments of the archive of a stream.
+
+    The archive writes a small segment every time it's flushed. Once there
+    are enough small segments, they are merged together with the segments
+    whose time range overlaps theirs, duplicates are dropped and the result
+    is written as segments of target_samples samples that cover disjoint time
+    ranges. Reading a time range then opens few segments no matter how often
+    the archive was flushed.
+
+    Segments are also rewritten to apply the retention policy of the stream,
+    and segments that have fully expired are removed. The new segments are
+    written before the old ones are removed, so a crash can only leave
+    duplicates behind, which the next compaction drops.
+    """
+
+    def __init__(self, archive: SegmentArchive,
+                 policy: Optional[RetentionPolicy] = None,
+                 target_samples: int = 1000000,
+                 min_segments: int = 4) -> None:
+        self.archive = archive
+        self.policy = policy or RetentionPolicy()
+        self.target_samples = target_samples
+        self.min_segments = min_segments
+        self.compactions = 0
+        self.merged_segments = 0
+        self.written_segments = 0
+        self.expired_segments = 0
+        self.dropped_samples = 0
+
+    @staticmethod
+    def _describe(path: str) -> Optional[Tuple[int, int, int, Dict[str, Any]]]:
+        try:
+            with SegmentReader(path) as reader:
+                if not len(reader.series):
+                    return None
+                return (reader.first_timestamp, reader.last_timestamp,
+                        len(reader), dict(reader.metadata))
+        except (FileNotFoundError, SegmentReader.CorruptSegment):
+            return None
+
+    def _is_due(self, first: int, last: int, metadata: Dict[str, Any],
+                now: float) -> bool:
+        """Whether the policy would change a segment enough to rewrite it.
+
+        Segments are trimmed once a quarter of their time range has expired,
+        rather than every time the retention moves past their first sample.
+        """
+        expires_before = self.policy.expires_before(now)
+        if expires_before is not None \
+                and expires_before - first >= (last - first) / 4:
+            return True
+        downsamples_before = self.policy.downsamples_before(now)
+        downsampled_before = metadata.get('downsampled_before',
+                                          np.iinfo(np.int64).min)
+        return (downsamples_before is not None
+                and first < downsamples_before
+                and downsampled_before < min(downsamples_before, last + 1))
+
+    def plan(self, now: Optional[float] = None
+             ) -> Tuple[List[str], List[str]]:
+        """Returns the segments that have expired and the ones to merge."""
+        now = now if now is not None else time()
+        expires_before = self.policy.expires_before(now)
+        segments = dict(())  # type: Dict[str, Tuple[int, int, int, Dict]]
+        for path in self.archive.segments():
+            description = self._describe(path)
+            if description is not None:
+                segments[path] = description
+        expired = [path for path, (_, last, _, _) in segments.items()
+                   if expires_before is not None and last < expires_before]
+        for path in expired:
+            del segments[path]
+        small = [path for path, (_, _, count, _) in segments.items()
+                 if count < self.target_samples]
+        selected = set(small if len(small) >= self.min_segments else ())
+        selected.update(path for path, (first, last, _, metadata)
+                        in segments.items()
+                        if self._is_due(first, last, metadata, now))
+        # Merge the segments that overlap the selected ones, until the time
+        # ranges of the merged segments are disjoint from the others
+        while selected:
+            ranges = [segments[path][:2] for path in selected]
+            overlapping = {path for path, (first, last, _, _)
+                           in segments.items() if path not in selected
+                           and any(first <= end and start <= last
+                                   for start, end in ranges)}
+            if not overlapping:
+                break
+            selected |= overlapping
+        if len(selected) == 1:
+            # A single small segment would be rewritten as it is
+            path, = selected
+            if not self._is_due(*segments[path][:2], segments[path][3], now):
+                selected = set()
+        return expired, sorted(selected)
+
+    def compact(self, now: Optional[float] = None) -> Dict[str, int]:
+        """Runs one compaction of the archive and returns what it did."""
+        try:
+            return self._compact(now if now is not None else time())
+        finally:
+            # Even a compaction that failed halfway may have changed them
+            self.archive.invalidate()
+
+    def _compact(self, now: float) -> Dict[str, int]:
+        expired, selected = self.plan(now)
+        for path in expired:
+            os.remove(path)
+        self.expired_segments += len(expired)
+        written = list()  # type: List[str]
+        if selected:
+            dictionary = TagDictionary()
+            batches = list()  # type: List[SampleBatch]
+            blocks = set()  # type: Set[str]
+            for path in selected:
+                with SegmentReader(path) as reader:
+                    batches.extend(reader.read(dictionary=dictionary))
+                    blocks.update(reader.metadata.get('blocks', ()))
+            merged = SampleBatch.concatenate(batches, dictionary)
+            compacted = self.policy.apply(deduplicate(merged), now).sorted()
+            self.dropped_samples += len(merged) - len(compacted)
+            metadata = dict(())  # type: Dict[str, Any]
+            downsamples_before = self.policy.downsamples_before(now)
+            if downsamples_before is not None:
+                metadata['downsampled_before'] = downsamples_before
+            for start in range(0, len(compacted), self.target_samples):
+                chunk = compacted.take(
+                    slice(start, start + self.target_samples))
+                writer = SegmentWriter(
+                    self.archive.segment_path(int(chunk.timestamps[0])),
+                    self.archive.stream_id,
+                    # The blocks of the merged segments are listed once, so
+                    # that the archive keeps skipping them
+                    dict(metadata, blocks=sorted(blocks)) if not start
+                    else metadata)
+                writer.add(chunk)
+                written.append(writer.close())
+            for path in selected:
+                os.remove(path)
+            self.compactions += 1
+            self.merged_segments += len(selected)
+            self.written_segments += len(written)
+        return {'expired': len(expired), 'merged': len(selected),
+                'written': len(written)}
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {'compactions': self.compactions,
+                'merged_segments': self.merged_segments,
+                'written_segments': self.written_segments,
+                'expired_segments': self.expired_segments,
+                'dropped_samples': self.dropped_samples}
@@ -1,16 +1,33 @@
 from abc import ABC
+from asyncio import Future, as_completed, ensure_future, gather, shield
+from datetime import datetime
 from enum import Enum
 from logging import Logger
-from typing import Any, Dict, Iterable, Iterator, Optional, Type, TYPE_CHECKING
+from time import monotonic
+from typing import (Any, AsyncIterator, Dict, Iterable, Iterator, List,
+                    Optional, Set, Tuple, Type, Union)
 
+import numpy as np
+from iota import Address
 from iota.api import Iota
-from iota.commands.extended.utils import find_transaction_objects
 
+from carbon.ledger.arrays import SampleBatch, TagDictionary, time_bounds
+from carbon.ledger.backends import StorageBackend
+from carbon.ledger.cache import BlockCache, NegativeCache
+from carbon.ledger.checkpoints import Checkpoint
 from carbon.ledger.data import Packet
-from carbon.ledger.protocols import ProtocolParser
-
-if TYPE_CHECKING:
-    from iota import Transaction
+from carbon.ledger.index import TimeIndex
+from carbon.ledger.nodes import NodePool
+from carbon.ledger.polling import PollingInterval
+from carbon.ledger.prefetch import ReadAheadWindow
+from carbon.ledger.protocols import ProtocolParser, datetime_to_epoch
+from carbon.ledger.rollups import RollupStore
+from carbon.ledger.scheduler import Priority
+from carbon.ledger.segments import SegmentArchive
+from carbon.ledger.trytes import (MessageAssembler, TransactionBatch,
+                                  TryteDecoder)
+from carbon.ledger.verification import DigestVerifier
+from carbon.ledger.wal import WriteAheadLog
 
 
 class Network(str, Enum):
@@ -18,7 +35,15 @@ class Network(str, Enum):
 
 
 class Block:
-    """Represents a block that contains one or more data packets."""
+    """Represents a block that contains one or more data packets.
+
+    The raw samples of the block are kept in `data['samples']` and shared with
+    its packets, which are parsed lazily. Once every packet has been parsed
+    the raw samples can be released with release_raw.
+    """
+
+    __slots__ = ('address', 'next_link', 'previous_link', 'data', 'metadata',
+                 'samples', 'arrays')
 
     def __init__(self, address: str, next_link: str, previous_link: str,
                  data: Dict[str, Any], metadata: Dict[str, Any]) -> None:
@@ -27,56 +52,376 @@ class Block:
         self.next_link = next_link
         self.previous_link = previous_link
         self.metadata = metadata
-        self.samples = list()
+        self.samples = list()  # type: List[Packet]
+        self.arrays = None  # type: Optional[SampleBatch]
+
+    @property
+    def raw_samples(self) -> List[str]:
+        samples = self.data.get('samples')
+        if samples is None:
+            samples = [str(packet) for packet in self.samples]
+        return samples
+
+    @property
+    def sample_count(self) -> int:
+        samples = self.data.get('samples')
+        return len(samples) if samples is not None else len(self.samples)
+
+    def release_raw(self) -> bool:
+        """Drops the raw samples if the block is fully materialized.
+
+        Returns whether they were released. The packets then serialize
+        themselves from their parsed fields, as they were written.
+        """
+        if not self.samples or not all(packet.parsed
+                                       for packet in self.samples):
+            return False
+        for packet in self.samples:
+            packet.release_raw()
+        self.data.pop('samples', None)
+        return True
 
 
 class LedgerConnector(ABC):
+    class InvalidAddress(Exception):
+        pass
+
+    class NoDataFetched(Exception):
+        pass
+
     def __init__(self, protocol: ProtocolParser):
         self._protocol = protocol
 
+    @property
+    def protocol(self) -> ProtocolParser:
+        return self._protocol
+
     def fetch(self, address: str, log: Logger) -> Block:
         raise NotImplemented()
 
+    def fetch_many(self, addresses: Iterable[str],
+                   log: Logger) -> Dict[str, Block]:
+        """Fetches the blocks of many addresses.
 
-class IOTAConnector(LedgerConnector):
-    class InvalidAddress(Exception):
-        pass
+        Addresses that have no data are left out of the result. Connectors
+        should override this method if the ledger supports bulk requests.
+        """
+        blocks = dict(())  # type: Dict[str, Block]
+        for address in addresses:
+            try:
+                blocks[address] = self.fetch(address, log)
+            except LedgerConnector.NoDataFetched:
+                pass
+        return blocks
 
-    class NoDataFetched(Exception):
+    def fetch_by_tag(self, tag: str, log: Logger) -> Dict[str, Block]:
+        """Fetches all the blocks marked with a tag, indexed by address."""
+        raise NotImplemented()
+
+
+class AsyncLedgerConnector(ABC):
+    """Ledger connector whose I/O does not block the event loop."""
+
+    InvalidAddress = LedgerConnector.InvalidAddress
+    NoDataFetched = LedgerConnector.NoDataFetched
+
+    def __init__(self, protocol: ProtocolParser):
+        self._protocol = protocol
+
+    @property
+    def protocol(self) -> ProtocolParser:
+        return self._protocol
+
+    async def fetch(self, address: str, log: Logger,
+                    priority: Priority = Priority.FOLLOW) -> Block:
+        raise NotImplemented()
+
+    async def fetch_many(self, addresses: Iterable[str], log: Logger,
+                         priority: Priority = Priority.BACKFILL
+                         ) -> Dict[str, Block]:
+        """Same as LedgerConnector.fetch_many but for async connectors."""
+        addresses = list(addresses)
+        results = await gather(*(self.fetch(address, log, priority)
+                                 for address in addresses),
+                               return_exceptions=True)
+        blocks = dict(())  # type: Dict[str, Block]
+        for address, result in zip(addresses, results):
+            if isinstance(result, LedgerConnector.NoDataFetched):
+                continue
+            elif isinstance(result, Exception):
+                raise result
+            blocks[address] = result
+        return blocks
+
+    async def fetch_by_tag(self, tag: str, log: Logger,
+                           priority: Priority = Priority.BACKFILL
+                           ) -> Dict[str, Block]:
+        """Same as LedgerConnector.fetch_by_tag but for async connectors."""
+        raise NotImplemented()
+
+    async def close(self) -> None:
         pass
 
+
+def iota_transactions_to_block(protocol: ProtocolParser, address: str,
+                               transactions: TransactionBatch, log: Logger,
+                               decoder: Optional[TryteDecoder] = None
+                               ) -> Block:
+    """Parses the messages of the transactions of an address as a block."""
+    rows = transactions.group_by_address().get(address[:81])
+    if rows is None:
+        raise IOTAConnector.NoDataFetched()
+    message = (decoder or TryteDecoder()).decode(transactions.fragments,
+                                                 [rows])[0]
+    return protocol.parse_buffer(address=address, buffer=message, log=log)
+
+
+def iota_transactions_to_blocks(protocol: ProtocolParser,
+                                addresses: Optional[Iterable[str]],
+                                transactions: TransactionBatch, log: Logger,
+                                decoder: Optional[TryteDecoder] = None
+                                ) -> Dict[str, Block]:
+    """Splits the transactions of many addresses into one block per address.
+
+    If no addresses are given, all the addresses of the transactions are
+    kept, with their checksum. The messages of all the blocks are decoded at
+    once. Blocks that can not be decoded or parsed are logged and left out
+    of the result.
+    """
+    decoder = decoder or TryteDecoder()
+    # Transactions carry the address without the checksum
+    requested = ({address[:81]: address for address in addresses}
+                 if addresses is not None
+                 else None)
+    grouped = list()  # type: List[Tuple[str, np.ndarray]]
+    for address, rows in transactions.group_by_address().items():
+        if requested is None:
+            # Links in the headers of the blocks include the checksum
+            grouped.append((str(Address(address).with_valid_checksum()),
+                            rows))
+        elif address in requested:
+            grouped.append((requested[address], rows))
+    try:
+        messages = decoder.decode(transactions.fragments,
+                                  [rows for _, rows in grouped])
+    except ValueError:
+        # Decode the blocks one by one to leave out only the invalid ones
+        messages = None
+    blocks = dict(())  # type: Dict[str, Block]
+    for i, (address, rows) in enumerate(grouped):
+        try:
+            message = (messages[i] if messages is not None
+                       else decoder.decode(transactions.fragments,
+                                           [rows])[0])
+            blocks[address] = protocol.parse_buffer(address=address,
+                                                    buffer=message, log=log)
+        except (ProtocolParser.InvalidData, ValueError) as e:
+            log.error(f'Could not parse block with address {address}. '
+                      f'{repr(e)}')
+    return blocks
+
+
+def batches(items: List[Any], batch_size: int) -> Iterator[List[Any]]:
+    for i in range(0, len(items), batch_size):
+        yield items[i:i + batch_size]
+
+
+class IOTAConnector(LedgerConnector):
     def __init__(self, node_address: str = 'https://nodes.thetangle.org',
-                 *args, **kwargs):
+                 *args, batch_size: int = 100, trytes_chunk_size: int = 100,
+                 **kwargs):
         super().__init__(*args,  **kwargs)
         self._iota_api = Iota(node_address)
+        self._batch_size = batch_size
+        self._trytes_chunk_size = trytes_chunk_size
+        self._decoder = TryteDecoder()
+
+    def _get_transactions(self, addresses: Optional[List[str]] = None,
+                          tags: Optional[List[str]] = None
+                          ) -> TransactionBatch:
+        query = dict(())  # type: Dict[str, List[str]]
+        if addresses:
+            # The node expects addresses without the checksum
+            query['addresses'] = [address[:81] for address in addresses]
+        if tags:
+            query['tags'] = [tag.ljust(27, '9') for tag in tags]
+        hashes = self._iota_api.find_transactions(**query)['hashes']
+        # Bound the size of the responses of addresses with long histories
+        return TransactionBatch.concatenate([
+            TransactionBatch([str(trytes) for trytes in
+                              self._iota_api.get_trytes(chunk)['trytes']])
+            for chunk in batches(hashes, self._trytes_chunk_size)])
 
     def fetch(self, address: str, log: Logger) -> Block:
         """Fetches a block from IOTA with an address.
 
         Since IOTA does not support exactly blocks, what is fetched is all the
         transactions of an address which are then sorted based on their
-        timestamps and then concatenated in one block.
+        timestamps and then concatenated in one block. The digest of the block
+        is verified by the streams, see DigestVerifier.
+        """
+        if not address:
+            raise IOTAConnector.InvalidAddress()
+        return iota_transactions_to_block(self._protocol, address,
+                                          self._get_transactions([address]),
+                                          log, self._decoder)
+
+    def fetch_many(self, addresses: Iterable[str],
+                   log: Logger) -> Dict[str, Block]:
+        """Fetches the blocks of many addresses with bulk requests.
+
+        The addresses are looked up in batches, so that one findTransactions
+        and one getTrytes request are sent per batch instead of per address.
+        """
+        addresses = [address for address in addresses if address]
+        blocks = dict(())  # type: Dict[str, Block]
+        for batch in batches(addresses, self._batch_size):
+            transactions = self._get_transactions(batch)
+            blocks.update(iota_transactions_to_blocks(
+                self._protocol, batch, transactions, log, self._decoder))
+        return blocks
+
+    def fetch_by_tag(self, tag: str, log: Logger) -> Dict[str, Block]:
+        """Fetches all the blocks whose transactions carry a tag.
+
+        This requires the publisher of the stream to tag its transactions,
+        since by default they are sent with an empty tag.
+        """
+        return iota_transactions_to_blocks(self._protocol, None,
+                                           self._get_transactions(tags=[tag]),
+                                           log, self._decoder)
+
+
+class AsyncIOTAConnector(AsyncLedgerConnector):
+    """IOTA connector that talks to the node's HTTP API with aiohttp.
+
+    The requests are sent without blocking the event loop so that many
+    streams can be fetched concurrently by the same process, and the raw
+    trytes of the responses are decoded in batches. Connectors should share
+    a single node pool, so that they reuse the same HTTP connections and
+    knowledge about the health of the nodes.
+    """
+
+    HEADERS = {'X-IOTA-API-Version': '1'}
+
+    def __init__(self, node_address: str = 'https://nodes.thetangle.org',
+                 *args, batch_size: int = 100, trytes_chunk_size: int = 100,
+                 node_pool: Optional[NodePool] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._batch_size = batch_size
+        self._trytes_chunk_size = trytes_chunk_size
+        self._owns_node_pool = node_pool is None
+        self._node_pool = node_pool or NodePool([node_address])
+        # Decoding and parsing a response never yields to the event loop, so
+        # the buffer of the decoder is never shared by two responses
+        self._decoder = TryteDecoder()
+
+    async def _request(self, command: str, priority: Priority,
+                       **params: Any) -> Dict[str, Any]:
+        return await self._node_pool.request(
+            command, headers=AsyncIOTAConnector.HEADERS, priority=priority,
+            owner=self, **params)
+
+    async def _find_transactions(
+        self, addresses: Optional[List[str]] = None,
+        tags: Optional[List[str]] = None,
+        priority: Priority = Priority.FOLLOW
+    ) -> List[str]:
+        query = dict(())  # type: Dict[str, List[str]]
+        if addresses:
+            # The node expects addresses without the checksum
+            query['addresses'] = [address[:81] for address in addresses]
+        if tags:
+            query['tags'] = [tag.ljust(27, '9') for tag in tags]
+        response = await self._request('findTransactions', priority, **query)
+        return response.get('hashes') or []
+
+    async def _iter_transactions(
+        self, hashes: List[str], priority: Priority = Priority.FOLLOW
+    ) -> AsyncIterator[TransactionBatch]:
+        """Fetches transactions in chunks and yields them as they arrive.
 
-        TODO: Add digest checks.
+        The chunks are requested concurrently, so addresses with long
+        histories don't produce a single huge response, and every chunk is
+        packed into a batch as soon as it arrives.
         """
-        def get_transactions(address: str) -> Iterable['Transaction']:
-            adapter = self._iota_api.adapter
-            return find_transaction_objects(adapter, addresses=[address])
+        chunks = [ensure_future(self._request('getTrytes', priority,
+                                              hashes=chunk))
+                  for chunk in batches(hashes, self._trytes_chunk_size)]
+        try:
+            for chunk in as_completed(chunks):
+                response = await chunk
+                yield TransactionBatch(response.get('trytes') or [])
+        finally:
+            for chunk in chunks:
+                chunk.cancel()
+
+    async def _get_transactions(
+        self, addresses: Optional[List[str]] = None,
+        tags: Optional[List[str]] = None,
+        priority: Priority = Priority.FOLLOW
+    ) -> TransactionBatch:
+        hashes = await self._find_transactions(addresses, tags, priority)
+        return TransactionBatch.concatenate(
+            [transactions async for transactions in
+             self._iter_transactions(hashes, priority)])
 
-        def get_signature_string(t: 'Transaction') -> str:
-            return t.signature_message_fragment.as_string()
+    async def fetch(self, address: str, log: Logger,
+                    priority: Priority = Priority.FOLLOW) -> Block:
+        """Fetches a block from IOTA with an address without blocking.
 
+        The message of the block is parsed while the rest of its
+        transactions are still being fetched.
+        """
         if not address:
-            raise IOTAConnector.InvalidAddress()
-        transactions = sorted(get_transactions(address),
-                              key=lambda t: t.current_index)
-        if not transactions:
-            raise IOTAConnector.NoDataFetched()
-        raw_data = ''.join(map(get_signature_string, transactions))
-        block = self._protocol.parse_headers(address=address,
-                                             raw_data=raw_data,
-                                             log=log)
-        return block
+            raise AsyncIOTAConnector.InvalidAddress()
+        hashes = await self._find_transactions([address], priority=priority)
+        if not hashes:
+            raise AsyncIOTAConnector.NoDataFetched()
+        assembler = MessageAssembler()
+
+        async def fragments() -> AsyncIterator[str]:
+            async for transactions in self._iter_transactions(hashes,
+                                                              priority):
+                yield assembler.add(transactions)
+            yield assembler.finish()
+
+        return await self._protocol.parse_async_fragments(
+            address=address, fragments=fragments(), log=log)
+
+    async def fetch_many(self, addresses: Iterable[str], log: Logger,
+                         priority: Priority = Priority.BACKFILL
+                         ) -> Dict[str, Block]:
+        """Fetches the blocks of many addresses with bulk requests.
+
+        All the batches of addresses are requested concurrently.
+        """
+        addresses = [address for address in addresses if address]
+        batch_list = list(batches(addresses, self._batch_size))
+        transaction_batches = await gather(*(
+            self._get_transactions(batch, priority=priority)
+            for batch in batch_list))
+        blocks = dict(())  # type: Dict[str, Block]
+        for batch, transactions in zip(batch_list, transaction_batches):
+            blocks.update(iota_transactions_to_blocks(
+                self._protocol, batch, transactions, log, self._decoder))
+        return blocks
+
+    async def fetch_by_tag(self, tag: str, log: Logger,
+                           priority: Priority = Priority.BACKFILL
+                           ) -> Dict[str, Block]:
+        """Fetches all the blocks whose transactions carry a tag."""
+        transactions = await self._get_transactions(tags=[tag],
+                                                    priority=priority)
+        return iota_transactions_to_blocks(self._protocol, None,
+                                           transactions, log, self._decoder)
+
+    async def close(self) -> None:
+        if self._owns_node_pool:
+            await self._node_pool.close()
+
+
+AnyLedgerConnector = Union[LedgerConnector, AsyncLedgerConnector]
 
 
 class Stream(Iterable):
@@ -89,12 +434,12 @@ class Stream(Iterable):
     """
 
     class LazyIterator:
-        def __init__(self, stream: 'Stream',
-                     reverse_order: bool = False) -> None:
+        def __init__(self, stream: 'Stream', reverse_order: bool = False,
+                     start_address: Optional[str] = None) -> None:
             self._stream = stream
-            self._next_address = (stream.latest_address
-                                  if reverse_order
-                                  else stream.root_address)
+            self._next_address = start_address or (stream.latest_address
+                                                   if reverse_order
+                                                   else stream.root_address)
             self._reversed = reverse_order
 
         def __next__(self) -> Block:
@@ -102,83 +447,690 @@ class Stream(Iterable):
                 raise StopIteration()
 
             # Return the block immediately if it's already fetched
-            block = self._stream._address_index.get(self._next_address)
+            block = self._stream._get(self._next_address)
             if not block:
                 # Try to fetch the block from the ledger
                 self._stream._fetch(self._next_address, not self._reversed)
 
             # Check again if block has been fetched
-            block = self._stream._address_index.get(self._next_address)
+            block = self._stream._get(self._next_address)
             if not block:
                 raise StopIteration()
 
             self._next_address = (block.previous_link
                                   if self._reversed
                                   else block.next_link)
+            self._stream._advance(block, forward=not self._reversed)
             return block
 
         def __iter__(self):
             return self
 
+    class AsyncLazyIterator:
+        """Same as the LazyIterator but for streams with async connectors.
+
+        When the stream has a read-ahead window, the iterator keeps walking
+        the chain in a background task while the consumer processes the
+        blocks it has already received. Consumers that may stop before the
+        end of the stream must close the iterator, or use it as an async
+        context manager, so that the task stops and the blocks it kept in
+        the cache for them are released.
+        """
+
+        def __init__(self, stream: 'Stream', reverse_order: bool = False,
+                     start_address: Optional[str] = None) -> None:
+            self._stream = stream
+            self._next_address = start_address or (stream.latest_address
+                                                   if reverse_order
+                                                   else stream.root_address)
+            self._reversed = reverse_order
+            self._window = (ReadAheadWindow(stream.window_size)
+                            if stream.window_size
+                            else None)  # type: Optional[ReadAheadWindow]
+            self._consumed = 0
+            self._read_address = self._next_address
+            self._read_count = 0
+            self._read_ahead_task = None  # type: Optional[Future]
+            self._pinned = set()  # type: Set[str]
+
+        def _link(self, block: Block) -> str:
+            return block.previous_link if self._reversed else block.next_link
+
+        async def _timed_fetch(self, address: str) -> Optional[Block]:
+            start = monotonic()
+            block = await self._stream._async_fetch(address,
+                                                    not self._reversed)
+            if self._window and block:
+                self._window.record_fetch(monotonic() - start)
+            return block
+
+        async def _get_block(self, address: str) -> Optional[Block]:
+            block = self._stream._get(address)
+            if block:
+                return block
+            return await self._timed_fetch(address)
+
+        async def _read_ahead(self) -> None:
+            while (self._read_address
+                   and self._read_count - self._consumed < self._window.size):
+                position = self._read_count
+                block = await self._get_block(self._read_address)
+                if not block:
+                    # End of the stream for now, the consumer will retry
+                    return
+                if position != self._read_count:
+                    # The consumer overtook the read-ahead task meanwhile
+                    continue
+                if position >= self._consumed:
+                    # Keep the block in the cache until it's consumed
+                    self._stream._cache.pin(block.address)
+                    self._pinned.add(block.address)
+                self._read_address = self._link(block)
+                self._read_count += 1
+
+        def _schedule_read_ahead(self) -> None:
+            if self._read_count < self._consumed:
+                # The consumer overtook the read-ahead task
+                self._read_address = self._next_address
+                self._read_count = self._consumed
+            if self._read_ahead_task and not self._read_ahead_task.done():
+                return
+            self._read_ahead_task = ensure_future(self._read_ahead())
+
+        async def __anext__(self) -> Block:
+            if self._window:
+                self._window.record_request()
+            if not self._next_address:
+                raise StopAsyncIteration()
+
+            block = await self._get_block(self._next_address)
+            if not block:
+                raise StopAsyncIteration()
+
+            if block.address in self._pinned:
+                self._pinned.remove(block.address)
+                self._stream._cache.unpin(block.address)
+            self._next_address = self._link(block)
+            self._consumed += 1
+            self._stream._advance(block, forward=not self._reversed)
+            if self._window:
+                self._schedule_read_ahead()
+                self._window.record_handout()
+            return block
+
+        def __aiter__(self) -> 'Stream.AsyncLazyIterator':
+            return self
+
+        def _release(self) -> None:
+            for address in self._pinned:
+                self._stream._cache.unpin(address)
+            self._pinned = set()
+
+        async def aclose(self) -> None:
+            """Stops reading ahead and ends the iteration."""
+            self._next_address = None
+            task, self._read_ahead_task = self._read_ahead_task, None
+            if task is not None and not task.done():
+                task.cancel()
+                await gather(task, return_exceptions=True)
+            self._release()
+
+        async def __aenter__(self) -> 'Stream.AsyncLazyIterator':
+            return self
+
+        async def __aexit__(self, *exc_info: Any) -> None:
+            await self.aclose()
+
+        def __del__(self) -> None:
+            # The read-ahead task holds the iterator until it's done, so only
+            # the pins can be left behind
+            self._release()
+
     class LazyDataIterator:
         def __init__(self, stream: 'Stream',
                      reverse_order: bool = False) -> None:
+            self._stream = stream
             self._iter = reversed(stream) if reverse_order else iter(stream)
             self._reversed = reverse_order
-            self._data_iter = None  # type: Optional[Iterator[Packet]]
+            self._block = None  # type: Optional[Block]
+            self._data_iter = iter(())  # type: Iterator[Packet]
 
         def __next__(self) -> Packet:
-            for block in self._iter:
-                if self._reversed:
-                    for packet in reversed(block.data):
-                        yield packet
-                else:
-                    for packet in block.data:
-                        yield packet
+            while True:
+                packet = next(self._data_iter, None)
+                if packet is not None:
+                    return packet
+                if self._block is not None:
+                    # Every packet of the block has been handed out
+                    self._block.release_raw()
+                # Raises StopIteration at the end of the stream
+                self._block = next(self._iter)
+                packets = self._stream._block_packets(self._block)
+                self._data_iter = iter(reversed(packets) if self._reversed
+                                       else packets)
 
         def __iter__(self) -> Iterator[Packet]:
             return self
 
-    def __init__(self, ledger_connector: LedgerConnector, root_address: str,
-                 logger: Logger) -> None:
+    def __init__(self, ledger_connector: AnyLedgerConnector,
+                 root_address: str, logger: Logger,
+                 window_size: Optional[int] = None,
+                 backend: Optional[StorageBackend] = None,
+                 cache: Optional[BlockCache] = None,
+                 polling: Optional[PollingInterval] = None,
+                 verifier: Optional[DigestVerifier] = None,
+                 public_key: Optional[str] = None,
+                 archive: Optional[SegmentArchive] = None,
+                 wal: Optional[WriteAheadLog] = None,
+                 rollups: Optional[RollupStore] = None) -> None:
         self._connector = ledger_connector
         self.root_address = root_address
+        # Blocks fetched from the ledger are only verified if the key of the
+        # publisher of the stream is known
+        self.public_key = public_key
+        self._verifier = verifier
+        # Samples of the blocks fetched from the ledger are archived in
+        # segments and rolled up if an archive and a rollup store are given
+        self.archive = archive
+        self.rollups = rollups
+        # Blocks fetched asynchronously from the ledger are logged before
+        # they are stored
+        self._wal = wal
+        # Frontier of the traversal: the latest block processed following the
+        # stream and the earliest one reached exploring it backwards
         self.latest_address = root_address
-        self._address_index = dict(())  # type: Dict[str, Block]
+        self.earliest_address = root_address
+        self.processed_samples = 0
+        self._head_position = None  # type: Optional[int]
+        self._tail_position = 0
+        self.gaps = set()  # type: Set[str]
+        # Whether the stream has reached its tail once, after which following
+        # it is live work rather than catching up
+        self.caught_up = False
+        self.window_size = window_size
+        self._backend = backend
+        self._cache = cache if cache is not None else BlockCache()
+        self._in_flight = dict(())  # type: Dict[str, Future]
+        self._negative_cache = NegativeCache()
+        self.polling = polling or PollingInterval()
+        self.tag_dictionary = TagDictionary()
+        self.index = TimeIndex(root_address)
         self._logger = logger
 
+    @property
+    def stream_id(self) -> str:
+        return self.root_address
+
+    def _get(self, address: str) -> Optional[Block]:
+        """Returns a block of the stream if it has already been fetched."""
+        block = self._cache.get(address)
+        if block is None and self._backend is not None:
+            block = self._backend.get(address)
+            if block is not None:
+                self._cache.put(block)
+                self._index(block)
+        return block
+
+    def _index(self, block: Block) -> None:
+        if block.address in self.index:
+            return
+        self.index.add(*self._index_entry(block))
+
+    @staticmethod
+    def _index_entry(block: Block) -> Tuple[str, str, str, int, int, int]:
+        samples = block.raw_samples
+        try:
+            first, last = time_bounds(samples)
+        except ValueError:
+            # Keep the block in the chain but out of every time range
+            first, last = TimeIndex.NO_TIMESTAMPS
+        return (block.address, block.next_link, block.previous_link,
+                first, last, len(samples))
+
+    def _rebuild_index(self) -> None:
+        """Indexes the blocks of the stream that are already stored.
+
+        The blocks are added following their links from the root and from
+        the frontier of the stream, so that each one is linked to the
+        previous one as soon as it's added.
+        """
+        entries = {entry[0]: entry for entry in map(
+            self._index_entry, self._backend.blocks(self.stream_id))}
+        if not entries:
+            return
+        for start in (self.root_address, self.latest_address,
+                      self.earliest_address):
+            first = entries.pop(start, None)
+            if first is None:
+                continue
+            self.index.add(*first)
+            # Walk forwards along the next links, then backwards along the
+            # previous ones
+            for link in (1, 2):
+                address = first[link]
+                while address in entries:
+                    entry = entries.pop(address)
+                    self.index.add(*entry)
+                    address = entry[link]
+        # Blocks that are not linked to the frontier, after a gap
+        for entry in entries.values():
+            self.index.add(*entry)
+        self._logger.info(f'Indexed {len(self.index)} stored blocks of '
+                          f'stream with root address {self.root_address}')
+
+    def _store(self, block: Block) -> None:
+        if block.address == self.root_address:
+            self._cache.pin(block.address)
+        self._cache.put(block)
+        self._index(block)
+        if self._backend is not None:
+            self._backend.put(block, self.stream_id)
+        if self.archive is not None or self.rollups is not None:
+            batch = self._block_arrays(block)
+            if batch is None:
+                return
+            if self.archive is not None:
+                self.archive.add(batch, block.address)
+            if self.rollups is not None:
+                self.rollups.add(self.stream_id, block.address, batch)
+
+    async def _store_durably(self, blocks: List[Block]) -> None:
+        """Stores blocks fetched from the ledger once they are logged.
+
+        Without a write-ahead log they are stored right away.
+        """
+        if self._wal is None or not blocks:
+            for block in blocks:
+                self._store(block)
+            return
+        positions = [self._wal.append(self.stream_id, block)
+                     for block in blocks]
+        await self._wal.commit(positions[-1])
+        for block, position in zip(blocks, positions):
+            self._store(block)
+            self._wal.applied(position)
+
+    def replay(self, block: Block) -> None:
+        """Stores a block replayed from the write-ahead log."""
+        self._store(block)
+
+    def _advance(self, block: Block, forward: bool) -> None:
+        """Moves the frontier of the stream past a block handed out."""
+        position = self.index.position(block.address)
+        if position is None:
+            return
+        if forward and (self._head_position is None
+                        or position > self._head_position):
+            self._head_position = position
+            self.latest_address = block.address
+            self.processed_samples += block.sample_count
+        elif not forward and position < self._tail_position:
+            self._tail_position = position
+            self.earliest_address = block.address
+
+    def checkpoint(self) -> Checkpoint:
+        return Checkpoint(self.stream_id, head=self.latest_address,
+                          tail=self.earliest_address,
+                          head_position=self._head_position,
+                          tail_position=self._tail_position,
+                          sample_offset=self.processed_samples,
+                          gaps=self.gaps)
+
+    def restore(self, checkpoint: Checkpoint) -> None:
+        """Resumes the traversal of the stream from a checkpoint.
+
+        Following the stream continues from its head and exploring it
+        backwards from its tail, instead of walking it again from the root.
+        The blocks stored before are indexed again, so that they can be
+        queried right away.
+        """
+        self.latest_address = checkpoint.head
+        self.earliest_address = checkpoint.tail
+        self._head_position = checkpoint.head_position
+        self._tail_position = checkpoint.tail_position
+        self.processed_samples = checkpoint.sample_offset
+        self.gaps = set(checkpoint.gaps)
+        if checkpoint.head_position is not None:
+            self.index.anchor(checkpoint.head, checkpoint.head_position)
+        self.index.anchor(checkpoint.tail, checkpoint.tail_position)
+        if self._backend is not None:
+            self._rebuild_index()
+
+    async def _verify(self, block: Block) -> bool:
+        """Whether a block fetched from the ledger can be stored."""
+        if self._verifier is None or not self.public_key:
+            return True
+        valid = await self._verifier.verify(block, self.public_key)
+        if not valid:
+            self._logger.error(f'Invalid digest for block with address '
+                               f'{block.address}. Dropping it.')
+        return valid
+
+    async def _verify_many(self, blocks: Dict[str, Block]
+                           ) -> Dict[str, Block]:
+        addresses = list(blocks)
+        valid = await gather(*(self._verify(blocks[address])
+                               for address in addresses))
+        return {address: blocks[address]
+                for address, is_valid in zip(addresses, valid) if is_valid}
+
+    async def fill_gaps(self) -> int:
+        """Fetches again the blocks that could not be fetched before."""
+        if not self.gaps:
+            return 0
+        blocks = await self._verify_many(await self._connector.fetch_many(
+            sorted(self.gaps), self._logger))
+        await self._store_durably(list(blocks.values()))
+        for block in blocks.values():
+            self.gaps.discard(block.address)
+        return len(blocks)
+
     def _fetch(self, address: str, latest: bool = False) -> None:
         """Fetch a block from the ledger and update the state of the stream."""
         try:
             # Fetch block from the ledger
-            self._address_index[address] = self._connector.fetch(address,
-                                                                 self._logger)
+            block = self._connector.fetch(address, self._logger)
+            # Synchronous streams can't wait for the write-ahead log to be
+            # synced, so their blocks are not logged
+            self._store(block)
             # Add block to the registry
+            self.gaps.discard(address)
             self._logger.info(f'Fetched block with address {address}')
+        except LedgerConnector.NoDataFetched:
+            self._logger.debug(f'No block found at address {address}')
         except Exception as e:
+            self.gaps.add(address)
             self._logger.error(
                 msg=f'Could not fetch block with address {address}. {repr(e)}')
             return
 
+    async def _async_fetch(self, address: str,
+                           latest: bool = False) -> Optional[Block]:
+        """Same as _fetch but for async connectors.
+
+        Concurrent fetches of the same address, for example from a forward
+        and a backward iterator, share a single request to the ledger.
+        Addresses that were recently found empty are not requested again
+        until the next poll of the tail.
+        """
+        if address in self._negative_cache:
+            return None
+        in_flight = self._in_flight.get(address)
+        if in_flight is None:
+            in_flight = ensure_future(self._fetch_from_ledger(address,
+                                                              latest))
+            self._in_flight[address] = in_flight
+            in_flight.add_done_callback(
+                lambda _: self._in_flight.pop(address, None))
+        # A cancelled waiter must not cancel the fetch for the other ones
+        return await shield(in_flight)
+
+    async def _fetch_from_ledger(self, address: str,
+                                 latest: bool = False) -> Optional[Block]:
+        priority = (Priority.FOLLOW if latest and self.caught_up
+                    else Priority.BACKFILL)
+        try:
+            block = await self._connector.fetch(address, self._logger,
+                                                priority)
+            if not await self._verify(block):
+                # The block will not be verified again before the next poll
+                self._negative_cache.add(address, 0.9 * self.polling.interval)
+                return None
+            await self._store_durably([block])
+            self.gaps.discard(address)
+            self._logger.info(f'Fetched block with address {address}')
+            return block
+        except LedgerConnector.NoDataFetched:
+            if latest:
+                self.caught_up = True
+            # Expire a bit before the next poll so that it's not skipped
+            self._negative_cache.add(address, 0.9 * self.polling.interval)
+            self._logger.debug(f'No block found at address {address}')
+            return None
+        except Exception as e:
+            self.gaps.add(address)
+            self._logger.error(
+                msg=f'Could not fetch block with address {address}. {repr(e)}')
+            return None
+
+    async def backfill(self, addresses: Iterable[str] = (),
+                       tag: Optional[str] = None) -> int:
+        """Fetches blocks of the stream with bulk queries.
+
+        Instead of walking the stream one block at a time, candidate blocks
+        are fetched all at once by the tag of their transactions and/or by a
+        set of known addresses. They are then linked locally, starting from
+        the root of the stream, using the links in their headers. Candidates
+        that are not connected to the root are dropped. Returns the number of
+        new blocks that were stored.
+        """
+        candidates = dict(())  # type: Dict[str, Block]
+        if tag:
+            candidates.update(await self._connector.fetch_by_tag(
+                tag, self._logger))
+        missing = [address for address in addresses
+                   if address not in candidates and self._get(address) is None]
+        if missing:
+            candidates.update(await self._connector.fetch_many(
+                missing, self._logger))
+
+        new_blocks = list()  # type: List[Block]
+        visited = set()  # type: Set[str]
+
+        def walk(address: str, forward: bool) -> None:
+            while address and address not in visited:
+                visited.add(address)
+                block = candidates.get(address) or self._get(address)
+                if not block:
+                    return
+                if address in candidates:
+                    new_blocks.append(block)
+                address = block.next_link if forward else block.previous_link
+
+        root = candidates.get(self.root_address) or self._get(
+            self.root_address)
+        walk(self.root_address, forward=True)
+        if root:
+            walk(root.previous_link, forward=False)
+        # Only the blocks of the stream are verified, other publishers could
+        # use the same tag
+        verified = await self._verify_many({block.address: block
+                                            for block in new_blocks})
+        new_blocks = [block for block in new_blocks
+                      if block.address in verified]
+        await self._store_durably(new_blocks)
+        self._logger.info(f'Backfilled {len(new_blocks)} blocks out of '
+                          f'{len(candidates)} candidates for stream with '
+                          f'root address {self.root_address}')
+        return len(new_blocks)
+
     def __iter__(self) -> Iterator[Block]:
         return Stream.LazyIterator(self)
 
     def __reversed__(self):
         return Stream.LazyIterator(self, reverse_order=True)
 
+    def __aiter__(self) -> 'Stream.AsyncLazyIterator':
+        return Stream.AsyncLazyIterator(self)
+
+    def async_reversed(self, start_address: Optional[str] = None
+                       ) -> 'Stream.AsyncLazyIterator':
+        return Stream.AsyncLazyIterator(self, reverse_order=True,
+                                        start_address=start_address)
+
+    def follow(self) -> 'Stream.AsyncLazyIterator':
+        """Iterates over the stream from its head onwards."""
+        return Stream.AsyncLazyIterator(self,
+                                        start_address=self.latest_address)
+
     def __len__(self) -> int:
-        return len(self._address_index)
+        """Number of blocks that can be accessed by position."""
+        return len(self.index)
+
+    def _load(self, address: str) -> Block:
+        """Returns a block, fetching it again if it's no longer stored."""
+        block = self._get(address)
+        if block is None and isinstance(self._connector, LedgerConnector):
+            self._fetch(address)
+            block = self._get(address)
+        if block is None:
+            raise LedgerConnector.NoDataFetched(address)
+        return block
+
+    async def _async_load(self, address: str) -> Block:
+        block = self._get(address) or await self._async_fetch(address)
+        if block is None:
+            raise LedgerConnector.NoDataFetched(address)
+        return block
+
+    def __getitem__(self, item: Union[int, slice]
+                    ) -> Union[Block, List[Block]]:
+        """Returns blocks by their position among the indexed blocks.
+
+        Positions start from the earliest block of the stream that has been
+        fetched so far.
+        """
+        if isinstance(item, slice):
+            return [self._load(self.index.address_at(i))
+                    for i in range(*item.indices(len(self.index)))]
+        return self._load(self.index.address_at(item))
+
+    def sample(self, i: int) -> Packet:
+        """Returns the i-th sample among the indexed blocks."""
+        address, offset = self.index.locate_sample(i)
+        return self._block_packets(self._load(address))[offset]
+
+    @staticmethod
+    def _epoch(t: Union[datetime, int, float]) -> int:
+        return datetime_to_epoch(t) if isinstance(t, datetime) else int(t)
+
+    def range(self, start: Union[datetime, int, float],
+              end: Union[datetime, int, float]) -> Iterator[Block]:
+        """Iterates over the blocks with samples in [start, end).
+
+        Only the indexed blocks whose samples overlap the range are loaded.
+        Timestamps are datetimes in UTC or seconds since the epoch.
+        """
+        for address in self.index.addresses_between(self._epoch(start),
+                                                    self._epoch(end)):
+            yield self._load(address)
+
+    async def async_range(self, start: Union[datetime, int, float],
+                          end: Union[datetime, int, float],
+                          fetch: bool = True) -> AsyncIterator[Block]:
+        """Same as range but for streams with async connectors.
+
+        Without fetch, the blocks that are no longer stored are skipped
+        instead of being fetched again from the ledger.
+        """
+        for address in self.index.addresses_between(self._epoch(start),
+                                                    self._epoch(end)):
+            block = (await self._async_load(address) if fetch
+                     else self._get(address))
+            if block is not None:
+                yield block
 
-    def __getitem__(self, item: int):
-        # TODO: Fix me
-        return self._blocks[item]
+    async def async_range_batches(self, start: Union[datetime, int, float],
+                                  end: Union[datetime, int, float],
+                                  fetch: bool = True
+                                  ) -> AsyncIterator[SampleBatch]:
+        """Iterates over the samples in [start, end), one batch per block."""
+        start, end = self._epoch(start), self._epoch(end)
+        async for block in self.async_range(start, end, fetch):
+            batch = self._block_arrays(block)
+            if batch is not None:
+                yield batch.between(start, end)
+
+    async def async_latest(self, keys: Optional[Iterable[str]] = None,
+                           max_blocks: int = 100,
+                           fetch: bool = True) -> SampleBatch:
+        """Returns the latest sample of every key of the stream.
+
+        The indexed blocks are read from the latest one backwards, until a
+        sample of every given key has been found or max_blocks have been
+        read. Without keys, only the keys of the latest block are returned.
+        Without fetch, the blocks that are no longer stored are skipped.
+        """
+        wanted = (None if keys is None else
+                  {self.tag_dictionary.encode(key) for key in keys})
+        batches = list()  # type: List[SampleBatch]
+        found = set()  # type: Set[int]
+        for i in range(len(self.index) - 1,
+                       max(len(self.index) - 1 - max_blocks, -1), -1):
+            address = self.index.address_at(i)
+            block = (await self._async_load(address) if fetch
+                     else self._get(address))
+            batch = self._block_arrays(block) if block is not None else None
+            if batch is None or not len(batch):
+                continue
+            batches.append(batch)
+            found.update(batch.tag_ids.tolist())
+            if wanted is None or wanted <= found:
+                break
+        latest = SampleBatch.concatenate(batches, self.tag_dictionary)
+        if wanted is not None:
+            latest = latest.take(np.isin(latest.tag_ids, list(wanted)))
+        return latest.latest()
 
     @property
     def data(self) -> Iterator[Packet]:
         return Stream.LazyDataIterator(self, reverse_order=False)
 
+    def _block_packets(self, block: Block) -> List[Packet]:
+        """Returns the packets of a block, creating them if needed."""
+        if not block.samples and block.data.get('samples'):
+            self._connector.protocol.parse_data(block, self._logger,
+                                                self.tag_dictionary)
+        return block.samples
+
+    def _block_arrays(self, block: Block) -> Optional[SampleBatch]:
+        """Returns the samples of a block in columnar form.
+
+        The arrays are parsed once and kept with the block, encoded with the
+        tag dictionary of the stream.
+        """
+        if (block.arrays is None
+                or block.arrays.dictionary is not self.tag_dictionary):
+            try:
+                block.arrays = self._connector.protocol.parse_arrays(
+                    block, self.tag_dictionary, self._logger)
+            except ProtocolParser.InvalidData:
+                return None
+            if block.address in self._cache:
+                # Account for the memory used by the arrays
+                self._cache.put(block)
+        return block.arrays
+
+    def batches(self, reverse_order: bool = False) -> Iterator[SampleBatch]:
+        """Iterates over the samples of the stream, one batch per block."""
+        for block in reversed(self) if reverse_order else iter(self):
+            batch = self._block_arrays(block)
+            if batch is not None:
+                yield batch
+
+    async def async_batches(
+            self, reverse_order: bool = False) -> AsyncIterator[SampleBatch]:
+        """Same as batches but for streams with async connectors."""
+        blocks = self.async_reversed() if reverse_order else self.__aiter__()
+        async with blocks:
+            async for block in blocks:
+                batch = self._block_arrays(block)
+                if batch is not None:
+                    yield batch
+
+    def to_arrays(self) -> SampleBatch:
+        """Returns all the samples of the stream in a single batch."""
+        return SampleBatch.concatenate(self.batches(), self.tag_dictionary)
+
+    async def async_to_arrays(self) -> SampleBatch:
+        return SampleBatch.concatenate(
+            [batch async for batch in self.async_batches()],
+            self.tag_dictionary)
+
 
-def get_connector(ledger: str) -> Type[LedgerConnector]:
+def get_connector(
+    ledger: str, asynchronous: bool = False
+) -> Union[Type[LedgerConnector], Type[AsyncLedgerConnector]]:
     network = Network[ledger.upper()]
     if network == Network.IOTA:
-        return IOTAConnector
+        return AsyncIOTAConnector if asynchronous else IOTAConnector
@@ -1,55 +1,178 @@
+import json
+import re
+from calendar import timegm
 from datetime import datetime
-from typing import Any, List, Optional, TYPE_CHECKING
+from typing import (Any, Callable, List, Optional, Sequence, Tuple,
+                    TYPE_CHECKING)
+
+from carbon.ledger.protocols import epoch_to_datetime
 
 if TYPE_CHECKING:
+    from carbon.ledger.arrays import TagDictionary
     from carbon.ledger.connectors import Block
 
+JSON_NUMBER = re.compile(r'-?(0|[1-9][0-9]*)(\.[0-9]+)?([eE][+-]?[0-9]+)?')
+
+
+class TagSet:
+    """The metric key and the tags of a sample in Carbon 2.0 format.
+
+    The Hermes clients encode them as `key;tag=value;...;meta.tag=value`.
+    Tags prefixed with `meta.` are the meta tags of Metrics 2.0, all the
+    others are intrinsic tags. Tag sets are immutable, so that samples of the
+    same series can share a single instance.
+    """
+
+    __slots__ = ('raw', 'key', 'tags', 'meta', '_metrics_20')
+
+    META_PREFIX = 'meta.'
+
+    def __init__(self, raw: str, key: str, tags: Tuple[Tuple[str, str], ...],
+                 meta: Tuple[Tuple[str, str], ...]) -> None:
+        self.raw = raw
+        self.key = key
+        self.tags = tags
+        self.meta = meta
+        self._metrics_20 = None  # type: Optional[str]
+
+    @staticmethod
+    def parse(raw: str,
+              intern: Callable[[str], str] = lambda s: s) -> 'TagSet':
+        fields = raw.split(';')
+        tags = list()  # type: List[Tuple[str, str]]
+        meta = list()  # type: List[Tuple[str, str]]
+        for field in fields[1:]:
+            name, _, value = field.partition('=')
+            if name.startswith(TagSet.META_PREFIX):
+                meta.append((intern(name[len(TagSet.META_PREFIX):]),
+                             intern(value)))
+            else:
+                tags.append((intern(name), intern(value)))
+        return TagSet(raw, intern(fields[0]), tuple(tags), tuple(meta))
+
+    @staticmethod
+    def from_parts(key: str, other_tags: Sequence[str]) -> 'TagSet':
+        return TagSet.parse(';'.join([key] + list(other_tags)))
+
+    @property
+    def other_tags(self) -> List[str]:
+        return self.raw.split(';')[1:]
+
+    @property
+    def metrics_20(self) -> str:
+        """The tags as the members of a Metrics 2.0 JSON object.
+
+        The metric key becomes the `what` tag, unless the sample already has
+        one. It's rendered once per tag set.
+        """
+        if self._metrics_20 is None:
+            tags = dict(self.tags)
+            tags.setdefault('what', self.key)
+            tags['meta'] = dict(self.meta)
+            self._metrics_20 = json.dumps(tags)[1:-1]
+        return self._metrics_20
+
+    def __eq__(self, other: Any) -> bool:
+        return self is other or (isinstance(other, TagSet)
+                                 and self.raw == other.raw)
+
+    def __hash__(self) -> int:
+        return hash(self.raw)
+
+    def __str__(self) -> str:
+        return self.raw
+
+    def __repr__(self) -> str:
+        return f'TagSet({self.raw!r})'
+
 
 class Packet:
     """Represents a data sample.
 
     The encoding of the data sample is done using the Carbon 2.0 protocol.
-    TODO: Add Carbon2.0 stuff here
+    Packets created from a raw sample only keep a reference to it, the fields
+    are parsed the first time one of them is accessed. Packets created with
+    the tag dictionary of their stream share its tag sets. Once parsed, they
+    keep the timestamp as it was written, so that the raw sample can be
+    released and serialized again as it was.
     """
 
+    __slots__ = ('_raw', '_tag_set', '_timestamp', '_raw_timestamp', '_data',
+                 '_block', '_dictionary')
+
     class InvalidPacket(Exception):
         pass
 
     def __init__(self, raw: Optional[str] = '', tag: Optional[str] = '', other_tags: Optional[List[str]] = '',
                  timestamp: Optional[datetime] = '', data: Optional[Any] = None, block: Optional['Block'] = None,
-                 ) -> None:
-        self._tag = tag
-        self._tags = other_tags
-        self._raw = ''
-        self._timestamp = timestamp
+                 dictionary: Optional['TagDictionary'] = None) -> None:
+        if not raw and (not tag or not timestamp or not data):
+            raise Packet.InvalidPacket()
+        self._raw = raw or None
+        self._tag_set = (TagSet.from_parts(tag, other_tags or ())
+                         if tag else None)  # type: Optional[TagSet]
+        self._timestamp = timestamp or None
+        self._raw_timestamp = None  # type: Optional[str]
         self._data = data
-        self._raw = raw
         self._block = block
-        if not self._raw and (not self._tag or not self._timestamp or not self._data):
-            raise Packet.InvalidPacket()
+        self._dictionary = dictionary
 
     def _parse_raw(self) -> None:
         if not self._raw:
             raise Packet.InvalidPacket()
-        _tags, self._timestamp, self._data = self._raw.split(' ')
-        split_tags = _tags.split(',')
-        self._tag = split_tags[0]
-        self._tags = split_tags[1:]
+        try:
+            _tags, self._raw_timestamp, self._data = self._raw.split(' ')
+            self._timestamp = epoch_to_datetime(self._raw_timestamp)
+        except ValueError:
+            raise Packet.InvalidPacket()
+        self._tag_set = (self._dictionary.tag_set(_tags)
+                         if self._dictionary is not None
+                         else TagSet.parse(_tags))
 
     def _to_raw(self) -> None:
-        self._raw = f'${self._tag};{self._tags} ${self._timestamp.strftime("%Y-%m-%d %H:%M:%S")} ${self._data}'
+        timestamp = (self._raw_timestamp
+                     or timegm(self._timestamp.utctimetuple()))
+        self._raw = f'{self._tag_set.raw} {timestamp} {self._data}'
+
+    def release_raw(self) -> None:
+        """Parses the packet and drops its reference to the raw sample."""
+        if self._tag_set is None:
+            self._parse_raw()
+        self._raw = None
 
     @property
-    def tag(self) -> str:
-        if not self._tag:
+    def parsed(self) -> bool:
+        return self._tag_set is not None
+
+    @property
+    def tag_set(self) -> TagSet:
+        if self._tag_set is None:
             self._parse_raw()
-        return self._tag
+        return self._tag_set
+
+    @property
+    def tag(self) -> str:
+        return self.tag_set.key
 
     @property
     def tags(self) -> List[str]:
-        if not self._tags:
+        return self.tag_set.other_tags
+
+    @property
+    def timestamp(self) -> datetime:
+        if self._timestamp is None:
             self._parse_raw()
-        return self._tags
+        return self._timestamp
+
+    @property
+    def data(self) -> Any:
+        if self._tag_set is None:
+            self._parse_raw()
+        return self._data
+
+    @property
+    def block(self) -> Optional['Block']:
+        return self._block
 
     @staticmethod
     def from_raw(raw: str) -> 'Packet':
@@ -64,4 +187,14 @@ class Packet:
         return self.__str__()
 
     def __metrics_20__(self) -> str:
-        raise NotImplemented()
+        """Serializes the packet as a Metrics 2.0 JSON object.
+
+        The tags are rendered once per tag set and numeric values are copied
+        as they are, so only the timestamp is formatted for every packet.
+        """
+        value = str(self.data)
+        if not JSON_NUMBER.fullmatch(value):
+            value = json.dumps(value)
+        return (f'{{{self.tag_set.metrics_20}, '
+                f'"time": {timegm(self.timestamp.utctimetuple())}, '
+                f'"value": {value}}}')
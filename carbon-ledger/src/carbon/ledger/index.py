@@ -0,0 +1,195 @@
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+
+class TimeIndex:
+    """Index of the blocks of a stream by position and by time.
+
+    The position of a block is its distance from the root of the stream and
+    is derived from the links of the blocks as they are added, so blocks can
+    be added in any order. Blocks that are not linked yet to an indexed block
+    are kept aside until they are, up to max_pending of them, the oldest
+    ones being dropped first. Blocks whose position is already taken, like
+    the ones of a fork, are not indexed. For every block the index keeps the first
+    and last timestamps of its samples and the offset of its first sample,
+    so that positions, samples and time ranges are all found with a binary
+    search instead of walking the stream.
+    """
+
+    # Bounds of blocks without valid timestamps, that match no time range
+    NO_TIMESTAMPS = (np.iinfo(np.int64).max, np.iinfo(np.int64).min)
+
+    class Entry:
+        __slots__ = ('address', 'next_link', 'previous_link',
+                     'first_timestamp', 'last_timestamp', 'count')
+
+        def __init__(self, address: str, next_link: str, previous_link: str,
+                     first_timestamp: int, last_timestamp: int,
+                     count: int) -> None:
+            self.address = address
+            self.next_link = next_link
+            self.previous_link = previous_link
+            self.first_timestamp = first_timestamp
+            self.last_timestamp = last_timestamp
+            self.count = count
+
+    def __init__(self, root_address: str, max_pending: int = 10000) -> None:
+        # Positions of the indexed blocks and of the addresses they link to
+        self._positions = {root_address: 0}  # type: Dict[str, int]
+        self._entries = dict(())  # type: Dict[int, TimeIndex.Entry]
+        self._indexed = set()  # type: Set[str]
+        # Blocks not linked yet, from the oldest, and the addresses of the
+        # ones waiting for every link
+        self._pending = dict(())  # type: Dict[str, TimeIndex.Entry]
+        self._waiting = dict(())  # type: Dict[str, List[str]]
+        self.max_pending = max_pending
+        # Positions, timestamps and sample counts of the indexed blocks, and
+        # the positions indexed since, which are merged on the next lookup
+        self._arrays = TimeIndex._with_bounds(*TimeIndex._to_arrays([], []))
+        self._added = list()  # type: List[int]
+
+    def add(self, address: str, next_link: str, previous_link: str,
+            first_timestamp: int, last_timestamp: int, count: int) -> None:
+        if address in self._indexed or address in self._pending:
+            return
+        entry = TimeIndex.Entry(address, next_link, previous_link,
+                                first_timestamp, last_timestamp, count)
+        self._pending[address] = entry
+        for link in (next_link, previous_link):
+            if link:
+                self._waiting.setdefault(link, list()).append(address)
+        self._link_pending([address])
+        if len(self._pending) > self.max_pending:
+            self._drop(next(iter(self._pending)))
+
+    def anchor(self, address: str, position: int) -> None:
+        """Records the known position of an address before it's indexed."""
+        self._positions.setdefault(address, position)
+        self._link_pending([address])
+
+    def position(self, address: str) -> Optional[int]:
+        """Position of an indexed block relative to the root."""
+        if address not in self._indexed:
+            return None
+        return self._positions[address]
+
+    def _position_of(self, entry: 'TimeIndex.Entry') -> Optional[int]:
+        position = self._positions.get(entry.address)
+        if position is None and entry.previous_link in self._indexed:
+            position = self._positions[entry.previous_link] + 1
+        if position is None and entry.next_link in self._indexed:
+            position = self._positions[entry.next_link] - 1
+        return position
+
+    def _drop(self, address: str) -> None:
+        entry = self._pending.pop(address)
+        for link in (entry.next_link, entry.previous_link):
+            waiting = self._waiting.get(link)
+            if waiting is not None and address in waiting:
+                waiting.remove(address)
+                if not waiting:
+                    del self._waiting[link]
+
+    def _link_pending(self, addresses: Iterable[str]) -> None:
+        """Indexes the pending blocks at some addresses, if they can be
+        positioned, and then the pending blocks linked to them."""
+        queue = deque(addresses)  # type: Deque[str]
+        while queue:
+            address = queue.popleft()
+            entry = self._pending.get(address)
+            if entry is None:
+                continue
+            position = self._position_of(entry)
+            if position is None:
+                continue
+            self._drop(address)
+            if position in self._entries:
+                # Another block is already indexed at the same position
+                continue
+            self._entries[position] = entry
+            self._indexed.add(address)
+            self._positions[address] = position
+            if entry.next_link:
+                self._positions.setdefault(entry.next_link, position + 1)
+            if entry.previous_link:
+                self._positions.setdefault(entry.previous_link,
+                                           position - 1)
+            self._added.append(position)
+            # The blocks this one links to, and the ones linking to it, can
+            # be positioned now
+            queue.extend((entry.next_link, entry.previous_link))
+            queue.extend(self._waiting.pop(address, ()))
+
+    @staticmethod
+    def _to_arrays(positions: List[int], entries: List['TimeIndex.Entry']
+                   ) -> Tuple[np.ndarray, ...]:
+        return (np.array(positions, dtype=np.int64),
+                np.array([entry.first_timestamp for entry in entries],
+                         dtype=np.int64),
+                np.array([entry.last_timestamp for entry in entries],
+                         dtype=np.int64),
+                np.array([entry.count for entry in entries], dtype=np.int64))
+
+    @staticmethod
+    def _with_bounds(positions: np.ndarray, first: np.ndarray,
+                     last: np.ndarray, counts: np.ndarray
+                     ) -> Tuple[np.ndarray, ...]:
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        # Bounds that are monotonic even if the timestamps of the blocks are
+        # not, so that they can be searched
+        latest_so_far = np.maximum.accumulate(last)
+        earliest_after = np.minimum.accumulate(first[::-1])[::-1]
+        return (positions, first, last, counts, offsets, latest_so_far,
+                earliest_after)
+
+    def _build(self) -> Tuple[np.ndarray, ...]:
+        if self._added:
+            added = sorted(self._added)
+            self._added = list()
+            columns = TimeIndex._to_arrays(
+                added, [self._entries[position] for position in added])
+            # Blocks are mostly added at the ends, where inserting them
+            # amounts to appending them
+            at = np.searchsorted(self._arrays[0], columns[0])
+            self._arrays = TimeIndex._with_bounds(*(
+                np.insert(array, at, column)
+                for array, column in zip(self._arrays[:4], columns)))
+        return self._arrays
+
+    def _address(self, i: int) -> str:
+        positions = self._build()[0]
+        return self._entries[int(positions[i])].address
+
+    def address_at(self, i: int) -> str:
+        """Address of the i-th indexed block, from the earliest one."""
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+        return self._address(i)
+
+    def locate_sample(self, i: int) -> Tuple[str, int]:
+        """Address of the block of the i-th indexed sample and its offset."""
+        offsets = self._build()[4]
+        if not 0 <= i < offsets[-1]:
+            raise IndexError(i)
+        block = int(np.searchsorted(offsets, i, side='right')) - 1
+        return self._address(block), i - int(offsets[block])
+
+    def addresses_between(self, start: int, end: int) -> List[str]:
+        """Addresses of the blocks with samples in [start, end), in order."""
+        _, first, last, _, _, latest_so_far, earliest_after = self._build()
+        low = int(np.searchsorted(latest_so_far, start, side='left'))
+        high = int(np.searchsorted(earliest_after, end, side='left'))
+        return [self._address(i) for i in range(low, high)
+                if first[i] < end and last[i] >= start]
+
+    @property
+    def sample_count(self) -> int:
+        return int(self._build()[4][-1])
+
+    def __contains__(self, address: str) -> bool:
+        return address in self._indexed
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,218 @@
+from asyncio import FIRST_COMPLETED, CancelledError, ensure_future, wait
+from collections import deque
+from time import monotonic
+from typing import Any, Deque, Dict, List, Optional
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+from carbon.ledger.scheduler import Priority, RateLimiter, Scheduler
+
+
+class Node:
+    """Health information about one node of a pool."""
+
+    def __init__(self, url: str, window: int = 100,
+                 smoothing: float = 0.2,
+                 rate_limit: Optional[float] = None) -> None:
+        self.url = url
+        self.rate_limiter = (RateLimiter(rate_limit) if rate_limit
+                             else None)  # type: Optional[RateLimiter]
+        self.latency = None  # type: Optional[float]
+        self.failures = 0
+        self.down_until = 0.0
+        self._latencies = deque(maxlen=window)  # type: Deque[float]
+        self._smoothing = smoothing
+
+    def record_success(self, latency: float) -> None:
+        self._latencies.append(latency)
+        self.latency = (latency if self.latency is None
+                        else ((1 - self._smoothing) * self.latency
+                              + self._smoothing * latency))
+        self.failures = 0
+
+    def record_failure(self, cooldown: float) -> None:
+        self.failures += 1
+        if self.failures >= 3:
+            # Back off exponentially up to ~8.5 hours for a 30s cooldown
+            backoff = 2 ** min(self.failures - 3, 10)
+            self.down_until = monotonic() + cooldown * backoff
+
+    def quantile(self, q: float) -> Optional[float]:
+        if len(self._latencies) < 20:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    @property
+    def available(self) -> bool:
+        return self.down_until <= monotonic()
+
+    @property
+    def score(self) -> float:
+        """The lower the better. Unknown nodes are tried early."""
+        latency = self.latency if self.latency is not None else 0.0
+        return latency * (1 + self.failures)
+
+
+class NodePool:
+    """Pool of ledger nodes shared by all the connectors of the process.
+
+    Requests go to the healthiest node, based on its recent latency and
+    failures, over keep-alive HTTP connections. If a node fails the request
+    is retried on the next one, and nodes that keep failing are put aside for
+    a while. With hedging enabled, a second request is sent to another node
+    when the first one takes longer than the p95 latency of its node, and
+    whichever answers first wins. The second request takes its own slot of
+    the scheduler and its own token of the rate limit of its node.
+
+    Requests can be limited per node to a number of requests per second, and
+    a scheduler can bound the number of concurrent requests of the whole
+    process, serving the requests by priority.
+    """
+
+    class NodeError(Exception):
+        pass
+
+    class NoNodeAvailable(Exception):
+        pass
+
+    def __init__(self, urls: List[str], timeout: float = 30,
+                 max_connections: int = 100, hedge: bool = True,
+                 hedge_quantile: float = 0.95, max_attempts: int = 3,
+                 cooldown: float = 30, rate_limit: Optional[float] = None,
+                 scheduler: Optional[Scheduler] = None) -> None:
+        if not urls:
+            raise NodePool.NoNodeAvailable()
+        self.nodes = [Node(url, rate_limit=rate_limit) for url in urls]
+        self.scheduler = scheduler
+        self._timeout = timeout
+        self._max_connections = max_connections
+        self._hedge = hedge
+        self._hedge_quantile = hedge_quantile
+        self._max_attempts = max_attempts
+        self._cooldown = cooldown
+        self._session = None  # type: Optional[ClientSession]
+
+    def _get_session(self) -> ClientSession:
+        # The session must be created from within a running event loop
+        if self._session is None or self._session.closed:
+            self._session = ClientSession(
+                connector=TCPConnector(limit=self._max_connections),
+                timeout=ClientTimeout(total=self._timeout))
+        return self._session
+
+    def _ranked_nodes(self) -> List[Node]:
+        nodes = sorted(self.nodes, key=lambda n: n.score)
+        available = [node for node in nodes if node.available]
+        # If every node is down, try them anyway instead of giving up
+        return available or nodes
+
+    async def _send(self, node: Node, payload: Dict[str, Any],
+                    headers: Dict[str, str]) -> Dict:
+        if node.rate_limiter is not None:
+            await node.rate_limiter.acquire()
+        start = monotonic()
+        try:
+            async with self._get_session().post(
+                    node.url, json=payload, headers=headers) as response:
+                body = await response.json(content_type=None)
+            if (response.status != 200
+                    or 'error' in body or 'exception' in body):
+                raise NodePool.NodeError(
+                    f'{response.status} response from {node.url} for '
+                    f'{payload.get("command")}: '
+                    f'{body.get("error") or body.get("exception") or body}')
+        except CancelledError:
+            # Hedged requests that lost the race are not the node's fault
+            raise
+        except Exception:
+            node.record_failure(self._cooldown)
+            raise
+        node.record_success(monotonic() - start)
+        return body
+
+    async def _send_scheduled(self, node: Node, payload: Dict[str, Any],
+                              headers: Dict[str, str], priority: Priority,
+                              owner: Any) -> Dict:
+        """Sends a request in a slot of its own of the scheduler."""
+        if self.scheduler is None:
+            return await self._send(node, payload, headers)
+        await self.scheduler.acquire(priority, owner)
+        try:
+            return await self._send(node, payload, headers)
+        finally:
+            self.scheduler.release(priority)
+
+    async def _send_hedged(self, node: Node, backup: Optional[Node],
+                           payload: Dict[str, Any], headers: Dict[str, str],
+                           priority: Priority, owner: Any) -> Dict:
+        delay = node.quantile(self._hedge_quantile)
+        if not self._hedge or backup is None or delay is None:
+            return await self._send(node, payload, headers)
+        tasks = {ensure_future(self._send(node, payload, headers))}
+        done, _ = await wait(tasks, timeout=delay)
+        if not done:
+            # The second request counts against the concurrency budget too
+            tasks.add(ensure_future(self._send_scheduled(
+                backup, payload, headers, priority, owner)))
+        try:
+            while tasks:
+                done, tasks = await wait(tasks, return_when=FIRST_COMPLETED)
+                for task in done:
+                    if not task.exception():
+                        return task.result()
+            # Both requests failed
+            raise done.pop().exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def request(self, command: str,
+                      headers: Optional[Dict[str, str]] = None,
+                      priority: Priority = Priority.FOLLOW,
+                      owner: Any = None, **params: Any) -> Dict[str, Any]:
+        """Sends an API command to the best node, failing over if needed.
+
+        With a scheduler, the request first waits for a slot of its priority.
+        The owner is whoever the request is sent for, usually a connector, so
+        that the scheduler can serve the owners in turn.
+        """
+        if self.scheduler is None:
+            return await self._request(command, headers, priority, owner,
+                                       **params)
+        await self.scheduler.acquire(priority, owner)
+        try:
+            return await self._request(command, headers, priority, owner,
+                                       **params)
+        finally:
+            self.scheduler.release(priority)
+
+    async def _request(self, command: str,
+                       headers: Optional[Dict[str, str]] = None,
+                       priority: Priority = Priority.FOLLOW,
+                       owner: Any = None, **params: Any) -> Dict[str, Any]:
+        payload = dict(params, command=command)
+        headers = headers or {}
+        nodes = self._ranked_nodes()[:self._max_attempts]
+        error = None  # type: Optional[Exception]
+        for i, node in enumerate(nodes):
+            backup = nodes[i + 1] if i + 1 < len(nodes) else None
+            try:
+                return await self._send_hedged(node, backup, payload,
+                                               headers, priority, owner)
+            except CancelledError:
+                raise
+            except Exception as e:
+                error = e
+        raise error
+
+    @property
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {node.url: {'latency': node.latency,
+                           'failures': node.failures,
+                           'available': node.available}
+                for node in self.nodes}
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
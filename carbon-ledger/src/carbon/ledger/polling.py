@@ -0,0 +1,56 @@
+from time import monotonic
+from typing import Optional
+
+
+class PollingInterval:
+    """Adapts how often the tail of a stream is polled for new blocks.
+
+    The interval is derived from how often new blocks appear at the tail of
+    the stream, so that the tail is polled a few times per publishing period.
+    Every poll that finds nothing beyond the expected ones makes the interval
+    grow exponentially, so idle streams end up being polled rarely.
+    """
+
+    def __init__(self, min_interval: float = 5, max_interval: float = 600,
+                 polls_per_period: int = 4, backoff: float = 2,
+                 smoothing: float = 0.3) -> None:
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._polls_per_period = polls_per_period
+        self._backoff = backoff
+        self._smoothing = smoothing
+        self._period = None  # type: Optional[float]
+        self._last_block_at = None  # type: Optional[float]
+        self._misses = 0
+
+    def record_block(self) -> None:
+        """Records that a new block was found at the tail of the stream."""
+        now = monotonic()
+        if self._last_block_at is not None:
+            period = now - self._last_block_at
+            self._period = (period if self._period is None
+                            else ((1 - self._smoothing) * self._period
+                                  + self._smoothing * period))
+        self._last_block_at = now
+        self._misses = 0
+
+    def record_miss(self) -> None:
+        """Records that the tail of the stream had no new block."""
+        self._misses += 1
+
+    @property
+    def period(self) -> Optional[float]:
+        """Estimated time between two blocks of the stream."""
+        return self._period
+
+    @property
+    def interval(self) -> float:
+        if self._period is None:
+            base, patience = self.min_interval, 0
+        else:
+            base = self._period / self._polls_per_period
+            patience = self._polls_per_period
+        # The exponent is capped to avoid overflows on long idle streams
+        exponent = min(max(0, self._misses - patience), 64)
+        interval = base * self._backoff ** exponent
+        return max(self.min_interval, min(self.max_interval, interval))
@@ -0,0 +1,55 @@
+from math import ceil
+from time import monotonic
+from typing import Optional
+
+
+class ReadAheadWindow:
+    """Decides how many blocks a stream iterator should fetch in advance.
+
+    Blocks of a stream form a linked list, so the address of block N+1 is only
+    known once block N has been fetched. The read-ahead can therefore not fire
+    all the requests at once, but it can keep walking the chain while the
+    consumer is busy with the blocks it already has. The size of the window is
+    the number of blocks the consumer would go through during one fetch,
+    based on exponentially weighted averages of both, capped by the maximum
+    size given by the user.
+    """
+
+    def __init__(self, max_size: int, min_size: int = 1,
+                 smoothing: float = 0.2) -> None:
+        self.max_size = max(max_size, min_size)
+        self.min_size = min_size
+        self._smoothing = smoothing
+        self._fetch_latency = None  # type: Optional[float]
+        self._consume_time = None  # type: Optional[float]
+        self._handed_out_at = None  # type: Optional[float]
+
+    def _average(self, average: Optional[float], sample: float) -> float:
+        if average is None:
+            return sample
+        return (1 - self._smoothing) * average + self._smoothing * sample
+
+    def record_fetch(self, latency: float) -> None:
+        """Records how long a fetch from the ledger took."""
+        self._fetch_latency = self._average(self._fetch_latency, latency)
+
+    def record_handout(self) -> None:
+        """Marks that a block has just been handed to the consumer."""
+        self._handed_out_at = monotonic()
+
+    def record_request(self) -> None:
+        """Marks that the consumer asks for the next block."""
+        if self._handed_out_at is None:
+            return
+        self._consume_time = self._average(self._consume_time,
+                                           monotonic() - self._handed_out_at)
+        self._handed_out_at = None
+
+    @property
+    def size(self) -> int:
+        if self._fetch_latency is None:
+            return self.min_size
+        if not self._consume_time:
+            return self.max_size
+        size = ceil(self._fetch_latency / self._consume_time) + 1
+        return max(self.min_size, min(self.max_size, size))
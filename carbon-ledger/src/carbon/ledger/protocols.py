@@ -1,10 +1,14 @@
+import hashlib
 from abc import ABC
+from calendar import timegm
 from datetime import datetime
 from enum import Enum
 from logging import Logger
-from typing import List, Type, TYPE_CHECKING
+from typing import (AsyncIterable, Iterable, List, Optional, Type,
+                    TYPE_CHECKING)
 
 if TYPE_CHECKING:
+    from carbon.ledger.arrays import SampleBatch, TagDictionary
     from carbon.ledger.data import Packet
     from carbon.ledger.ledgers import Block
 
@@ -20,6 +24,10 @@ def epoch_to_datetime(ts):
         return datetime.utcfromtimestamp(int(ts)/1000)
 
 
+def datetime_to_epoch(dt):
+    return timegm(dt.utctimetuple())
+
+
 def datetime_to_string(dt):
     return dt.strftime('%Y-%m-%d %H:%M:%S')
 
@@ -32,38 +40,192 @@ class ProtocolParser(ABC):
     def parse_headers(address: str, raw_data: str, log: Logger) -> 'Block':
         raise NotImplemented()
 
+    @classmethod
+    def parse_fragments(cls, address: str, fragments: Iterable[str],
+                        log: Logger) -> 'Block':
+        """Parses a block whose raw data arrive in consecutive pieces.
+
+        Parsers that can process the pieces incrementally should override
+        this method instead of joining them.
+        """
+        return cls.parse_headers(address=address, raw_data=''.join(fragments),
+                                 log=log)
+
+    @classmethod
+    async def parse_async_fragments(cls, address: str,
+                                    fragments: AsyncIterable[str],
+                                    log: Logger) -> 'Block':
+        """Same as parse_fragments, for pieces that arrive asynchronously."""
+        return cls.parse_fragments(
+            address=address, fragments=[fragment async for fragment in
+                                        fragments], log=log)
+
+    @classmethod
+    def parse_buffer(cls, address: str, buffer: memoryview,
+                     log: Logger) -> 'Block':
+        """Parses a block from the UTF-8 encoded bytes of its raw data.
+
+        The buffer is only read, so it can be a view into a larger one.
+        """
+        return cls.parse_fragments(address=address,
+                                   fragments=(str(buffer, 'utf-8'),), log=log)
+
+    @staticmethod
+    def parse_data(block: 'Block', log: Logger,
+                   dictionary: Optional['TagDictionary'] = None
+                   ) -> List['Packet']:
+        raise NotImplemented()
+
     @staticmethod
-    def parse_data(block: 'Block', log: Logger) -> List['Packet']:
+    def parse_arrays(block: 'Block', dictionary: 'TagDictionary',
+                     log: Logger) -> 'SampleBatch':
+        """Parses the samples of a block into columnar arrays."""
         raise NotImplemented()
 
 
 class HermesPlaintextParser(ProtocolParser):
+    class StreamingParser:
+        """Splits the raw data of a block into its fields incrementally.
+
+        The data can be fed in pieces of any size. Fields, or separators,
+        that are split across two pieces are stitched back together, and
+        every sample is returned as soon as it's complete. The data signed by
+        the publisher, everything after the digest, is hashed on the way.
+        """
+
+        SEPARATOR = '::'
+        HEADER_FIELDS = 3
+        DIGEST_PREFIX = 'digest:'
+
+        def __init__(self) -> None:
+            self.header = list()  # type: List[str]
+            self._pending = ''
+            self._unsigned = ''
+            self._signed = False
+            self._checksum = hashlib.sha256()
+
+        def _hash(self, data: str) -> None:
+            if not self._signed:
+                # Skip the digest and the separator that follows it
+                self._unsigned += data
+                end = self._unsigned.find(self.SEPARATOR)
+                if end < 0:
+                    return
+                data = self._unsigned[end + len(self.SEPARATOR):]
+                self._unsigned = ''
+                self._signed = True
+            self._checksum.update(data.encode())
+
+        def _consume(self, fields: List[str]) -> List[str]:
+            missing = self.HEADER_FIELDS - len(self.header)
+            if missing > 0:
+                self.header.extend(fields[:missing])
+                return fields[missing:]
+            return fields
+
+        def feed(self, data: str) -> List[str]:
+            """Consumes a piece of data and returns the completed samples."""
+            self._hash(data)
+            if self._pending:
+                data = self._pending + data
+            fields = data.split(self.SEPARATOR)
+            self._pending = fields.pop()
+            return self._consume(fields)
+
+        def close(self) -> List[str]:
+            """Returns the last sample, if the data did not end with one."""
+            pending, self._pending = self._pending, ''
+            return self._consume([pending]) if pending else []
+
+        @staticmethod
+        def _strip(field: str, prefix: str) -> str:
+            return field[len(prefix):] if field.startswith(prefix) else field
+
+        @property
+        def digest(self) -> Optional[str]:
+            return self.header[0] if self.header else None
+
+        @property
+        def checksum(self) -> Optional[str]:
+            """SHA-256 of the signed data, if the block has a digest."""
+            if not self.digest or \
+                    not self.digest.startswith(self.DIGEST_PREFIX):
+                return None
+            return self._checksum.hexdigest()
+
+        @property
+        def next_link(self) -> Optional[str]:
+            if len(self.header) < 2:
+                return None
+            return self._strip(self.header[1], 'next_address:')
+
+        @property
+        def previous_link(self) -> Optional[str]:
+            if len(self.header) < 3:
+                return None
+            return self._strip(self.header[2], 'previous_address:')
+
     @staticmethod
     def parse_headers(address: str, raw_data: str, log: Logger) -> 'Block':
+        return HermesPlaintextParser.parse_fragments(address, (raw_data,),
+                                                     log)
+
+    @classmethod
+    def parse_fragments(cls, address: str, fragments: Iterable[str],
+                        log: Logger) -> 'Block':
+        parser = cls.StreamingParser()
+        samples = list()  # type: List[str]
+        for fragment in fragments:
+            samples.extend(parser.feed(fragment))
+        return cls._to_block(address, parser, samples, log)
+
+    @classmethod
+    async def parse_async_fragments(cls, address: str,
+                                    fragments: AsyncIterable[str],
+                                    log: Logger) -> 'Block':
+        # Samples are split as soon as every piece arrives
+        parser = cls.StreamingParser()
+        samples = list()  # type: List[str]
+        async for fragment in fragments:
+            samples.extend(parser.feed(fragment))
+        return cls._to_block(address, parser, samples, log)
+
+    @staticmethod
+    def _to_block(address: str,
+                  parser: 'HermesPlaintextParser.StreamingParser',
+                  samples: List[str], log: Logger) -> 'Block':
         from carbon.ledger.connectors import Block
-        fields = (raw_data
-                  .replace('next_address:', '')
-                  .replace('previous_address:', '')
-                  .split('::'))  # type: List[str]
+        samples.extend(parser.close())
         log.debug(f'Header of block with address {address} '
-                  f'is : {"::".join(fields[:3])}')
-        if len(fields) < 4:
+                  f'is : {"::".join(parser.header)}')
+        if len(parser.header) < parser.HEADER_FIELDS or not samples:
             raise ProtocolParser.InvalidData()
         return Block(address=address,
-                     next_link=fields[1],
-                     previous_link=fields[2],
-                     data={'samples': fields[3:]},
-                     metadata={'digest': fields[0]})
+                     next_link=parser.next_link,
+                     previous_link=parser.previous_link,
+                     data={'samples': samples},
+                     metadata={'digest': parser.digest,
+                               'checksum': parser.checksum})
 
     @staticmethod
-    def parse_data(block: 'Block', log: Logger) -> None:
+    def parse_data(block: 'Block', log: Logger,
+                   dictionary: Optional['TagDictionary'] = None) -> None:
         from carbon.ledger.data import Packet
-        for sample in block.data['samples']:
-            tags, timestamp, data = sample.split(' ')
-            tags = tags.split(';')
-            block.samples.append(Packet(sample, tags[0], tags[1:],
-                                        epoch_to_datetime(timestamp),
-                                        data, block))
+        # The packets share the raw samples of the block and parse them lazily
+        block.samples.extend(Packet(sample, block=block,
+                                    dictionary=dictionary)
+                             for sample in block.raw_samples)
+
+    @staticmethod
+    def parse_arrays(block: 'Block', dictionary: 'TagDictionary',
+                     log: Logger) -> 'SampleBatch':
+        from carbon.ledger.arrays import parse_samples
+        try:
+            return parse_samples(block.raw_samples, dictionary)
+        except ValueError as e:
+            log.error(f'Could not parse the samples of block with address '
+                      f'{block.address}. {repr(e)}')
+            raise ProtocolParser.InvalidData()
 
 
 def get_protocol_parser(protocol_id: str) -> Type[ProtocolParser]:
@@ -0,0 +1,307 @@
+import sqlite3
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from carbon.ledger.arrays import SampleBatch
+from carbon.ledger.backends import checkpoint
+
+# Minute, hour and day
+RESOLUTIONS = (60, 3600, 86400)
+
+# Stream id, resolution, key and start of a bucket
+BucketKey = Tuple[str, int, str, int]
+
+
+class Aggregates:
+    """Count, sum, minimum and maximum of the samples of many buckets.
+
+    Every bucket is identified by its key and the timestamp of its start.
+    """
+
+    def __init__(self, keys: List[str], timestamps: np.ndarray,
+                 count: np.ndarray, total: np.ndarray, minimum: np.ndarray,
+                 maximum: np.ndarray, interval: int) -> None:
+        self.keys = keys
+        self.timestamps = timestamps
+        self.count = count
+        self.sum = total
+        self.min = minimum
+        self.max = maximum
+        self.interval = interval
+
+    @property
+    def mean(self) -> np.ndarray:
+        return self.sum / self.count
+
+    @staticmethod
+    def from_samples(batch: SampleBatch, interval: int) -> 'Aggregates':
+        """Aggregates samples in buckets of an interval."""
+        if not len(batch):
+            return Aggregates.empty(interval)
+        buckets = batch.timestamps // interval * interval
+        order = np.lexsort((buckets, batch.tag_ids))
+        buckets, tag_ids = buckets[order], batch.tag_ids[order]
+        values = batch.values[order]
+        starts = np.flatnonzero(np.concatenate((
+            [True], (buckets[1:] != buckets[:-1])
+            | (tag_ids[1:] != tag_ids[:-1]))))
+        if batch.counts is None:
+            counts = np.diff(np.append(starts, len(order)))
+            sums = np.add.reduceat(values, starts)
+        else:
+            # Downsampled samples stand for several ones
+            weights = batch.counts[order]
+            counts = np.add.reduceat(weights, starts)
+            sums = np.add.reduceat(values * weights, starts)
+        return Aggregates(
+            [batch.dictionary.decode(tag_id)
+             for tag_id in tag_ids[starts].tolist()],
+            buckets[starts], counts, sums,
+            np.minimum.reduceat(values, starts),
+            np.maximum.reduceat(values, starts), interval)
+
+    @staticmethod
+    def empty(interval: int) -> 'Aggregates':
+        return Aggregates([], np.empty(0, dtype=np.int64),
+                          np.empty(0, dtype=np.int64),
+                          np.empty(0), np.empty(0), np.empty(0), interval)
+
+    @staticmethod
+    def concatenate(aggregates: Sequence['Aggregates'],
+                    interval: int) -> 'Aggregates':
+        """Merges aggregates of an interval, bucket by bucket."""
+        aggregates = [part for part in aggregates if len(part)]
+        if not aggregates:
+            return Aggregates.empty(interval)
+        return Aggregates(
+            [key for part in aggregates for key in part.keys],
+            np.concatenate([part.timestamps for part in aggregates]),
+            np.concatenate([part.count for part in aggregates]),
+            np.concatenate([part.sum for part in aggregates]),
+            np.concatenate([part.min for part in aggregates]),
+            np.concatenate([part.max for part in aggregates]),
+            interval)._merge(interval)
+
+    def rebucket(self, interval: int) -> 'Aggregates':
+        """Merges the buckets into buckets of a longer interval."""
+        if interval == self.interval or not len(self):
+            return Aggregates(self.keys, self.timestamps, self.count,
+                              self.sum, self.min, self.max, interval)
+        return self._merge(interval)
+
+    def _merge(self, interval: int) -> 'Aggregates':
+        """Merges the buckets of every key that start in the same interval.
+        """
+        key_ids = dict(())  # type: Dict[str, int]
+        ids = np.array([key_ids.setdefault(key, len(key_ids))
+                        for key in self.keys])
+        keys = list(key_ids)
+        buckets = self.timestamps // interval * interval
+        order = np.lexsort((buckets, ids))
+        buckets, ids = buckets[order], ids[order]
+        starts = np.flatnonzero(np.concatenate((
+            [True], (buckets[1:] != buckets[:-1]) | (ids[1:] != ids[:-1]))))
+        return Aggregates(
+            [keys[key_id] for key_id in ids[starts].tolist()],
+            buckets[starts], np.add.reduceat(self.count[order], starts),
+            np.add.reduceat(self.sum[order], starts),
+            np.minimum.reduceat(self.min[order], starts),
+            np.maximum.reduceat(self.max[order], starts), interval)
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+
+class RollupStore:
+    """Maintains aggregates of the samples of the streams in SQLite.
+
+    The samples of every block are aggregated per key in buckets of every
+    resolution as the block is stored, and merged with the buckets already
+    kept. Queries over long ranges then read a few buckets instead of the
+    samples. Updates are kept in memory until they are flushed, together
+    with the addresses of the blocks they come from, so that blocks stored
+    again after a restart are not counted twice.
+    """
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS rollups (
+            stream_id TEXT NOT NULL,
+            resolution INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            sum REAL NOT NULL,
+            min REAL NOT NULL,
+            max REAL NOT NULL,
+            PRIMARY KEY (stream_id, resolution, key, bucket)
+        );
+        CREATE TABLE IF NOT EXISTS rolled_up_blocks (
+            address TEXT PRIMARY KEY,
+            stream_id TEXT NOT NULL
+        );
+    '''
+
+    def __init__(self, path: str = 'carbon-ledger-rollups.db',
+                 resolutions: Sequence[int] = RESOLUTIONS,
+                 cache_size: int = 100000) -> None:
+        self.resolutions = sorted(resolutions)
+        self.cache_size = cache_size
+        self._db = sqlite3.connect(path)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(RollupStore.SCHEMA)
+        # Count, sum, min and max of recently updated buckets
+        self._buckets = dict(())  # type: Dict[BucketKey, List[float]]
+        self._dirty = set()  # type: Set[BucketKey]
+        # Buckets that have not changed since they were flushed, least
+        # recently updated first. Only they can be evicted.
+        self._clean = OrderedDict()  # type: OrderedDict[BucketKey, None]
+        self._blocks = dict(())  # type: Dict[str, str]
+        self.updates = 0
+        self.flushes = 0
+        self.skipped_blocks = 0
+
+    def _rolled_up(self, address: str) -> bool:
+        return address in self._blocks or self._db.execute(
+            'SELECT 1 FROM rolled_up_blocks WHERE address = ?',
+            (address,)).fetchone() is not None
+
+    def _bucket(self, key: BucketKey) -> List[float]:
+        """Returns a bucket that is about to be updated."""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            row = self._db.execute(
+                'SELECT count, sum, min, max FROM rollups WHERE stream_id = ? '
+                'AND resolution = ? AND key = ? AND bucket = ?',
+                key).fetchone()
+            bucket = self._buckets[key] = (list(row) if row else
+                                           [0, 0.0, np.inf, -np.inf])
+        else:
+            self._clean.pop(key, None)
+        return bucket
+
+    def add(self, stream_id: str, address: str, batch: SampleBatch) -> bool:
+        """Rolls up the samples of a block, unless it already was.
+
+        Returns whether the block was rolled up.
+        """
+        if self._rolled_up(address):
+            self.skipped_blocks += 1
+            return False
+        self._blocks[address] = stream_id
+        if not len(batch):
+            return True
+        for resolution in self.resolutions:
+            aggregates = Aggregates.from_samples(batch, resolution)
+            for i, (key, timestamp) in enumerate(zip(
+                    aggregates.keys, aggregates.timestamps.tolist())):
+                bucket_key = (stream_id, resolution, key, timestamp)
+                bucket = self._bucket(bucket_key)
+                bucket[0] += int(aggregates.count[i])
+                bucket[1] += float(aggregates.sum[i])
+                bucket[2] = min(bucket[2], float(aggregates.min[i]))
+                bucket[3] = max(bucket[3], float(aggregates.max[i]))
+                self._dirty.add(bucket_key)
+                self.updates += 1
+        self._evict()
+        return True
+
+    def _evict(self) -> None:
+        # Buckets that have changed since the last flush are kept
+        while len(self._buckets) > self.cache_size and self._clean:
+            key, _ = self._clean.popitem(last=False)
+            del self._buckets[key]
+
+    def flush(self, sync: bool = False) -> None:
+        """Persists the updated buckets and the blocks they come from.
+
+        With sync, everything flushed so far is also checkpointed, so that
+        it survives a power failure and not only a crash of the process.
+        """
+        if self._dirty or self._blocks:
+            with self._db:
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO rollups '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    [key + tuple(self._buckets[key]) for key in self._dirty])
+                self._db.executemany(
+                    'INSERT OR IGNORE INTO rolled_up_blocks VALUES (?, ?)',
+                    list(self._blocks.items()))
+            for key in self._dirty:
+                self._clean[key] = None
+            self._dirty = set()
+            self._blocks = dict(())
+            self.flushes += 1
+            self._evict()
+        if sync:
+            checkpoint(self._db)
+
+    def keys(self, stream_id: str) -> Set[str]:
+        """The keys of the samples of a stream that have been rolled up."""
+        keys = {key for key, in self._db.execute(
+            'SELECT DISTINCT key FROM rollups WHERE stream_id = ? '
+            'AND resolution = ?', (stream_id, self.resolutions[0]))}
+        keys.update(key for key_stream_id, _, key, _ in self._buckets
+                    if key_stream_id == stream_id)
+        return keys
+
+    def _resolution_for(self, interval: Optional[int]) -> int:
+        """The coarsest resolution whose buckets fit exactly in an interval.
+        """
+        if interval is None:
+            return self.resolutions[0]
+        fitting = [resolution for resolution in self.resolutions
+                   if interval % resolution == 0]
+        return fitting[-1] if fitting else self.resolutions[0]
+
+    def query(self, stream_id: str, start: int, end: int,
+              interval: Optional[int] = None,
+              keys: Optional[Sequence[str]] = None) -> Aggregates:
+        """Aggregates of the buckets of a stream that start in [start, end).
+
+        The buckets are read at the coarsest resolution that divides the
+        interval and merged into buckets of the interval. Without an interval
+        the buckets of the finest resolution are returned. Buckets that don't
+        fit exactly in the interval are merged into the one they start in.
+        """
+        resolution = self._resolution_for(interval)
+        interval = max(interval or resolution, resolution)
+        start = start // resolution * resolution
+        query = ('SELECT key, bucket, count, sum, min, max FROM rollups '
+                 'WHERE stream_id = ? AND resolution = ? AND bucket >= ? '
+                 'AND bucket < ?')
+        parameters = [stream_id, resolution, start, end]
+        if keys is not None:
+            query += f' AND key IN ({", ".join("?" * len(keys))})'
+            parameters.extend(keys)
+        rows = {(key, bucket): values for key, bucket, *values
+                in self._db.execute(query, parameters)}
+        # Buckets updated since the last flush replace the stored ones
+        for bucket_key in self._dirty:
+            key_stream_id, key_resolution, key, bucket = bucket_key
+            if key_stream_id == stream_id and key_resolution == resolution \
+                    and start <= bucket < end \
+                    and (keys is None or key in keys):
+                rows[(key, bucket)] = self._buckets[bucket_key]
+        if not rows:
+            return Aggregates.empty(interval)
+        ordered = sorted(rows.items())
+        values = np.array([row[1] for row in ordered], dtype=np.float64)
+        aggregates = Aggregates(
+            [key for (key, _), _ in ordered],
+            np.array([bucket for (_, bucket), _ in ordered], dtype=np.int64),
+            values[:, 0].astype(np.int64), values[:, 1], values[:, 2],
+            values[:, 3], resolution)
+        return aggregates.rebucket(interval)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {'updates': self.updates, 'flushes': self.flushes,
+                'dirty': len(self._dirty),
+                'skipped_blocks': self.skipped_blocks}
+
+    def close(self) -> None:
+        self.flush(sync=True)
+        self._db.close()
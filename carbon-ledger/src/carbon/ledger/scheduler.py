@@ -0,0 +1,113 @@
+from asyncio import Future, sleep
+from collections import OrderedDict, deque
+from enum import IntEnum
+from time import monotonic
+from typing import Any, Deque, Dict, Optional
+
+
+class Priority(IntEnum):
+    """Classes of work, from the most to the least urgent."""
+    FOLLOW = 0
+    BACKFILL = 1
+
+
+class RateLimiter:
+    """Token bucket that limits the rate of the requests sent to a node."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated_at = monotonic()
+
+    def _refill(self) -> None:
+        now = monotonic()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self) -> None:
+        self._refill()
+        while self._tokens < 1:
+            await sleep((1 - self._tokens) / self.rate)
+            self._refill()
+        self._tokens -= 1
+
+
+class Scheduler:
+    """Shares a global budget of concurrent requests between streams.
+
+    Work waits in one queue per priority, and within a queue the streams are
+    served in turn, so that a stream with a lot of pending work can't delay
+    the others. Follow work is always served first, and part of the budget
+    is kept for it, so that a large backfill can't use every slot and make
+    new blocks wait behind long running requests.
+    """
+
+    def __init__(self, max_concurrency: int = 16,
+                 follow_reserve: Optional[int] = None) -> None:
+        self.max_concurrency = max(1, max_concurrency)
+        self.follow_reserve = (follow_reserve if follow_reserve is not None
+                               else max(1, self.max_concurrency // 4))
+        self.running = 0
+        self.running_by_priority = {priority: 0 for priority in Priority}
+        # One FIFO of waiters per owner, for every priority
+        self._queues = {
+            priority: OrderedDict() for priority in Priority
+        }  # type: Dict[Priority, OrderedDict[Any, Deque[Future]]]
+
+    def _limit(self, priority: Priority) -> int:
+        if priority == Priority.FOLLOW:
+            return self.max_concurrency
+        return max(1, self.max_concurrency - self.follow_reserve)
+
+    def _has_slot(self, priority: Priority) -> bool:
+        return self.running < self._limit(priority)
+
+    def _dispatch(self) -> None:
+        for priority in Priority:
+            queue = self._queues[priority]
+            while queue and self._has_slot(priority):
+                # Serve the owners in turn
+                owner, waiters = queue.popitem(last=False)
+                waiter = waiters.popleft()
+                if waiters:
+                    queue[owner] = waiters
+                if waiter.done():
+                    # The waiter was cancelled
+                    continue
+                self.running += 1
+                self.running_by_priority[priority] += 1
+                waiter.set_result(None)
+
+    async def acquire(self, priority: Priority = Priority.FOLLOW,
+                      owner: Any = None) -> None:
+        if self._has_slot(priority) and not any(
+                self._queues[p] for p in Priority if p <= priority):
+            self.running += 1
+            self.running_by_priority[priority] += 1
+            return
+        waiter = Future()
+        self._queues[priority].setdefault(owner, deque()).append(waiter)
+        try:
+            await waiter
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was given to us after all, hand it over
+                self.release(priority)
+            raise
+
+    def release(self, priority: Priority = Priority.FOLLOW) -> None:
+        self.running -= 1
+        self.running_by_priority[priority] -= 1
+        self._dispatch()
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        stats = {'running': self.running}
+        for priority in Priority:
+            name = priority.name.lower()
+            stats[f'{name}_running'] = self.running_by_priority[priority]
+            stats[f'{name}_waiting'] = sum(
+                len(waiters) for waiters in self._queues[priority].values())
+        return stats
@@ -0,0 +1,693 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+from itertools import count
+from threading import Lock
+from typing import (Any, Dict, Iterable, Iterator, List, Optional, Sequence,
+                    Set, Tuple)
+
+import numpy as np
+
+from carbon.ledger.arrays import SampleBatch, TagDictionary, parse_samples
+from carbon.ledger.data import Packet
+
+MAGIC = b'CLSG'
+# Version 2 segments can also store the number of samples behind every sample
+VERSION = 2
+VERSIONS = (1, 2)
+SUFFIX = '.seg'
+
+_HEADER = struct.Struct('<4sH2x')
+# Offset of the footer, length of its metadata, number of series, checksum of
+# the footer and magic
+_TRAILER = struct.Struct('<QIII4s')
+# Index of the series of a segment, stored in its footer
+_ENTRY = np.dtype([('tag_id', '<u4'), ('count', '<u4'),
+                   ('first_timestamp', '<i8'), ('last_timestamp', '<i8'),
+                   ('min', '<f8'), ('max', '<f8'), ('offset', '<u8'),
+                   ('size', '<u4'), ('crc', '<u4')])
+
+_COLUMNS = np.arange(8)
+
+
+def _significant_bytes(leading: np.ndarray,
+                       lengths: np.ndarray) -> np.ndarray:
+    return ((_COLUMNS >= leading[:, None])
+            & (_COLUMNS < (leading + lengths)[:, None]))
+
+
+def pack_words(words: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Packs 64-bit words into their significant bytes.
+
+    Every word gets a header byte with its number of leading zero bytes in
+    the high nibble and its number of significant bytes in the low one. Zero
+    words only take their header, and since headers have a fixed size the
+    words can all be unpacked at once.
+    """
+    raw = words.astype('>u8').view(np.uint8).reshape(-1, 8)
+    nonzero = raw != 0
+    any_nonzero = nonzero.any(axis=1)
+    leading = np.where(any_nonzero, nonzero.argmax(axis=1), 0)
+    trailing = nonzero[:, ::-1].argmax(axis=1)
+    lengths = np.where(any_nonzero, 8 - leading - trailing, 0)
+    headers = (leading << 4 | lengths).astype(np.uint8)
+    return headers, raw[_significant_bytes(leading, lengths)]
+
+
+def payload_size(headers: np.ndarray) -> int:
+    return int((headers & 0x0f).sum(dtype=np.int64))
+
+
+def unpack_words(headers: np.ndarray, payload: np.ndarray) -> np.ndarray:
+    """Inverse of pack_words."""
+    leading = (headers >> 4).astype(np.intp)
+    lengths = (headers & 0x0f).astype(np.intp)
+    if (leading + lengths > 8).any():
+        raise ValueError('Invalid word headers')
+    mask = _significant_bytes(leading, lengths)
+    raw = np.zeros((len(headers), 8), dtype=np.uint8)
+    raw[mask] = payload
+    return raw.view('>u8').reshape(-1).astype(np.uint64)
+
+
+def encode_timestamps(timestamps: np.ndarray
+                      ) -> Tuple[np.ndarray, np.ndarray]:
+    """Encodes the sorted timestamps of a series after the first one.
+
+    Samples are usually taken at a fixed interval, so the difference between
+    consecutive deltas is mostly zero. It's zigzag encoded so that small
+    negative values stay small, and packed.
+    """
+    deltas = np.diff(timestamps.astype(np.int64))
+    delta_of_deltas = np.diff(deltas, prepend=np.int64(0))
+    zigzag = (delta_of_deltas << 1) ^ (delta_of_deltas >> 63)
+    return pack_words(zigzag.view(np.uint64))
+
+
+def decode_timestamps(first: int, headers: np.ndarray,
+                      payload: np.ndarray) -> np.ndarray:
+    zigzag = unpack_words(headers, payload)
+    delta_of_deltas = ((zigzag >> np.uint64(1)).view(np.int64)
+                       ^ -(zigzag & np.uint64(1)).view(np.int64))
+    timestamps = np.empty(len(headers) + 1, dtype=np.int64)
+    timestamps[0] = first
+    np.cumsum(np.cumsum(delta_of_deltas), out=timestamps[1:])
+    timestamps[1:] += first
+    return timestamps
+
+
+def encode_values(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Encodes the values of a series as the XOR with the previous value.
+
+    The values of a series change slowly, so the XOR of consecutive values
+    shares the sign, exponent and high bits of the mantissa and is mostly
+    made of zeros.
+    """
+    bits = values.astype(np.float64).view(np.uint64)
+    xor = bits.copy()
+    xor[1:] ^= bits[:-1]
+    return pack_words(xor)
+
+
+def decode_values(headers: np.ndarray, payload: np.ndarray) -> np.ndarray:
+    xor = unpack_words(headers, payload)
+    return np.bitwise_xor.accumulate(xor).view(np.float64)
+
+
+class SegmentWriter:
+    """Writes the samples of a stream to a compressed segment file.
+
+    Samples are grouped by series, the samples of a key, and sorted by
+    timestamp. Every series is stored as delta-of-delta timestamps and XOR
+    encoded values, followed by the packed counts of the samples if any of
+    them is downsampled, and its keys are stored once in the dictionary of
+    the segment. The footer indexes the series by key and time range, so that
+    readers only decode the series they need. The file is written when the
+    writer is closed, and replaces any previous file atomically.
+    """
+
+    def __init__(self, path: str, stream_id: str = '',
+                 metadata: Optional[Dict[str, Any]] = None) -> None:
+        self.path = path
+        self.stream_id = stream_id
+        self.metadata = metadata or dict(())
+        self._dictionary = TagDictionary()
+        self._batches = list()  # type: List[SampleBatch]
+        self._size = 0
+
+    def add(self, batch: SampleBatch) -> None:
+        if not len(batch):
+            return
+        # Encode the keys of the batch with the dictionary of the segment
+        self._batches.append(batch.recode(self._dictionary))
+        self._size += len(batch)
+
+    def add_packets(self, packets: Iterable[Packet],
+                    batch_size: int = 10000) -> None:
+        """Adds samples as they are handed out by Stream.data.
+
+        Raises ValueError if the value of a sample is not a number.
+        """
+        samples = list()  # type: List[str]
+        for packet in packets:
+            samples.append(str(packet))
+            if len(samples) >= batch_size:
+                self.add(parse_samples(samples, self._dictionary))
+                samples = list()
+        self.add(parse_samples(samples, self._dictionary))
+
+    @property
+    def keys(self) -> List[str]:
+        return self._dictionary.keys
+
+    def to_arrays(self) -> SampleBatch:
+        """Returns the samples added since the segment was last written."""
+        return SampleBatch.concatenate(self._batches, self._dictionary)
+
+    def _series(self) -> Iterator[Tuple[str, SampleBatch]]:
+        """The samples of every key, sorted by timestamp."""
+        samples = self.to_arrays()
+        samples = samples.take(np.lexsort((samples.timestamps,
+                                           samples.tag_ids)))
+        bounds = np.flatnonzero(np.diff(samples.tag_ids)) + 1
+        for start, end in zip(np.concatenate(([0], bounds)).tolist(),
+                              np.concatenate((bounds,
+                                              [len(samples)])).tolist()):
+            yield (self._dictionary.decode(int(samples.tag_ids[start])),
+                   samples.take(slice(start, end)))
+
+    def close(self) -> Optional[str]:
+        """Writes the segment. Returns its path, or None if it's empty."""
+        if not self._size:
+            return None
+        keys = list()  # type: List[str]
+        entries = list()  # type: List[Tuple]
+        has_counts = any(batch.counts is not None for batch in self._batches)
+        temporary_path = f'{self.path}.tmp'
+        with open(temporary_path, 'wb') as segment_file:
+            segment_file.write(_HEADER.pack(MAGIC, VERSION))
+            offset = _HEADER.size
+            for key, series in self._series():
+                timestamps, values = series.timestamps, series.values
+                arrays = encode_timestamps(timestamps) + encode_values(values)
+                if has_counts:
+                    arrays += pack_words(
+                        series.sample_counts.astype(np.uint64))
+                chunk = b''.join(array.tobytes() for array in arrays)
+                segment_file.write(chunk)
+                entries.append((len(keys), len(timestamps),
+                                timestamps[0], timestamps[-1],
+                                values.min(), values.max(), offset,
+                                len(chunk), zlib.crc32(chunk)))
+                keys.append(key)
+                offset += len(chunk)
+            metadata = json.dumps({'stream_id': self.stream_id,
+                                   'keys': keys,
+                                   'counts': has_counts,
+                                   'metadata': self.metadata}).encode()
+            footer = metadata + np.array(entries, dtype=_ENTRY).tobytes()
+            segment_file.write(footer)
+            segment_file.write(_TRAILER.pack(offset, len(metadata),
+                                             len(entries),
+                                             zlib.crc32(footer), MAGIC))
+            segment_file.flush()
+            os.fsync(segment_file.fileno())
+        os.replace(temporary_path, self.path)
+        self._batches = list()
+        self._size = 0
+        return self.path
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __enter__(self) -> 'SegmentWriter':
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self.close()
+
+
+class SegmentReader:
+    """Reads a segment file written by SegmentWriter.
+
+    The file is memory-mapped and only the footer is read when it's opened.
+    The series are decoded as they are read, and their checksums verified.
+    """
+
+    class CorruptSegment(Exception):
+        pass
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, 'rb') as segment_file:
+            try:
+                self._mmap = mmap.mmap(segment_file.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SegmentReader.CorruptSegment(f'Empty segment {path}')
+        self._data = np.frombuffer(self._mmap, dtype=np.uint8)
+        self._read_footer()
+
+    def _read_footer(self) -> None:
+        size = len(self._mmap)
+        if size < _HEADER.size + _TRAILER.size:
+            raise SegmentReader.CorruptSegment(f'Truncated segment '
+                                               f'{self.path}')
+        magic, version = _HEADER.unpack_from(self._mmap, 0)
+        offset, metadata_length, count, crc, trailer_magic = \
+            _TRAILER.unpack_from(self._mmap, size - _TRAILER.size)
+        if magic != MAGIC or trailer_magic != MAGIC \
+                or version not in VERSIONS:
+            raise SegmentReader.CorruptSegment(f'Not a segment {self.path}')
+        footer_end = offset + metadata_length + count * _ENTRY.itemsize
+        if footer_end != size - _TRAILER.size \
+                or zlib.crc32(self._mmap[offset:footer_end]) != crc:
+            raise SegmentReader.CorruptSegment(f'Invalid footer in segment '
+                                               f'{self.path}')
+        metadata = json.loads(
+            self._mmap[offset:offset + metadata_length].decode())
+        self.stream_id = metadata['stream_id']  # type: str
+        self.keys = metadata['keys']  # type: List[str]
+        self.has_counts = metadata.get('counts', False)  # type: bool
+        self.metadata = metadata.get('metadata', {})  # type: Dict[str, Any]
+        self.series = np.frombuffer(
+            self._mmap, dtype=_ENTRY, count=count,
+            offset=offset + metadata_length)
+
+    @property
+    def first_timestamp(self) -> int:
+        return int(self.series['first_timestamp'].min())
+
+    @property
+    def last_timestamp(self) -> int:
+        return int(self.series['last_timestamp'].max())
+
+    def _decode(self, entry: np.void
+                ) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+        start = int(entry['offset'])
+        chunk = self._data[start:start + int(entry['size'])]
+        if zlib.crc32(chunk) != int(entry['crc']):
+            raise SegmentReader.CorruptSegment(
+                f'Invalid checksum of series {self.keys[entry["tag_id"]]} in '
+                f'segment {self.path}')
+        count = int(entry['count'])
+        timestamp_headers = chunk[:count - 1]
+        end = count - 1 + payload_size(timestamp_headers)
+        timestamps = decode_timestamps(int(entry['first_timestamp']),
+                                       timestamp_headers,
+                                       chunk[count - 1:end])
+        value_headers = chunk[end:end + count]
+        start, end = end + count, end + count + payload_size(value_headers)
+        values = decode_values(value_headers, chunk[start:end])
+        counts = None  # type: Optional[np.ndarray]
+        if self.has_counts:
+            counts = unpack_words(chunk[end:end + count],
+                                  chunk[end + count:]).astype(np.int64)
+        return timestamps, values, counts
+
+    def read(self, keys: Optional[Sequence[str]] = None,
+             start: Optional[int] = None, end: Optional[int] = None,
+             dictionary: Optional[TagDictionary] = None
+             ) -> Iterator[SampleBatch]:
+        """Iterates over the series of the segment, one batch per series.
+
+        Only the series of the given keys with samples in [start, end) are
+        decoded. Batches are encoded with the given dictionary, for example
+        the one of the stream, or with a new one.
+        """
+        dictionary = dictionary if dictionary is not None \
+            else TagDictionary()
+        tag_ids = (None if keys is None
+                   else {i for i, key in enumerate(self.keys) if key in keys})
+        for entry in self.series:
+            if tag_ids is not None and int(entry['tag_id']) not in tag_ids:
+                continue
+            if (start is not None and entry['last_timestamp'] < start) \
+                    or (end is not None and entry['first_timestamp'] >= end):
+                continue
+            timestamps, values, counts = self._decode(entry)
+            tag_id = dictionary.encode(self.keys[entry['tag_id']])
+            batch = SampleBatch(timestamps, values,
+                                np.full(len(timestamps), tag_id,
+                                        dtype=np.int32), dictionary, counts)
+            if start is not None or end is not None:
+                batch = batch.between(
+                    start if start is not None else np.iinfo(np.int64).min,
+                    end if end is not None else np.iinfo(np.int64).max)
+            yield batch
+
+    def to_arrays(self, dictionary: Optional[TagDictionary] = None
+                  ) -> SampleBatch:
+        """Returns all the samples of the segment, grouped by series."""
+        dictionary = dictionary if dictionary is not None \
+            else TagDictionary()
+        return SampleBatch.concatenate(self.read(dictionary=dictionary),
+                                       dictionary)
+
+    def __len__(self) -> int:
+        return int(self.series['count'].sum())
+
+    def close(self) -> None:
+        self.series = self._data = None
+        self._mmap.close()
+
+    def __enter__(self) -> 'SegmentReader':
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self.close()
+
+
+class SegmentIndex:
+    """The series of a segment and their time ranges, read from its footer.
+
+    Unlike the series of a SegmentReader, it stays valid once the segment
+    is closed or removed.
+    """
+
+    def __init__(self, reader: SegmentReader) -> None:
+        self.path = reader.path
+        self.keys = reader.keys
+        # The archive keeps the addresses of the blocks on its own
+        self.metadata = {key: value for key, value in reader.metadata.items()
+                         if key != 'blocks'}
+        self.series = reader.series.copy()
+
+    @property
+    def first_timestamp(self) -> int:
+        return int(self.series['first_timestamp'].min())
+
+    @property
+    def last_timestamp(self) -> int:
+        return int(self.series['last_timestamp'].max())
+
+    def overlaps(self, start: Optional[int], end: Optional[int]) -> bool:
+        """Whether the segment has samples in [start, end)."""
+        return not ((start is not None and self.last_timestamp < start)
+                    or (end is not None and self.first_timestamp >= end))
+
+
+class SegmentArchive:
+    """Archives the samples of a stream in segment files.
+
+    Samples are buffered until there are enough of them for a segment. The
+    segments of a stream are kept in a directory named after it, and their
+    names start with the first timestamp of the segment. The footers of the
+    segments are read once, and their indexes kept until the segments change
+    because the archive was flushed or compacted.
+
+    Segments also list the addresses of the blocks their samples come from,
+    so that the samples of a block that's stored again, because it was
+    replayed from the write-ahead log or reattached, are only archived once.
+    Duplicates of raw samples could be dropped by a compaction, but not
+    once they have been downsampled.
+    """
+
+    def __init__(self, directory: str, stream_id: str,
+                 segment_samples: int = 100000) -> None:
+        self.directory = os.path.join(directory, stream_id)
+        self.stream_id = stream_id
+        self.segment_samples = segment_samples
+        self._writer = None  # type: Optional[SegmentWriter]
+        self._sequence = count(1)
+        # Addresses of the archived blocks, read from the segments once
+        self._blocks = None  # type: Optional[Set[str]]
+        self._buffered_blocks = list()  # type: List[str]
+        self._indexes = dict(())  # type: Dict[str, SegmentIndex]
+        # The indexes are up to date while the generations match
+        self._generation = 0
+        self._indexed_generation = -1
+        # Compactions list the segments from another thread
+        self._lock = Lock()
+        self.written_segments = 0
+        self.written_samples = 0
+        self.skipped_blocks = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _archived_blocks(self) -> Set[str]:
+        if self._blocks is None:
+            blocks = set()  # type: Set[str]
+            for path in self.segments():
+                try:
+                    with SegmentReader(path) as reader:
+                        blocks.update(reader.metadata.get('blocks', ()))
+                except FileNotFoundError:
+                    # Replaced by a compaction meanwhile
+                    continue
+            self._blocks = blocks
+        return self._blocks
+
+    def add(self, batch: SampleBatch, address: Optional[str] = None) -> None:
+        """Buffers samples, and the address of the block they come from.
+
+        The samples of a block that's already archived are skipped.
+        """
+        if not len(batch):
+            return
+        if address is not None:
+            if address in self._archived_blocks():
+                self.skipped_blocks += 1
+                return
+            self._blocks.add(address)
+            self._buffered_blocks.append(address)
+        if self._writer is None:
+            self._writer = SegmentWriter(
+                self.segment_path(int(batch.timestamps.min())),
+                self.stream_id)
+        self._writer.add(batch)
+        if len(self._writer) >= self.segment_samples:
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes the buffered samples to a segment."""
+        if self._writer is None:
+            return
+        samples = len(self._writer)
+        writer, self._writer = self._writer, None
+        if self._buffered_blocks:
+            writer.metadata['blocks'] = self._buffered_blocks
+            self._buffered_blocks = list()
+        if writer.close() is not None:
+            self.invalidate()
+            self.written_segments += 1
+            self.written_samples += samples
+
+    def segment_path(self, first_timestamp: int) -> str:
+        """Path of a new segment whose first sample is at a timestamp.
+
+        A process started again can get the id of a previous one, whose
+        segments must not be replaced.
+        """
+        while True:
+            path = os.path.join(self.directory,
+                                f'{first_timestamp:012d}-{os.getpid()}-'
+                                f'{next(self._sequence)}{SUFFIX}')
+            if not os.path.exists(path):
+                return path
+
+    def segments(self) -> List[str]:
+        """Paths of the segments of the stream, oldest first."""
+        return sorted(os.path.join(self.directory, name)
+                      for name in os.listdir(self.directory)
+                      if name.endswith(SUFFIX))
+
+    def invalidate(self) -> None:
+        """Lists the segments again the next time they are needed.
+
+        Must be called once segments have been written or removed.
+        """
+        self._generation += 1
+
+    def indexes(self) -> List[SegmentIndex]:
+        """The indexes of the segments that have samples, oldest first."""
+        with self._lock:
+            generation = self._generation
+            if generation != self._indexed_generation:
+                indexes = dict(())  # type: Dict[str, SegmentIndex]
+                for path in self.segments():
+                    index = self._indexes.get(path)
+                    if index is None:
+                        try:
+                            with SegmentReader(path) as reader:
+                                index = SegmentIndex(reader)
+                        except FileNotFoundError:
+                            # Replaced by a compaction meanwhile
+                            continue
+                    indexes[path] = index
+                self._indexes = indexes
+                self._indexed_generation = generation
+            return [index for index in self._indexes.values()
+                    if len(index.series)]
+
+    def _buffered(self, dictionary: TagDictionary,
+                  keys: Optional[Sequence[str]] = None,
+                  start: Optional[int] = None,
+                  end: Optional[int] = None) -> SampleBatch:
+        """The samples that are not written to a segment yet."""
+        if self._writer is None:
+            return SampleBatch.empty(dictionary)
+        buffered = self._writer.to_arrays().recode(dictionary)
+        if start is not None or end is not None:
+            buffered = buffered.between(
+                start if start is not None else np.iinfo(np.int64).min,
+                end if end is not None else np.iinfo(np.int64).max)
+        if keys is not None:
+            buffered = SampleBatch.concatenate(
+                [buffered.select(key) for key in keys], dictionary)
+        return buffered
+
+    @staticmethod
+    def read_segments(paths: Iterable[str],
+                      keys: Optional[Sequence[str]] = None,
+                      start: Optional[int] = None, end: Optional[int] = None,
+                      dictionary: Optional[TagDictionary] = None
+                      ) -> Iterator[SampleBatch]:
+        """Iterates over the samples of segments, see SegmentReader.read.
+
+        Segments that have been removed meanwhile are skipped.
+        """
+        dictionary = dictionary if dictionary is not None \
+            else TagDictionary()
+        for path in paths:
+            try:
+                reader = SegmentReader(path)
+            except FileNotFoundError:
+                # Replaced by a compaction meanwhile
+                continue
+            with reader:
+                yield from reader.read(keys, start, end, dictionary)
+
+    def read(self, keys: Optional[Sequence[str]] = None,
+             start: Optional[int] = None, end: Optional[int] = None,
+             dictionary: Optional[TagDictionary] = None
+             ) -> Iterator[SampleBatch]:
+        """Iterates over the archived samples, see SegmentReader.read.
+
+        The samples that are not written to a segment yet come last. Samples
+        can be repeated while a compaction replaces the segments, or until
+        it drops the samples archived more than once.
+        """
+        dictionary = dictionary if dictionary is not None \
+            else TagDictionary()
+        yield from SegmentArchive.read_segments(
+            [index.path for index in self.indexes()
+             if index.overlaps(start, end)], keys, start, end, dictionary)
+        buffered = self._buffered(dictionary, keys, start, end)
+        if len(buffered):
+            yield buffered
+
+    def windows(self, keys: Optional[Sequence[str]] = None,
+                start: Optional[int] = None, end: Optional[int] = None
+                ) -> List[Tuple[List[str], SampleBatch]]:
+        """Splits the archived samples in [start, end) in time windows.
+
+        Every window has the segments whose time ranges overlap, and the
+        buffered samples if they overlap them, in a dictionary of their
+        own. Windows are disjoint and ordered, so reading them one after
+        the other with read_window returns the samples in the order of
+        their timestamps, and samples archived more than once are always
+        in the same window.
+        """
+        wanted = set(keys) if keys is not None else None
+        ranges = [(index.first_timestamp, index.last_timestamp, index.path)
+                  for index in self.indexes() if index.overlaps(start, end)
+                  and (wanted is None or not wanted.isdisjoint(index.keys))]
+        buffered = self._buffered(TagDictionary(), keys, start, end)
+        if len(buffered):
+            ranges.append((int(buffered.timestamps.min()),
+                           int(buffered.timestamps.max()), ''))
+        ranges.sort(key=lambda time_range: time_range[:2])
+        windows = list()  # type: List[Tuple[int, List[str]]]
+        for first, last, path in ranges:
+            if windows and first <= windows[-1][0]:
+                windows[-1] = (max(windows[-1][0], last),
+                               windows[-1][1] + [path])
+            else:
+                windows.append((last, [path]))
+        empty = SampleBatch.empty(buffered.dictionary)
+        return [([path for path in paths if path],
+                 buffered if '' in paths else empty)
+                for _, paths in windows]
+
+    @staticmethod
+    def read_window(paths: List[str], buffered: SampleBatch,
+                    keys: Optional[Sequence[str]] = None,
+                    start: Optional[int] = None, end: Optional[int] = None
+                    ) -> SampleBatch:
+        """Returns the samples of a window, see windows.
+
+        The samples are encoded with a new dictionary, and only the files of
+        the segments are read, so windows can be read from another thread.
+        """
+        dictionary = TagDictionary()
+        batches = list(SegmentArchive.read_segments(paths, keys, start, end,
+                                                    dictionary))
+        batches.append(buffered.recode(dictionary))
+        return SampleBatch.concatenate(batches, dictionary)
+
+    def keys(self) -> Set[str]:
+        """The keys of all the archived samples."""
+        keys = set()  # type: Set[str]
+        for index in self.indexes():
+            keys.update(index.keys)
+        if self._writer is not None:
+            keys.update(self._writer.keys)
+        return keys
+
+    def latest(self, keys: Optional[Sequence[str]] = None,
+               dictionary: Optional[TagDictionary] = None) -> SampleBatch:
+        """Returns the latest archived sample of every key.
+
+        Only the series that end last for their key are decoded.
+        """
+        dictionary = dictionary if dictionary is not None \
+            else TagDictionary()
+        wanted = set(keys) if keys is not None else None
+        # Index and series that end last for every key
+        last = dict(())  # type: Dict[str, Tuple[SegmentIndex, np.void]]
+        for index in self.indexes():
+            for entry in index.series:
+                key = index.keys[entry['tag_id']]
+                if (wanted is not None and key not in wanted) \
+                        or (key in last and entry['last_timestamp']
+                            <= last[key][1]['last_timestamp']):
+                    continue
+                last[key] = (index, entry)
+        by_path = dict(())  # type: Dict[str, List[Tuple[str, np.void]]]
+        for key, (index, entry) in last.items():
+            by_path.setdefault(index.path, list()).append((key, entry))
+        latest = dict(())  # type: Dict[str, Tuple[int, float, int]]
+        for path, entries in by_path.items():
+            try:
+                reader = SegmentReader(path)
+            except FileNotFoundError:
+                # Replaced by a compaction meanwhile
+                continue
+            with reader:
+                for key, entry in entries:
+                    timestamps, values, counts = reader._decode(entry)
+                    latest[key] = (int(timestamps[-1]), float(values[-1]),
+                                   int(counts[-1]) if counts is not None
+                                   else 1)
+        buffered = self._buffered(dictionary).latest()
+        for key, timestamp, value, sample_count in zip(
+                buffered.keys, buffered.timestamps.tolist(),
+                buffered.values.tolist(), buffered.sample_counts.tolist()):
+            if (wanted is None or key in wanted) \
+                    and (key not in latest or timestamp > latest[key][0]):
+                latest[key] = (timestamp, value, sample_count)
+        keys = sorted(latest)
+        return SampleBatch(
+            np.array([latest[key][0] for key in keys], dtype=np.int64),
+            np.array([latest[key][1] for key in keys], dtype=np.float64),
+            dictionary.encode_many(keys), dictionary,
+            np.array([latest[key][2] for key in keys], dtype=np.int64))
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {'segments': self.written_segments,
+                'samples': self.written_samples,
+                'skipped_blocks': self.skipped_blocks,
+                'buffered': len(self._writer) if self._writer else 0}
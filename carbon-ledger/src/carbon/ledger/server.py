@@ -0,0 +1,289 @@
+from asyncio import get_event_loop
+from logging import Logger
+from math import isfinite
+from time import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import numpy as np
+from aiohttp import web
+
+from carbon.ledger.arrays import SampleBatch, TagDictionary
+from carbon.ledger.compaction import deduplicate
+from carbon.ledger.connectors import Stream
+from carbon.ledger.rollups import Aggregates, RollupStore
+from carbon.ledger.segments import SegmentArchive
+
+
+def _number(value: float) -> str:
+    return repr(value) if isfinite(value) else 'null'
+
+
+def _tags(dictionary: TagDictionary, key: str) -> str:
+    return dictionary.tag_set(key).metrics_20
+
+
+def render_samples(batch: SampleBatch) -> str:
+    """Serializes samples as Metrics 2.0 JSON objects, one per line."""
+    dictionary = batch.dictionary
+    tags = {tag_id: _tags(dictionary, dictionary.decode(tag_id))
+            for tag_id in np.unique(batch.tag_ids).tolist()}
+    return ''.join(
+        f'{{{tags[tag_id]}, "time": {timestamp}, "value": {_number(value)}}}\n'
+        for tag_id, timestamp, value in zip(batch.tag_ids.tolist(),
+                                            batch.timestamps.tolist(),
+                                            batch.values.tolist()))
+
+
+def render_aggregates(aggregates: Aggregates, dictionary: TagDictionary,
+                      start: int = 0, end: Optional[int] = None) -> str:
+    """Serializes buckets as Metrics 2.0 JSON objects, one per line.
+
+    Every bucket is timestamped at its start and carries its interval.
+    """
+    end = len(aggregates) if end is None else end
+    return ''.join(
+        f'{{{_tags(dictionary, aggregates.keys[i])}, '
+        f'"time": {int(aggregates.timestamps[i])}, '
+        f'"interval": {aggregates.interval}, '
+        f'"count": {int(aggregates.count[i])}, '
+        f'"sum": {_number(float(aggregates.sum[i]))}, '
+        f'"min": {_number(float(aggregates.min[i]))}, '
+        f'"max": {_number(float(aggregates.max[i]))}, '
+        f'"mean": {_number(float(aggregates.mean[i]))}}}\n'
+        for i in range(start, end))
+
+
+class QueryServer:
+    """HTTP API over the samples of the streams followed by the process.
+
+    Samples are read from the archive of the stream if it's kept, from its
+    segments and from the samples of the latest blocks that are not written
+    to a segment yet. Otherwise they are read from the blocks already
+    stored, found through the time index of the stream. Aggregates are read
+    from the rollups if they are kept. Queries never wait for the ledger:
+    blocks evicted from the cache without a storage backend are skipped.
+    Samples are written as Metrics 2.0 JSON objects, one per line, in a
+    chunked response.
+
+    Routes:
+      GET /streams
+      GET /streams/{stream_id}/samples?start=&end=&key=
+      GET /streams/{stream_id}/latest?key=
+      GET /streams/{stream_id}/aggregates?start=&end=&interval=&key=
+
+    Timestamps are seconds since the epoch, and `key` can be repeated. A key
+    selects the samples with that exact key or with that metric name.
+    """
+
+    CONTENT_TYPE = 'application/x-ndjson'
+
+    def __init__(self, streams: List[Stream], logger: Logger,
+                 rollups: Optional[RollupStore] = None,
+                 host: str = '127.0.0.1', port: int = 8080,
+                 chunk_size: int = 10000) -> None:
+        # The list of streams can still grow after the server starts
+        self.streams = streams
+        self.rollups = rollups
+        self.host = host
+        self.port = port
+        self.chunk_size = chunk_size
+        self.requests = 0
+        self._logger = logger
+        self._runner = None  # type: Optional[web.AppRunner]
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.add_routes([
+            web.get('/streams', self.list_streams),
+            web.get('/streams/{stream_id}/samples', self.samples),
+            web.get('/streams/{stream_id}/latest', self.latest),
+            web.get('/streams/{stream_id}/aggregates', self.aggregates)])
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self._logger.info(f'Serving queries on http://{self.host}:{self.port}')
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _stream(self, request: web.Request) -> Stream:
+        self.requests += 1
+        stream_id = request.match_info['stream_id']
+        for stream in self.streams:
+            if stream.stream_id == stream_id:
+                return stream
+        raise web.HTTPNotFound(text=f'Unknown stream {stream_id}\n')
+
+    @staticmethod
+    def _integer(request: web.Request, name: str, default: int) -> int:
+        try:
+            return int(request.query.get(name, default))
+        except ValueError:
+            raise web.HTTPBadRequest(text=f'Invalid {name}: '
+                                          f'{request.query[name]}\n')
+
+    def _time_range(self, request: web.Request) -> Tuple[int, int]:
+        start = self._integer(request, 'start', 0)
+        end = self._integer(request, 'end', int(time()) + 1)
+        if end <= start:
+            raise web.HTTPBadRequest(text='The end must be after the start\n')
+        return start, end
+
+    def _keys(self, request: web.Request,
+              stream: Stream) -> Optional[List[str]]:
+        """The keys of the stream that the query selects, if it does.
+
+        Keys are looked up among the ones of the samples seen since the
+        process started, and the ones archived or rolled up before.
+        """
+        names = request.query.getall('key', [])
+        if not names:
+            return None
+        keys = set(stream.tag_dictionary.keys)
+        if stream.archive is not None:
+            keys.update(stream.archive.keys())
+        if self.rollups is not None:
+            keys.update(self.rollups.keys(stream.stream_id))
+        wanted = set(names)
+        return sorted(key for key in keys
+                      if key in wanted or key.split(';', 1)[0] in wanted)
+
+    @staticmethod
+    def _read_window(paths: List[str], buffered: SampleBatch, start: int,
+                     end: int, keys: Optional[List[str]]) -> SampleBatch:
+        batch = SegmentArchive.read_window(paths, buffered, keys, start, end)
+        return deduplicate(batch).sorted()
+
+    async def _archived(self, stream: Stream, start: int, end: int,
+                        keys: Optional[List[str]]
+                        ) -> AsyncIterator[SampleBatch]:
+        """Iterates over the archived samples in [start, end), ordered by
+        timestamp, one time window at a time.
+
+        Windows are decoded in a thread, so that the event loop keeps
+        serving meanwhile, and every batch has a dictionary of its own.
+        """
+        event_loop = get_event_loop()
+        for paths, buffered in stream.archive.windows(keys, start, end):
+            batch = await event_loop.run_in_executor(
+                None, self._read_window, paths, buffered, start, end, keys)
+            if len(batch):
+                yield batch
+
+    async def _respond(self, request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse()
+        response.content_type = QueryServer.CONTENT_TYPE
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        return response
+
+    async def list_streams(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        return web.json_response([{
+            'stream_id': stream.stream_id,
+            'latest_address': stream.latest_address,
+            'earliest_address': stream.earliest_address,
+            'caught_up': stream.caught_up,
+            'blocks': len(stream.index),
+            'samples': stream.index.sample_count,
+            'processed_samples': stream.processed_samples}
+            for stream in self.streams])
+
+    async def samples(self, request: web.Request) -> web.StreamResponse:
+        """Streams the samples in [start, end).
+
+        Archived samples are sent in the order of their timestamps, and the
+        samples of the blocks in the order of the blocks, block by block.
+        """
+        stream = self._stream(request)
+        start, end = self._time_range(request)
+        keys = self._keys(request, stream)
+        tag_ids = (None if keys is None else
+                   [stream.tag_dictionary.encode(key) for key in keys])
+        response = await self._respond(request)
+        try:
+            if stream.archive is not None:
+                async for batch in self._archived(stream, start, end, keys):
+                    for i in range(0, len(batch), self.chunk_size):
+                        await response.write(render_samples(batch.take(
+                            slice(i, i + self.chunk_size))).encode())
+            else:
+                async for batch in stream.async_range_batches(start, end,
+                                                              fetch=False):
+                    if tag_ids is not None:
+                        batch = batch.take(np.isin(batch.tag_ids, tag_ids))
+                    if len(batch):
+                        await response.write(render_samples(batch).encode())
+        except Exception as e:
+            # The status has been sent already, so the response is cut short
+            self._logger.error(f'Could not read the samples of stream '
+                               f'{stream.stream_id}: {repr(e)}')
+        await response.write_eof()
+        return response
+
+    async def latest(self, request: web.Request) -> web.StreamResponse:
+        """Returns the latest sample of every key.
+
+        Without an archive, only the latest blocks are read, see
+        Stream.async_latest.
+        """
+        stream = self._stream(request)
+        keys = self._keys(request, stream)
+        if keys is not None and not keys:
+            latest = SampleBatch.empty(stream.tag_dictionary)
+        elif stream.archive is not None:
+            latest = stream.archive.latest(keys, stream.tag_dictionary)
+        else:
+            latest = await stream.async_latest(keys, fetch=False)
+        response = await self._respond(request)
+        await response.write(render_samples(latest).encode())
+        await response.write_eof()
+        return response
+
+    async def aggregates(self, request: web.Request) -> web.StreamResponse:
+        """Streams the buckets of an interval that start in [start, end).
+
+        Buckets are read from the rollups if they are kept, and aggregated
+        from the samples of the range otherwise.
+        """
+        stream = self._stream(request)
+        start, end = self._time_range(request)
+        keys = self._keys(request, stream)
+        interval = self._integer(request, 'interval', 60)
+        if interval <= 0:
+            raise web.HTTPBadRequest(text='The interval must be positive\n')
+        if keys is not None and not keys:
+            aggregates = Aggregates.empty(interval)
+        elif self.rollups is not None:
+            aggregates = self.rollups.query(stream.stream_id, start, end,
+                                            interval, keys)
+        else:
+            aligned = start // interval * interval
+            if stream.archive is not None:
+                aggregates = Aggregates.concatenate(
+                    [Aggregates.from_samples(batch, interval)
+                     async for batch in self._archived(stream, aligned, end,
+                                                       keys)], interval)
+            else:
+                batches = [batch async for batch in stream.async_range_batches(
+                    aligned, end, fetch=False)]
+                batch = SampleBatch.concatenate(batches,
+                                                stream.tag_dictionary)
+                if keys is not None:
+                    batch = SampleBatch.concatenate(
+                        [batch.select(key) for key in keys],
+                        stream.tag_dictionary)
+                aggregates = Aggregates.from_samples(batch, interval)
+        response = await self._respond(request)
+        for i in range(0, len(aggregates), self.chunk_size):
+            await response.write(render_aggregates(
+                aggregates, stream.tag_dictionary, i,
+                min(i + self.chunk_size, len(aggregates))).encode())
+        await response.write_eof()
+        return response
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {'requests': self.requests}
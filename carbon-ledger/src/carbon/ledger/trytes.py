@@ -0,0 +1,225 @@
+import codecs
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+TRYTE_ALPHABET = b'9ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+TRANSACTION_LENGTH = 2673
+FRAGMENT_LENGTH = 2187
+# Position of the fields of a transaction in its trytes
+ADDRESS = slice(2187, 2268)
+CURRENT_INDEX = slice(2331, 2340)
+LAST_INDEX = slice(2340, 2349)
+BUNDLE = slice(2349, 2430)
+
+_NINE = TRYTE_ALPHABET[0]
+_INVALID = 255
+# Value of every tryte as a digit in base 27, for every possible byte
+_DIGITS = np.full(256, _INVALID, dtype=np.uint8)
+_DIGITS[np.frombuffer(TRYTE_ALPHABET, dtype=np.uint8)] = np.arange(27)
+
+
+def _digits(trytes: np.ndarray) -> np.ndarray:
+    digits = _DIGITS[trytes]
+    if (digits == _INVALID).any():
+        raise ValueError('Invalid trytes')
+    return digits
+
+
+def _padding(fragment: np.ndarray) -> int:
+    """Length of the padding of the last fragment of a message."""
+    text = np.flatnonzero(fragment != _NINE)
+    return len(fragment) - (int(text[-1]) + 1 if len(text) else 0)
+
+
+def decode_integers(trytes: np.ndarray) -> np.ndarray:
+    """Decodes the balanced ternary integers encoded by rows of trytes."""
+    digits = _digits(trytes).astype(np.int64)
+    digits[digits > 13] -= 27
+    return digits @ (27 ** np.arange(trytes.shape[-1], dtype=np.int64))
+
+
+def trytes_to_bytes(trytes: np.ndarray, out: np.ndarray) -> None:
+    """Decodes every pair of trytes to the byte it encodes, into out."""
+    digits = _digits(trytes)
+    values = digits[1::2].astype(np.uint16) * 27 + digits[0::2]
+    if (values > 255).any():
+        raise ValueError('Trytes out of the range of a byte')
+    np.copyto(out, values, casting='unsafe')
+
+
+class TransactionBatch:
+    """The raw trytes of many transactions, one transaction per row.
+
+    Fields are decoded for all the transactions at once, instead of turning
+    every transaction into an object.
+    """
+
+    def __init__(self, trytes: Sequence[str]) -> None:
+        raw = np.frombuffer(''.join(trytes).encode('ascii'), dtype=np.uint8)
+        if len(raw) != len(trytes) * TRANSACTION_LENGTH:
+            raise ValueError('Transactions must have '
+                             f'{TRANSACTION_LENGTH} trytes')
+        self.trytes = raw.reshape(len(trytes), TRANSACTION_LENGTH)
+
+    @staticmethod
+    def concatenate(batches: Sequence['TransactionBatch']
+                    ) -> 'TransactionBatch':
+        batch = TransactionBatch(())
+        if batches:
+            batch.trytes = np.concatenate([b.trytes for b in batches])
+        return batch
+
+    @property
+    def fragments(self) -> np.ndarray:
+        return self.trytes[:, :FRAGMENT_LENGTH]
+
+    @property
+    def addresses(self) -> List[str]:
+        raw = self.trytes[:, ADDRESS].tobytes().decode('ascii')
+        length = ADDRESS.stop - ADDRESS.start
+        return [raw[i:i + length] for i in range(0, len(raw), length)]
+
+    @property
+    def current_index(self) -> np.ndarray:
+        return decode_integers(self.trytes[:, CURRENT_INDEX])
+
+    @property
+    def last_index(self) -> np.ndarray:
+        return decode_integers(self.trytes[:, LAST_INDEX])
+
+    def group_by_address(self) -> Dict[str, np.ndarray]:
+        """Rows of the transactions of every address, by current index.
+
+        Reattachments repeat the transactions of a bundle, so only the first
+        transaction with each index of a bundle is kept.
+        """
+        groups = dict(())  # type: Dict[str, List[int]]
+        seen = set()  # type: Set[Tuple[bytes, int]]
+        addresses = self.addresses
+        bundles = self.trytes[:, BUNDLE]
+        current_index = self.current_index
+        for i in np.argsort(current_index, kind='stable').tolist():
+            key = (bundles[i].tobytes(), int(current_index[i]))
+            if key in seen:
+                continue
+            seen.add(key)
+            groups.setdefault(addresses[i], []).append(i)
+        return {address: np.array(rows, dtype=np.intp)
+                for address, rows in groups.items()}
+
+    def __len__(self) -> int:
+        return len(self.trytes)
+
+
+class TryteDecoder:
+    """Decodes the messages of many transactions in one vectorized pass.
+
+    The text of all the messages is written into one buffer that is reused
+    by every call, so the views that are returned are only valid until the
+    next call. They should be parsed right away.
+    """
+
+    def __init__(self, capacity: int = 1 << 16) -> None:
+        self._buffer = np.empty(capacity, dtype=np.uint8)
+
+    def _reserve(self, size: int) -> np.ndarray:
+        if len(self._buffer) < size:
+            self._buffer = np.empty(max(size, 2 * len(self._buffer)),
+                                    dtype=np.uint8)
+        return self._buffer[:size]
+
+    def decode(self, fragments: np.ndarray,
+               messages: Sequence[np.ndarray]) -> List[memoryview]:
+        """Decodes messages made of rows of a matrix of fragments.
+
+        Every message is given by the rows of its fragments, in order. Only
+        the last fragment of a message has its padding stripped, and a last
+        character whose second tryte was padding gets it back. Raises
+        ValueError if the trytes do not encode bytes.
+        """
+        pieces = list()  # type: List[np.ndarray]
+        lengths = list()  # type: List[int]
+        for rows in messages:
+            message = fragments[rows]
+            trytes = message.reshape(-1)
+            length = len(trytes) - _padding(message[-1])
+            pieces.append(trytes[:length])
+            if length % 2:
+                pieces.append(np.array([_NINE], dtype=np.uint8))
+            lengths.append((length + 1) // 2)
+        trytes = (np.concatenate(pieces) if pieces
+                  else np.empty(0, dtype=np.uint8))
+        buffer = self._reserve(len(trytes) // 2)
+        trytes_to_bytes(trytes, buffer)
+        view = memoryview(buffer)
+        offsets = np.cumsum([0] + lengths).tolist()
+        return [view[start:end]
+                for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+class MessageAssembler:
+    """Decodes the message of a bundle whose transactions arrive in pieces.
+
+    Fragments are decoded as soon as all the ones before them have arrived,
+    so that the message can be parsed while the rest of the bundle is still
+    being fetched. Repeated fragments, like those of reattachments, are
+    ignored.
+    """
+
+    def __init__(self) -> None:
+        self._fragments = dict(())  # type: Dict[int, np.ndarray]
+        self._next_index = 0
+        self._last_index = None  # type: Optional[int]
+        self._carry = np.empty(0, dtype=np.uint8)
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.complete = False
+
+    def _decode(self, fragments: List[np.ndarray], final: bool) -> str:
+        trytes = np.concatenate([self._carry] + fragments)
+        if final:
+            if fragments:
+                trytes = trytes[:len(trytes) - _padding(fragments[-1])]
+            if len(trytes) % 2:
+                # Restore the null tryte of a padded last character
+                trytes = np.append(trytes, np.uint8(_NINE))
+            self._carry = np.empty(0, dtype=np.uint8)
+        else:
+            even_length = len(trytes) & ~1
+            trytes, self._carry = trytes[:even_length], trytes[even_length:]
+        data = np.empty(len(trytes) // 2, dtype=np.uint8)
+        trytes_to_bytes(trytes, data)
+        return self._text_decoder.decode(memoryview(data), final=final)
+
+    def add(self, batch: TransactionBatch) -> str:
+        """Adds transactions of the bundle and returns the decoded text.
+
+        Raises ValueError if the trytes do not encode text.
+        """
+        if self.complete:
+            return ''
+        last_index = batch.last_index
+        for i, index in enumerate(batch.current_index.tolist()):
+            if index >= self._next_index and index not in self._fragments:
+                self._fragments[index] = batch.fragments[i].copy()
+                if self._last_index is None:
+                    self._last_index = int(last_index[i])
+        fragments = list()  # type: List[np.ndarray]
+        while self._next_index in self._fragments:
+            fragments.append(self._fragments.pop(self._next_index))
+            self._next_index += 1
+            if self._next_index > self._last_index:
+                self.complete = True
+                break
+        if not fragments:
+            return ''
+        return self._decode(fragments, final=self.complete)
+
+    def finish(self) -> str:
+        """Decodes what is left of an incomplete bundle, in order."""
+        if self.complete:
+            return ''
+        self.complete = True
+        fragments = [self._fragments.pop(index)
+                     for index in sorted(self._fragments)]
+        return self._decode(fragments, final=True)
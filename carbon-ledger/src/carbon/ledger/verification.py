@@ -0,0 +1,278 @@
+from asyncio import Future, get_event_loop
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from ecdsa import SECP256k1, VerifyingKey
+from ecdsa.ellipticcurve import INFINITY, Point, PointJacobi
+from ecdsa.numbertheory import inverse_mod
+
+if TYPE_CHECKING:
+    from carbon.ledger.connectors import Block
+
+DIGEST_PREFIX = 'digest:'
+
+# Public key, signature and checksum of the signed data, all hex encoded
+Request = Tuple[str, str, str]
+
+_CURVE = SECP256k1.curve
+_GENERATOR = SECP256k1.generator
+_ORDER = SECP256k1.order
+
+
+@lru_cache(maxsize=1024)
+def _public_point(public_key: str) -> PointJacobi:
+    key = VerifyingKey.from_string(bytes.fromhex(public_key), curve=SECP256k1)
+    return PointJacobi.from_affine(key.pubkey.point)
+
+
+def _lift_x(x: int) -> List[PointJacobi]:
+    """Points of the curve with an x coordinate."""
+    p = _CURVE.p()
+    y_squared = (pow(x, 3, p) + _CURVE.a() * x + _CURVE.b()) % p
+    # The modulus of secp256k1 is 3 mod 4
+    y = pow(y_squared, (p + 1) // 4, p)
+    if y * y % p != y_squared:
+        return []
+    return [PointJacobi.from_affine(Point(_CURVE, x, y)),
+            PointJacobi.from_affine(Point(_CURVE, x, p - y))]
+
+
+def _verify(key: PointJacobi, e: int, r: int, s: int) -> bool:
+    w = inverse_mod(s, _ORDER)
+    point = _GENERATOR * (e * w % _ORDER) + key * (r * w % _ORDER)
+    return point != INFINITY and point.x() % _ORDER == r
+
+
+def _walk_matches(start: PointJacobi, step: PointJacobi, first_x: int,
+                  count: int) -> bool:
+    """Whether x(start + i * step) = first_x + i mod the order for an i.
+
+    The points are added in Jacobian coordinates with plain integers, so
+    that every candidate costs a single addition: x = X / Z^2 is compared
+    as X = x * Z^2 instead of being converted to affine coordinates.
+    """
+    if start == INFINITY or step == INFINITY:
+        return any(_verify_point(start + step * i, first_x + i)
+                   for i in range(count))
+    p = _CURVE.p()
+    x2, y2 = step.x(), step.y()
+    x1, y1 = start.x(), start.y()
+    x, y, z = x1, y1, 1
+    for i in range(count):
+        z_squared = z * z % p
+        candidate = first_x + i
+        if x == candidate * z_squared % p or (
+                candidate + _ORDER < p
+                and x == (candidate + _ORDER) * z_squared % p):
+            return True
+        # Mixed addition of the affine step, for a curve with a = 0
+        u2 = x2 * z_squared % p
+        s2 = y2 * z * z_squared % p
+        h = (u2 - x) % p
+        r = (s2 - y) % p
+        if h == 0:
+            # The point is the step or its opposite, which is improbable
+            return any(_verify_point(start + step * j, first_x + j)
+                       for j in range(i + 1, count))
+        h_squared = h * h % p
+        h_cubed = h * h_squared % p
+        v = x * h_squared % p
+        x3 = (r * r - h_cubed - 2 * v) % p
+        y = (r * (v - x3) - y * h_cubed) % p
+        x = x3
+        z = z * h % p
+    return False
+
+
+def _verify_point(point: PointJacobi, r: int) -> bool:
+    return point != INFINITY and point.x() % _ORDER == r
+
+
+def _verify_truncated_r(key: PointJacobi, e: int, r_high: int,
+                        s: int) -> bool:
+    """Searches for the lost last byte of r."""
+    w = inverse_mod(s, _ORDER)
+    # Every increment of r moves the point of the signature by w * key
+    return _walk_matches(
+        _GENERATOR * (e * w % _ORDER) + key * (r_high * 256 * w % _ORDER),
+        key * w, r_high * 256, 256)
+
+
+def _verify_truncated_s(key: PointJacobi, e: int, r: int,
+                        s_high: int) -> bool:
+    """Searches for the lost last byte of s.
+
+    A valid signature satisfies s * R = e * G + r * key, where R is one of
+    the points with r as x coordinate, so instead of verifying every
+    candidate s, the multiples of R are compared with the remainder.
+    """
+    target = _GENERATOR * e + key * r
+    for point in _lift_x(r):
+        remainder = target + point * ((_ORDER - s_high * 256) % _ORDER)
+        multiple = INFINITY
+        for _ in range(256):
+            if remainder == multiple:
+                return True
+            multiple = point + multiple
+    return False
+
+
+def _precomputed(point: PointJacobi) -> PointJacobi:
+    """Copy of a point that keeps its multiples, for faster multiplication."""
+    return PointJacobi(_CURVE, point.x(), point.y(), 1, _ORDER,
+                       generator=True)
+
+
+def _verify_truncated_both(key: PointJacobi, e: int, r_high: int,
+                           s_high: int) -> bool:
+    """Searches for the lost last bytes of both r and s.
+
+    For every candidate s, the candidates of r are walked as for a single
+    truncated r. Both multiplications by the inverse of s use points with
+    precomputed multiples, so every candidate s costs about as much as
+    verifying one signature.
+    """
+    base = _precomputed(_GENERATOR * e + key * (r_high * 256))
+    step = _precomputed(key)
+    for s in range(s_high * 256, s_high * 256 + 256):
+        w = inverse_mod(s, _ORDER)
+        if _walk_matches(base * w, step * w, r_high * 256, 256):
+            return True
+    return False
+
+
+def verify_signature(public_key: str, signature: str, checksum: str) -> bool:
+    """Verifies the signature of a block published by the Android client.
+
+    The client encodes r and s with 32 bytes each, but copies the first 32
+    bytes of their two's complement representation, so a component with
+    its highest bit set starts with a zero byte and loses its last one. A
+    leading zero byte can also be the sign byte of a shorter component, so
+    both readings are tried, and the lost bytes of truncated components are
+    searched for. When both components are truncated, which is the case of
+    about a quarter of the signatures, the search takes about a second.
+    """
+    try:
+        key = _public_point(public_key)
+        raw = bytes.fromhex(signature)
+        e = int(checksum, 16) % _ORDER
+    except (ValueError, AssertionError):
+        return False
+    if len(raw) != 64:
+        return False
+    r_bytes, s_bytes = raw[:32], raw[32:]
+    r = int.from_bytes(r_bytes, 'big')
+    s = int.from_bytes(s_bytes, 'big')
+    r_truncated, s_truncated = r_bytes[0] == 0, s_bytes[0] == 0
+    if not 0 < r < _ORDER or not 0 < s < _ORDER:
+        return False
+    if _verify(key, e, r, s):
+        return True
+    if r_truncated and _verify_truncated_r(key, e, r, s):
+        return True
+    if s_truncated and _verify_truncated_s(key, e, r, s):
+        return True
+    return (r_truncated and s_truncated
+            and _verify_truncated_both(key, e, r, s))
+
+
+def verify_batch(requests: List[Request]) -> List[bool]:
+    return [verify_signature(*request) for request in requests]
+
+
+class DigestVerifier:
+    """Verifies the digests of blocks in a pool of processes.
+
+    Verifications requested close together, for example by many streams
+    fetching blocks concurrently, are sent to the pool in batches so that
+    the overhead of the pool is shared. The signatures that have already
+    been verified are kept in an LRU, so blocks that are fetched again are
+    not verified twice.
+    """
+
+    def __init__(self, processes: Optional[int] = None, batch_size: int = 32,
+                 max_delay: float = 0.01, cache_size: int = 10000,
+                 executor: Optional[Executor] = None) -> None:
+        self.processes = processes
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.cache_size = cache_size
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._verified = OrderedDict()  # type: OrderedDict[Request, None]
+        self._pending = list()  # type: List[Tuple[Request, Future]]
+        self.hits = 0
+        self.valid = 0
+        self.invalid = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.processes)
+        return self._executor
+
+    def _flush(self) -> None:
+        batch, self._pending = self._pending, list()
+        if not batch:
+            return
+        results = get_event_loop().run_in_executor(
+            self._get_executor(), verify_batch,
+            [request for request, _ in batch])
+        results.add_done_callback(lambda f: self._resolve(batch, f))
+
+    @staticmethod
+    def _resolve(batch: List[Tuple[Request, Future]],
+                 results: Future) -> None:
+        error = results.exception() if not results.cancelled() else None
+        for i, (_, waiter) in enumerate(batch):
+            if waiter.done():
+                continue
+            if results.cancelled():
+                waiter.cancel()
+            elif error is not None:
+                waiter.set_exception(error)
+            else:
+                waiter.set_result(results.result()[i])
+
+    def _remember(self, request: Request) -> None:
+        self._verified[request] = None
+        if len(self._verified) > self.cache_size:
+            self._verified.popitem(last=False)
+
+    async def verify(self, block: 'Block', public_key: str) -> bool:
+        """Verifies the digest of a block with the key of its publisher."""
+        digest = block.metadata.get('digest') or ''
+        checksum = block.metadata.get('checksum')
+        if not digest.startswith(DIGEST_PREFIX) or not checksum:
+            self.invalid += 1
+            return False
+        request = (public_key, digest[len(DIGEST_PREFIX):], checksum)
+        if request in self._verified:
+            self._verified.move_to_end(request)
+            self.hits += 1
+            return True
+        loop = get_event_loop()
+        waiter = loop.create_future()
+        self._pending.append((request, waiter))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif len(self._pending) == 1:
+            loop.call_later(self.max_delay, self._flush)
+        result = await waiter
+        if result:
+            self.valid += 1
+            self._remember(request)
+        else:
+            self.invalid += 1
+        return result
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {'cached': len(self._verified), 'hits': self.hits,
+                'valid': self.valid, 'invalid': self.invalid}
+
+    def close(self) -> None:
+        if self._owns_executor and self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -0,0 +1,213 @@
+import json
+import os
+import struct
+import zlib
+from asyncio import Future, Lock, ensure_future, get_event_loop, sleep
+from typing import (BinaryIO, Dict, Iterator, List, Optional, Tuple,
+                    TYPE_CHECKING)
+
+if TYPE_CHECKING:
+    from carbon.ledger.connectors import Block
+
+SUFFIX = '.log'
+
+# Length and checksum of every record
+_RECORD = struct.Struct('<II')
+
+# Sequence of the log file of a record and position of its end in the log
+LogPosition = Tuple[int, int]
+
+
+def _encode(stream_id: str, block: 'Block') -> bytes:
+    return json.dumps({
+        'stream_id': stream_id, 'address': block.address,
+        'next_link': block.next_link, 'previous_link': block.previous_link,
+        'data': dict(block.data, samples=block.raw_samples),
+        'metadata': block.metadata}).encode()
+
+
+def _decode(payload: bytes) -> Tuple[str, 'Block']:
+    from carbon.ledger.connectors import Block
+    record = json.loads(payload.decode())
+    return record['stream_id'], Block(
+        address=record['address'], next_link=record['next_link'],
+        previous_link=record['previous_link'], data=record['data'],
+        metadata=record['metadata'])
+
+
+class WriteAheadLog:
+    """Append-only log of the blocks fetched from the ledger.
+
+    Blocks are appended before they are stored, and are only stored once the
+    log has been synced to disk. Syncs are shared: appends made within the
+    commit delay of each other wait for a single fsync. The raw samples of
+    a block are logged with it, and are parsed again when it's replayed.
+
+    The log is split in files. Every checkpoint closes the current file, and
+    the files whose blocks have all been stored can be removed once the
+    storage they were written to has been flushed.
+    """
+
+    def __init__(self, directory: str, commit_delay: float = 0.01) -> None:
+        self.directory = directory
+        self.commit_delay = commit_delay
+        os.makedirs(directory, exist_ok=True)
+        self._sequences = sorted(
+            int(name[:-len(SUFFIX)]) for name in os.listdir(directory)
+            if name.endswith(SUFFIX))  # type: List[int]
+        self._file = None  # type: Optional[BinaryIO]
+        # Records appended to every file that have not been stored yet
+        self._in_flight = dict(())  # type: Dict[int, int]
+        self._written = 0
+        self._synced = 0
+        self._waiters = list()  # type: List[Tuple[int, Future]]
+        self._group_commit = None  # type: Optional[Future]
+        self._lock = Lock()
+        self.records = 0
+        self.syncs = 0
+        self.replayed = 0
+
+    def _path(self, sequence: int) -> str:
+        return os.path.join(self.directory, f'{sequence:012d}{SUFFIX}')
+
+    def _read(self, sequence: int) -> Iterator[Tuple[str, 'Block']]:
+        """Reads the records of a file up to the first torn one.
+
+        A torn record is what is left of an append interrupted by a crash,
+        so it's truncated along with anything after it.
+        """
+        path = self._path(sequence)
+        with open(path, 'rb') as log_file:
+            content = log_file.read()
+        offset = 0
+        while offset + _RECORD.size <= len(content):
+            length, crc = _RECORD.unpack_from(content, offset)
+            payload = content[offset + _RECORD.size:
+                              offset + _RECORD.size + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            yield _decode(payload)
+            offset += _RECORD.size + length
+        if offset < len(content):
+            with open(path, 'r+b') as log_file:
+                log_file.truncate(offset)
+
+    def replay(self) -> Iterator[Tuple[str, 'Block']]:
+        """Iterates over the logged blocks and the ids of their streams.
+
+        Must be called before anything is appended to the log.
+        """
+        for sequence in list(self._sequences):
+            for stream_id, block in self._read(sequence):
+                self.replayed += 1
+                yield stream_id, block
+
+    def append(self, stream_id: str, block: 'Block') -> LogPosition:
+        """Appends a block to the log, without syncing it.
+
+        The position that is returned must be passed to applied once the
+        block has been stored.
+        """
+        if self._file is None:
+            sequence = self._sequences[-1] + 1 if self._sequences else 1
+            self._sequences.append(sequence)
+            self._file = open(self._path(sequence), 'ab')
+        sequence = self._sequences[-1]
+        payload = _encode(stream_id, block)
+        self._file.write(_RECORD.pack(len(payload), zlib.crc32(payload)))
+        self._file.write(payload)
+        self._written += _RECORD.size + len(payload)
+        self._in_flight[sequence] = self._in_flight.get(sequence, 0) + 1
+        self.records += 1
+        return sequence, self._written
+
+    async def commit(self, position: LogPosition) -> None:
+        """Waits until the log has been synced up to a position."""
+        if position[1] <= self._synced:
+            return
+        waiter = get_event_loop().create_future()
+        self._waiters.append((position[1], waiter))
+        if self._group_commit is None:
+            self._group_commit = ensure_future(self._commit_groups())
+        await waiter
+
+    def applied(self, position: LogPosition) -> None:
+        """Records that the block at a position has been stored."""
+        self._in_flight[position[0]] -= 1
+
+    async def _commit_groups(self) -> None:
+        try:
+            while self._waiters:
+                await sleep(self.commit_delay)
+                try:
+                    await self._sync(close=False)
+                except OSError as e:
+                    waiters, self._waiters = self._waiters, list()
+                    for _, waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_exception(e)
+        finally:
+            self._group_commit = None
+
+    async def _sync(self, close: bool) -> None:
+        async with self._lock:
+            if self._file is None:
+                return
+            while True:
+                position = self._written
+                self._file.flush()
+                if position > self._synced:
+                    await get_event_loop().run_in_executor(
+                        None, os.fsync, self._file.fileno())
+                    self._synced = position
+                    self.syncs += 1
+                # Blocks appended during the sync must be synced before the
+                # file is closed
+                if not close or self._written == position:
+                    break
+            if close:
+                self._file.close()
+                self._file = None
+        waiters = list()  # type: List[Tuple[int, Future]]
+        for end, waiter in self._waiters:
+            if end > self._synced:
+                waiters.append((end, waiter))
+            elif not waiter.done():
+                waiter.set_result(None)
+        self._waiters = waiters
+
+    async def rotate(self) -> List[int]:
+        """Syncs and closes the current file of the log.
+
+        Returns the files whose blocks have all been stored. They can be
+        removed once the storage has been flushed.
+        """
+        await self._sync(close=True)
+        return [sequence for sequence in self._sequences
+                if not self._in_flight.get(sequence)]
+
+    def remove(self, sequences: List[int]) -> None:
+        for sequence in sequences:
+            os.remove(self._path(sequence))
+            self._sequences.remove(sequence)
+            self._in_flight.pop(sequence, None)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {'records': self.records, 'syncs': self.syncs,
+                'replayed': self.replayed, 'files': len(self._sequences)}
+
+    def close(self, truncate: bool = False) -> None:
+        """Syncs and closes the log.
+
+        With truncate, the files whose blocks have all been stored are also
+        removed, which is only safe once the storage has been flushed.
+        """
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+        if truncate:
+            self.remove([sequence for sequence in self._sequences
+                         if not self._in_flight.get(sequence)])
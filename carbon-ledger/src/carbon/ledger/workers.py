@@ -0,0 +1,163 @@
+import hashlib
+import signal
+from bisect import bisect
+from logging import Logger
+from multiprocessing import Process, Queue
+from queue import Empty
+from time import monotonic
+from typing import (Any, Callable, Dict, Iterable, List, Optional, Tuple,
+                    TypeVar)
+
+T = TypeVar('T')
+
+
+def stable_hash(key: str) -> int:
+    """Hash of a string that is the same in every process and run."""
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hashing of keys to a set of nodes.
+
+    Every node is placed many times on the ring, so that keys are spread
+    evenly, and changing the number of nodes only moves the keys of the
+    nodes that were added or removed.
+    """
+
+    def __init__(self, nodes: Iterable[int], replicas: int = 100) -> None:
+        points = sorted((stable_hash(f'{node}:{replica}'), node)
+                        for node in nodes for replica in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key: str) -> int:
+        i = bisect(self._hashes, stable_hash(key)) % len(self._hashes)
+        return self._nodes[i]
+
+
+def shard(items: Iterable[T], key: Callable[[T], str],
+          workers: int) -> Dict[int, List[T]]:
+    """Assigns items to workers by consistent hashing of their key."""
+    ring = HashRing(range(workers))
+    shards = {worker: list() for worker in range(workers)
+              }  # type: Dict[int, List[T]]
+    for item in items:
+        shards[ring.node_for(key(item))].append(item)
+    return shards
+
+
+def merge_metrics(metrics: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Sums the numeric metrics of several workers, key by key."""
+    merged = dict(())  # type: Dict[str, Any]
+    for worker_metrics in metrics:
+        for name, value in worker_metrics.items():
+            if isinstance(value, dict):
+                merged[name] = merge_metrics([merged.get(name, {}), value])
+            elif isinstance(value, (int, float)) \
+                    and not isinstance(value, bool):
+                merged[name] = merged.get(name, 0) + value
+    return merged
+
+
+class Supervisor:
+    """Runs worker processes, restarts the ones that die and merges their
+    metrics.
+
+    Every worker runs `target(worker_id, workers, metrics_queue, *args)` and
+    reports its metrics as dicts on the queue. Workers that exit cleanly
+    are not restarted, and the supervisor returns once all of them have.
+    """
+
+    def __init__(self, workers: int, target: Callable[..., None],
+                 args: Tuple = (), log: Optional[Logger] = None,
+                 metrics_interval: float = 60,
+                 max_backoff: float = 60) -> None:
+        self.workers = workers
+        self._target = target
+        self._args = args
+        self._log = log
+        self._metrics_interval = metrics_interval
+        self._max_backoff = max_backoff
+        self._queue = Queue()  # type: Queue
+        self._processes = dict(())  # type: Dict[int, Process]
+        self._restarts = {worker: 0 for worker in range(workers)}
+        self._restart_at = dict(())  # type: Dict[int, float]
+        self._metrics = dict(())  # type: Dict[int, Dict[str, Any]]
+        self._running = False
+
+    def _start(self, worker_id: int) -> None:
+        process = Process(target=self._target, name=f'worker-{worker_id}',
+                          args=(worker_id, self.workers, self._queue)
+                          + tuple(self._args))
+        process.start()
+        self._processes[worker_id] = process
+        if self._log:
+            self._log.info(f'Started worker {worker_id} with pid '
+                           f'{process.pid}')
+
+    def _check_workers(self) -> None:
+        now = monotonic()
+        for worker_id, process in list(self._processes.items()):
+            if process.is_alive():
+                continue
+            process.join()
+            del self._processes[worker_id]
+            if process.exitcode == 0:
+                if self._log:
+                    self._log.info(f'Worker {worker_id} has finished')
+                continue
+            backoff = min(self._max_backoff,
+                          2 ** min(self._restarts[worker_id], 16))
+            self._restarts[worker_id] += 1
+            self._restart_at[worker_id] = now + backoff
+            if self._log:
+                self._log.error(f'Worker {worker_id} died with exit code '
+                                f'{process.exitcode}, restarting it in '
+                                f'{backoff} seconds')
+        for worker_id, restart_at in list(self._restart_at.items()):
+            if restart_at <= now and self._running:
+                del self._restart_at[worker_id]
+                self._start(worker_id)
+
+    def _collect_metrics(self, timeout: float) -> None:
+        try:
+            worker_id, metrics = self._queue.get(timeout=timeout)
+            self._metrics[worker_id] = metrics
+            while True:
+                worker_id, metrics = self._queue.get_nowait()
+                self._metrics[worker_id] = metrics
+        except Empty:
+            pass
+
+    @property
+    def metrics(self) -> Dict[str, Any]:
+        merged = merge_metrics(self._metrics.values())
+        merged['workers'] = len(self._processes)
+        merged['restarts'] = sum(self._restarts.values())
+        return merged
+
+    def stop(self, *_: Any) -> None:
+        self._running = False
+
+    def run(self) -> None:
+        self._running = True
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for worker_id in range(self.workers):
+            self._start(worker_id)
+        reported_at = monotonic()
+        while self._running and (self._processes or self._restart_at):
+            self._collect_metrics(timeout=1)
+            self._check_workers()
+            if self._log and monotonic() - reported_at >= \
+                    self._metrics_interval:
+                reported_at = monotonic()
+                self._log.info(f'Worker metrics: {self.metrics}')
+        # Let the workers save their state before exiting. The queue must be
+        # drained meanwhile, or workers could block while exiting.
+        for process in self._processes.values():
+            process.terminate()
+        while any(process.is_alive() for process in self._processes.values()):
+            self._collect_metrics(timeout=0.1)
+        for process in self._processes.values():
+            process.join()
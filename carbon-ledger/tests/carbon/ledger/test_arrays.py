@@ -0,0 +1,20 @@
+import pytest
+
+from carbon.ledger.arrays import split_samples
+
+
+def test_split_samples() -> None:
+    assert split_samples(['a 1 2', 'b,c=d 3 4']) == (
+        ['a', 'b,c=d'], ['1', '3'], ['2', '4'])
+
+
+def test_split_samples_with_spaces_in_keys() -> None:
+    # Same number of fields in total as two well formed samples
+    assert split_samples(['a b 1 2', 'c 3 4']) == (
+        ['a b', 'c'], ['1', '3'], ['2', '4'])
+
+
+def test_split_malformed_samples() -> None:
+    with pytest.raises(ValueError):
+        # Same number of fields in total as two well formed samples
+        split_samples(['a b 1 2', '3 4'])
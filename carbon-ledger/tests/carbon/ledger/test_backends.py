@@ -0,0 +1,72 @@
+from pathlib import Path
+from typing import Any, Iterator
+
+import pytest
+
+from carbon.ledger.backends import SQLite, StorageBackend, get_backend
+from carbon.ledger.checkpoints import BackendCheckpointStore, Checkpoint
+from carbon.ledger.connectors import Block
+
+
+def block(address: str, next_link: str = '') -> Block:
+    return Block(address=address, next_link=next_link, previous_link='',
+                 data={'samples': ['metric 1600000000 1',
+                                   'metric 1600000060 2']},
+                 metadata={'digest': 'digest:ABC'})
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request: Any, tmp_path: Path) -> Iterator[StorageBackend]:
+    backend_type = get_backend(request.param)
+    backend = (backend_type(str(tmp_path / 'blocks.db'))
+               if backend_type is SQLite
+               else backend_type())
+    yield backend
+    backend.close()
+
+
+def test_put_and_get(backend: StorageBackend) -> None:
+    assert backend.get('A0') is None and 'A0' not in backend
+    backend.put(block('A0', 'A1'), 'A0')
+    backend.put(block('A1'), 'A0')
+    backend.put(block('B0'), 'B0')
+    # Storing a block again doesn't count it twice
+    backend.put(block('A1'), 'A0')
+    assert 'A0' in backend
+    assert (backend.count('A0'), backend.count('B0'),
+            backend.count('C0')) == (2, 1, 0)
+    stored = backend.get('A0')
+    assert stored.next_link == 'A1'
+    assert stored.raw_samples == ['metric 1600000000 1',
+                                  'metric 1600000060 2']
+    assert stored.metadata == {'digest': 'digest:ABC'}
+    assert sorted(stored.address
+                  for stored in backend.blocks('A0')) == ['A0', 'A1']
+
+
+def test_checkpoints(backend: StorageBackend) -> None:
+    store = BackendCheckpointStore(backend)
+    assert store.load('A0') is None
+    checkpoint = Checkpoint('A0', head='A4', tail='A0', head_position=4,
+                            sample_offset=10, gaps=['A2'])
+    store.save([checkpoint])
+    assert store.load('A0').same_frontier(checkpoint)
+    store.save([Checkpoint('A0', head='A5', tail='A0', head_position=5)])
+    assert store.load('A0').head == 'A5'
+
+
+def test_keep_blocks_after_restart(tmp_path: Path) -> None:
+    path = str(tmp_path / 'blocks.db')
+    backend = SQLite(path)
+    backend.put(block('A0', 'A1'), 'A0')
+    backend.flush()
+    backend.close()
+
+    backend = SQLite(path)
+    try:
+        assert backend.get('A0').next_link == 'A1'
+        assert backend.count('A0') == 1
+        # The samples are parsed again when the block is loaded
+        assert backend.get('A0').sample_count == 2
+    finally:
+        backend.close()
@@ -0,0 +1,95 @@
+import logging
+from time import sleep
+
+from carbon.ledger.cache import BlockCache, NegativeCache
+from carbon.ledger.connectors import Block, LedgerConnector, Stream
+from carbon.ledger.protocols import HermesPlaintextParser
+
+
+class EmptyConnector(LedgerConnector):
+    """Ledger without any block."""
+
+    def __init__(self) -> None:
+        super().__init__(HermesPlaintextParser())
+
+    def fetch(self, address: str, log: logging.Logger) -> Block:
+        raise LedgerConnector.NoDataFetched()
+
+
+def block(address: str) -> Block:
+    return Block(address=address, next_link='', previous_link='',
+                 data={'samples': ['metric 1600000000 1']}, metadata={})
+
+
+def test_evict_least_recently_used() -> None:
+    cache = BlockCache(max_entries=3)
+    for address in ['A', 'B', 'C']:
+        cache.put(block(address))
+    assert cache.get('A') is not None
+    cache.put(block('D'))
+    assert 'B' not in cache, 'Least recently used block not evicted'
+    assert [address for address in 'ACD' if address in cache] == ['A', 'C',
+                                                                  'D']
+    assert cache.stats['evictions'] == 1
+    assert cache.get('B') is None
+    assert (cache.stats['hits'], cache.stats['misses']) == (1, 1)
+
+    # Putting a block again doesn't count it twice
+    size = cache.size_bytes
+    cache.put(block('D'))
+    assert cache.size_bytes == size
+
+    cache = BlockCache(max_bytes=size)
+    for address in ['E', 'F', 'G', 'H']:
+        cache.put(block(address))
+    assert len(cache) == 3 and cache.size_bytes <= size
+
+
+def test_keep_pinned_blocks() -> None:
+    cache = BlockCache(max_entries=2)
+    cache.put(block('A'))
+    cache.pin('A')
+    for address in ['B', 'C', 'D']:
+        cache.put(block(address))
+    assert 'A' in cache, 'Pinned block evicted'
+    assert len(cache) == 2 and 'D' in cache, \
+        'Pinned block not counted in the budget'
+    cache.unpin('A')
+    cache.put(block('E'))
+    assert 'A' not in cache, 'Unpinned block not evicted'
+    assert 'D' in cache
+
+
+def test_share_root_pin() -> None:
+    cache = BlockCache(max_entries=2)
+    logger = logging.getLogger(__name__)
+    # Two streams follow the same root
+    streams = [Stream(EmptyConnector(), 'A0', logger, cache=cache)
+               for _ in range(2)]
+    for stream in streams:
+        stream.replay(block('A0'))
+    # An iterator of one of them pins the root while reading ahead
+    cache.pin('A0')
+    cache.unpin('A0')
+    for address in ['A1', 'A2', 'A3']:
+        cache.put(block(address))
+    assert 'A0' in cache, 'Root unpinned by the read-ahead of a stream'
+    assert cache.stats['pinned'] == 1
+
+
+def test_negative_cache_expiry() -> None:
+    cache = NegativeCache(ttl=0.05, max_entries=2)
+    cache.add('A')
+    cache.add('B', ttl=10)
+    assert 'A' in cache and 'B' in cache
+    sleep(0.06)
+    assert 'A' not in cache, 'Entry kept after its TTL'
+    assert 'B' in cache
+    assert len(cache) == 1, 'Expired entry not dropped'
+    assert cache.hits == 3
+
+    cache.add('C')
+    cache.add('D')
+    assert 'B' not in cache, 'Oldest entry kept over the limit'
+    cache.discard('C')
+    assert 'C' not in cache and 'D' in cache
@@ -0,0 +1,88 @@
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+from carbon.ledger.arrays import SampleBatch, TagDictionary, parse_samples
+from carbon.ledger.compaction import Compactor, RetentionPolicy
+from carbon.ledger.segments import SegmentArchive
+
+
+def archive_samples(archive: SegmentArchive, samples: List[str]) -> None:
+    archive.add(parse_samples(samples, TagDictionary()))
+    archive.flush()
+
+
+def read_archive(archive: SegmentArchive) -> SampleBatch:
+    dictionary = TagDictionary()
+    return SampleBatch.concatenate(archive.read(dictionary=dictionary),
+                                   dictionary)
+
+
+def test_downsample_late_samples(tmp_path: Path) -> None:
+    archive = SegmentArchive(str(tmp_path), 'stream')
+    compactor = Compactor(archive, RetentionPolicy(downsample_after=100,
+                                                   downsample_interval=10),
+                          min_segments=1)
+    archive_samples(archive, [f'metric {i} {i}' for i in range(10)])
+    compactor.compact(now=1000)
+    downsampled = read_archive(archive)
+    assert downsampled.values.tolist() == [4.5]
+    assert downsampled.sample_counts.tolist() == [10]
+
+    # Samples that arrive after their interval was downsampled
+    archive_samples(archive, ['metric 3 100', 'metric 5 100'])
+    compactor.compact(now=1000)
+    downsampled = read_archive(archive)
+    assert downsampled.timestamps.tolist() == [0]
+    assert np.isclose(downsampled.values[0], (45 + 200) / 12), \
+        'Late samples not weighted like the downsampled ones'
+    assert downsampled.sample_counts.tolist() == [12]
+
+    # Downsampling again changes nothing
+    compactor.compact(now=2000)
+    assert read_archive(archive).sample_counts.tolist() == [12]
+
+
+def test_compact_after_restart(tmp_path: Path) -> None:
+    policy = RetentionPolicy(downsample_after=100, downsample_interval=10)
+    for samples in (['metric 0 1', 'metric 1 2'], ['metric 2 3']):
+        # Every process gets the same id, as in a container
+        archive = SegmentArchive(str(tmp_path), 'stream')
+        archive_samples(archive, samples)
+        Compactor(archive, policy, min_segments=1).compact(now=1000)
+    downsampled = read_archive(archive)
+    assert downsampled.sample_counts.tolist() == [3], \
+        'Compaction replaced a segment of the previous process'
+    assert downsampled.values.tolist() == [2]
+
+
+def test_skip_replayed_blocks(tmp_path: Path) -> None:
+    policy = RetentionPolicy(downsample_after=100, downsample_interval=10)
+    block = parse_samples([f'metric {i} {i}' for i in range(10)],
+                          TagDictionary())
+    archive = SegmentArchive(str(tmp_path), 'stream')
+    archive.add(block, 'A0')
+    archive.flush()
+    Compactor(archive, policy, min_segments=1).compact(now=1000)
+    assert read_archive(archive).sample_counts.tolist() == [10]
+
+    # After a restart, the block is replayed from the write-ahead log along
+    # with a block that came late
+    archive = SegmentArchive(str(tmp_path), 'stream')
+    compactor = Compactor(archive, policy, min_segments=1)
+    archive.add(block, 'A0')
+    archive.add(parse_samples(['metric 5 100'], TagDictionary()), 'A1')
+    archive.flush()
+    assert archive.skipped_blocks == 1
+    compactor.compact(now=1000)
+    compactor.compact(now=2000)
+    downsampled = read_archive(archive)
+    assert downsampled.sample_counts.tolist() == [11], \
+        'Samples of a replayed block counted twice'
+    assert np.isclose(downsampled.values[0], (45 + 100) / 11)
+
+    # Compacted segments still list the blocks they come from
+    archive = SegmentArchive(str(tmp_path), 'stream')
+    archive.add(block, 'A0')
+    assert archive.skipped_blocks == 1
@@ -0,0 +1,366 @@
+import logging
+from asyncio import (CancelledError, ensure_future, gather, new_event_loop,
+                     sleep)
+from pathlib import Path
+from random import Random
+from typing import Any, Dict, List, Tuple
+
+from iota import (Address, BundleHash, Fragment, Nonce, Tag, Transaction,
+                  TransactionHash, TryteString)
+
+from carbon.ledger.backends import SQLite
+from carbon.ledger.cache import BlockCache
+from carbon.ledger.connectors import (AsyncIOTAConnector,
+                                      AsyncLedgerConnector, Block,
+                                      LedgerConnector, Stream)
+from carbon.ledger.nodes import Node, NodePool
+from carbon.ledger.polling import PollingInterval
+from carbon.ledger.protocols import HermesPlaintextParser
+from carbon.ledger.scheduler import Priority
+from carbon.ledger.trytes import ADDRESS, FRAGMENT_LENGTH, TRYTE_ALPHABET
+
+
+class ChainConnector(AsyncLedgerConnector):
+    """Serves a chain of blocks from memory, a bit slower than the consumer."""
+
+    def __init__(self, length: int) -> None:
+        super().__init__(HermesPlaintextParser())
+        self.blocks = {
+            f'A{i}': Block(address=f'A{i}', next_link=f'A{i + 1}',
+                           previous_link=f'A{i - 1}' if i else '',
+                           data={'samples': [f'metric {1600000000 + i} {i}']},
+                           metadata={})
+            for i in range(length)}  # type: Dict[str, Block]
+        self.fetches = list()  # type: List[str]
+
+    async def fetch(self, address: str, log: logging.Logger,
+                    priority: Priority = Priority.FOLLOW) -> Block:
+        self.fetches.append(address)
+        await sleep(0.01)
+        if address not in self.blocks:
+            raise AsyncLedgerConnector.NoDataFetched()
+        return self.blocks[address]
+
+
+class TaggedChainConnector(ChainConnector):
+    """Chain whose blocks are found by tag, along with blocks of others."""
+
+    def __init__(self, length: int, tagged: List[str]) -> None:
+        super().__init__(length)
+        self.blocks['B1'] = Block(address='B1', next_link='B2',
+                                  previous_link='B0',
+                                  data={'samples': ['other 1600000000 1']},
+                                  metadata={})
+        self.tagged = tagged
+
+    async def fetch_by_tag(self, tag: str, log: logging.Logger,
+                           priority: Priority = Priority.BACKFILL
+                           ) -> Dict[str, Block]:
+        return {address: self.blocks[address] for address in self.tagged}
+
+
+class TangleNodePool(NodePool):
+    """Node that serves IOTA transactions from memory, in a random order.
+
+    The transactions of every block span a few fragments, and the requests
+    that are sent to the node are recorded with the number of items asked.
+    """
+
+    def __init__(self, length: int) -> None:
+        super().__init__(['http://tangle'], hedge=False)
+        self._random = Random(0)
+        self.addresses = [self._trytes(81) for _ in range(length)]
+        self.transactions = dict(())  # type: Dict[str, str]
+        for i, address in enumerate(self.addresses):
+            samples = [f'metric;block={i} {1600000000 + j} {j}'
+                       for j in range(100)]
+            message = '::'.join(
+                ['digest:ABCDEF', self._link(i + 1), self._link(i - 1)]
+                + samples)
+            self._add_bundle(address, str(TryteString.from_unicode(message)))
+        self.requests = list()  # type: List[Tuple[str, int]]
+
+    def _trytes(self, length: int) -> str:
+        return ''.join(chr(self._random.choice(TRYTE_ALPHABET))
+                       for _ in range(length))
+
+    def _link(self, i: int) -> str:
+        if 0 <= i < len(self.addresses):
+            return self.addresses[i]
+        return ''
+
+    def _add_bundle(self, address: str, message: str) -> None:
+        fragments = [message[i:i + FRAGMENT_LENGTH]
+                     for i in range(0, len(message), FRAGMENT_LENGTH)]
+        bundle = BundleHash(self._trytes(81))
+        for index, fragment in enumerate(fragments):
+            transaction = Transaction(
+                hash_=TransactionHash(self._trytes(81)),
+                signature_message_fragment=Fragment(
+                    fragment.ljust(FRAGMENT_LENGTH, '9')),
+                address=Address(address), value=0, timestamp=0,
+                current_index=index, last_index=len(fragments) - 1,
+                bundle_hash=bundle,
+                trunk_transaction_hash=TransactionHash(''),
+                branch_transaction_hash=TransactionHash(''),
+                tag=Tag(''), attachment_timestamp=0,
+                attachment_timestamp_lower_bound=0,
+                attachment_timestamp_upper_bound=0, nonce=Nonce(''),
+                legacy_tag=Tag(''))
+            self.transactions[str(transaction.hash)] = str(
+                transaction.as_tryte_string())
+
+    async def _send(self, node: Node, payload: Dict[str, Any],
+                    headers: Dict[str, str]) -> Dict:
+        command = payload['command']
+        await sleep(self._random.random() * 0.01)
+        if command == 'findTransactions':
+            addresses = payload['addresses']
+            self.requests.append((command, len(addresses)))
+            return {'hashes': [
+                transaction_hash for transaction_hash, trytes
+                in self.transactions.items() if trytes[ADDRESS] in addresses]}
+        self.requests.append((command, len(payload['hashes'])))
+        return {'trytes': [self.transactions[transaction_hash]
+                           for transaction_hash in payload['hashes']]}
+
+
+class StoredChainConnector(LedgerConnector):
+    """Ledger without any block other than the ones already stored."""
+
+    def __init__(self) -> None:
+        super().__init__(HermesPlaintextParser())
+
+    def fetch(self, address: str, log: logging.Logger) -> Block:
+        raise LedgerConnector.NoDataFetched()
+
+
+def test_stop_iterating_partway() -> None:
+    cache = BlockCache()
+    stream = Stream(ChainConnector(50), 'A0', logging.getLogger(__name__),
+                    window_size=8, cache=cache)
+
+    async def consume_some() -> Stream.AsyncLazyIterator:
+        async with stream.__aiter__() as blocks:
+            async for block in blocks:
+                await sleep(0.005)
+                if block.address == 'A3':
+                    break
+        return blocks
+
+    event_loop = new_event_loop()
+    try:
+        blocks = event_loop.run_until_complete(consume_some())
+        # Give a task that was left behind the chance to keep reading
+        event_loop.run_until_complete(sleep(0.1))
+    finally:
+        event_loop.close()
+    assert blocks._read_ahead_task is None, 'Read-ahead task not stopped'
+    # Only the root of the stream stays pinned
+    assert cache.stats['pinned'] == 1, 'Read-ahead blocks still pinned'
+    assert len(cache) < 20, 'Read-ahead task kept walking the stream'
+
+
+def test_query_stream_after_restart(tmp_path: Path) -> None:
+    blocks = ChainConnector(5).blocks
+    path = str(tmp_path / 'blocks.db')
+    backend = SQLite(path)
+    stream = Stream(StoredChainConnector(), 'A0',
+                    logging.getLogger(__name__), backend=backend)
+    for address in ['A0', 'A1', 'A2', 'A3', 'A4']:
+        stream.replay(blocks[address])
+    list(stream)
+    checkpoint = stream.checkpoint()
+    backend.close()
+
+    backend = SQLite(path)
+    stream = Stream(StoredChainConnector(), 'A0',
+                    logging.getLogger(__name__), backend=backend)
+    stream.restore(checkpoint)
+    try:
+        assert len(stream) == 5
+        assert [block.address for block in stream[:]] == [
+            'A0', 'A1', 'A2', 'A3', 'A4'], 'Stored blocks not indexed'
+        assert [block.address for block in stream.range(
+            1600000001, 1600000003)] == ['A1', 'A2']
+        assert str(stream.sample(4)) == 'metric 1600000004 4'
+        assert stream.latest_address == 'A4'
+    finally:
+        backend.close()
+
+
+def test_coalesce_fetches() -> None:
+    connector = ChainConnector(3)
+    stream = Stream(connector, 'A0', logging.getLogger(__name__))
+
+    async def fetch_concurrently() -> List[Block]:
+        waiters = [ensure_future(stream._async_fetch('A1'))
+                   for _ in range(3)]
+        await sleep(0)
+        # One of the consumers gives up while the block is fetched
+        waiters[0].cancel()
+        return await gather(*waiters, return_exceptions=True)
+
+    event_loop = new_event_loop()
+    try:
+        results = event_loop.run_until_complete(fetch_concurrently())
+    finally:
+        event_loop.close()
+    assert connector.fetches == ['A1'], 'Same address fetched twice'
+    assert isinstance(results[0], CancelledError)
+    assert [block.address for block in results[1:]] == ['A1', 'A1'], \
+        'Cancelled waiter cancelled the fetch of the others'
+    assert not stream._in_flight
+    assert stream._get('A1') is not None
+
+
+def test_skip_empty_address_until_next_poll() -> None:
+    connector = ChainConnector(3)
+    tail = connector.blocks.pop('A2')
+    polling = PollingInterval(min_interval=0.1, max_interval=1)
+    stream = Stream(connector, 'A0', logging.getLogger(__name__),
+                    polling=polling)
+
+    async def poll_tail() -> List[Block]:
+        blocks = [await stream._async_fetch('A2', latest=True)
+                  for _ in range(3)]
+        # The block is published before the next poll
+        connector.blocks['A2'] = tail
+        await sleep(0.9 * polling.interval)
+        blocks.append(await stream._async_fetch('A2', latest=True))
+        return blocks
+
+    event_loop = new_event_loop()
+    try:
+        blocks = event_loop.run_until_complete(poll_tail())
+    finally:
+        event_loop.close()
+    assert blocks[:3] == [None, None, None]
+    assert stream.caught_up
+    assert blocks[3] is tail, 'Empty address skipped past the next poll'
+    assert connector.fetches == ['A2', 'A2'], \
+        'Empty address requested again before the next poll'
+
+
+def test_backfill_linked_blocks() -> None:
+    connector = TaggedChainConnector(8, ['A0', 'A1', 'A2', 'B1', 'A6'])
+    # A gap in the ledger, the blocks after it are not linked to the root
+    del connector.blocks['A5']
+    stream = Stream(connector, 'A0', logging.getLogger(__name__))
+    # Blocks already stored link the candidates too
+    other_stream = Stream(TaggedChainConnector(8, ['A0', 'A1', 'A4']), 'A0',
+                          logging.getLogger(__name__))
+    for address in ['A2', 'A3']:
+        other_stream.replay(connector.blocks[address])
+
+    event_loop = new_event_loop()
+    try:
+        stored = event_loop.run_until_complete(
+            stream.backfill(['A3', 'A4', 'A5', 'A7'], tag='TAG'))
+        other_stored = event_loop.run_until_complete(
+            other_stream.backfill(tag='TAG'))
+    finally:
+        event_loop.close()
+    assert stored == 5
+    assert sorted(connector.fetches) == ['A3', 'A4', 'A5', 'A7']
+    assert [address for address in connector.blocks
+            if stream._get(address) is not None] == [
+        'A0', 'A1', 'A2', 'A3', 'A4'], 'Unlinked candidates stored'
+    assert other_stored == 3
+
+
+def test_fetch_many_in_chunks() -> None:
+    pool = TangleNodePool(5)
+    connector = AsyncIOTAConnector(protocol=HermesPlaintextParser(),
+                                   batch_size=2, trytes_chunk_size=2,
+                                   node_pool=pool)
+    logger = logging.getLogger(__name__)
+
+    async def fetch() -> Tuple[Dict[str, Block], Block]:
+        return (await connector.fetch_many(pool.addresses + [''], logger),
+                await connector.fetch(pool.addresses[2], logger))
+
+    event_loop = new_event_loop()
+    try:
+        blocks, block = event_loop.run_until_complete(fetch())
+    finally:
+        event_loop.close()
+    assert list(blocks) == pool.addresses
+    for i, address in enumerate(pool.addresses):
+        assert blocks[address].next_link == pool._link(i + 1)
+        assert blocks[address].previous_link == pool._link(i - 1)
+        assert blocks[address].raw_samples[-1] == \
+            f'metric;block={i} 1600000099 99'
+    # The fragments of a block can arrive in any order
+    assert block.raw_samples == blocks[pool.addresses[2]].raw_samples
+    assert len(block.raw_samples) == 100
+
+    finds = [count for command, count in pool.requests
+             if command == 'findTransactions']
+    assert sorted(finds) == [1, 1, 2, 2], 'Addresses not requested in batches'
+    chunks = [count for command, count in pool.requests
+              if command == 'getTrytes']
+    assert max(chunks) == 2, 'Transactions not requested in chunks'
+    fragments = len(pool.transactions) // 5
+    assert fragments > 2
+    assert sum(chunks) == len(pool.transactions) + fragments
+
+
+def test_fetch_only_blocks_not_stored(tmp_path: Path) -> None:
+    connector = ChainConnector(3)
+    path = str(tmp_path / 'blocks.db')
+
+    async def walk_stream(stream: Stream) -> List[str]:
+        return [block.address async for block in stream]
+
+    event_loop = new_event_loop()
+    try:
+        backend = SQLite(path)
+        stream = Stream(connector, 'A0', logging.getLogger(__name__),
+                        backend=backend)
+        event_loop.run_until_complete(walk_stream(stream))
+        backend.close()
+        assert connector.fetches == ['A0', 'A1', 'A2', 'A3']
+
+        # After a restart, the stream is walked from the stored blocks
+        connector.fetches = list()
+        connector.blocks.update(ChainConnector(4).blocks)
+        backend = SQLite(path)
+        stream = Stream(connector, 'A0', logging.getLogger(__name__),
+                        backend=backend)
+        try:
+            addresses = event_loop.run_until_complete(walk_stream(stream))
+        finally:
+            backend.close()
+    finally:
+        event_loop.close()
+    assert addresses == ['A0', 'A1', 'A2', 'A3']
+    assert connector.fetches == ['A3', 'A4'], 'Stored blocks fetched again'
+
+
+def test_walk_stream_both_ways() -> None:
+    pool = TangleNodePool(4)
+    connector = AsyncIOTAConnector(protocol=HermesPlaintextParser(),
+                                   node_pool=pool)
+    stream = Stream(connector, pool.addresses[0],
+                    logging.getLogger(__name__), window_size=2)
+
+    async def walk_stream() -> Tuple[List[str], List[str]]:
+        forward = [block.address async for block in stream]
+        backward = [block.address
+                    async for block in stream.async_reversed()]
+        await connector.close()
+        return forward, backward
+
+    event_loop = new_event_loop()
+    try:
+        forward, backward = event_loop.run_until_complete(walk_stream())
+    finally:
+        event_loop.close()
+    assert forward == pool.addresses
+    assert stream.latest_address == pool.addresses[-1]
+    assert backward == pool.addresses[::-1]
+    assert stream.processed_samples == 400
+    # Every block was fetched once, the walk back reads them from the cache
+    assert [command for command, _ in pool.requests].count(
+        'findTransactions') == 4
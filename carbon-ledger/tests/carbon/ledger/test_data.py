@@ -0,0 +1,17 @@
+import logging
+
+from carbon.ledger.connectors import Block
+from carbon.ledger.protocols import HermesPlaintextParser
+
+
+def test_release_raw_samples() -> None:
+    samples = ['temperature;room=a 1600000000123 21.50',
+               'temperature;room=b 1600000000 2.1e1']
+    block = Block(address='A', next_link='', previous_link='',
+                  data={'samples': list(samples)}, metadata={})
+    HermesPlaintextParser.parse_data(block, logging.getLogger(__name__))
+    assert [packet.data for packet in block.samples] == ['21.50', '2.1e1']
+    assert block.release_raw(), 'Raw samples not released'
+    assert 'samples' not in block.data
+    assert block.raw_samples == samples, 'Raw samples changed'
+    assert block.sample_count == 2
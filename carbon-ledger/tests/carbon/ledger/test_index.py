@@ -0,0 +1,56 @@
+from carbon.ledger.index import TimeIndex
+
+
+def add_block(index: TimeIndex, i: int, prefix: str = 'A') -> None:
+    index.add(f'{prefix}{i}', f'{prefix}{i + 1}',
+              f'{prefix}{i - 1}' if i else '', 100 * i, 100 * i + 99, 10)
+
+
+def test_add_blocks_in_any_order() -> None:
+    index = TimeIndex('A0')
+    for i in reversed(range(1, 1000)):
+        add_block(index, i)
+    assert len(index) == 0, 'Blocks indexed before being linked to the root'
+    add_block(index, 0)
+    assert len(index) == 1000
+    assert index.position('A999') == 999
+    assert index.sample_count == 10000
+    assert index.addresses_between(250, 450) == ['A2', 'A3', 'A4']
+
+
+def test_drop_unlinked_blocks() -> None:
+    index = TimeIndex('A0', max_pending=10)
+    for i in range(100):
+        add_block(index, i, prefix='B')
+    add_block(index, 0)
+    assert len(index) == 1
+    assert len(index._pending) == 10, 'Unlinked blocks were not dropped'
+    assert not set(index._waiting) - {'B89', 'B90', 'B91', 'B92', 'B93',
+                                      'B94', 'B95', 'B96', 'B97', 'B98',
+                                      'B99', 'B100'}
+
+
+def test_skip_forks() -> None:
+    index = TimeIndex('A0')
+    add_block(index, 0)
+    index.add('FORK', 'A2', 'A0', 0, 0, 1)
+    add_block(index, 1)
+    add_block(index, 2)
+    # The fork is positioned as soon as it's added, before A1
+    assert [index.address_at(i) for i in range(len(index))] == [
+        'A0', 'FORK', 'A2']
+    assert 'A1' not in index and not index._pending
+
+
+def test_lookups_while_adding() -> None:
+    index = TimeIndex('A0')
+    # Following the stream from the middle, then backfilling it
+    index.anchor('A500', 500)
+    for i in list(range(500, 1000)) + list(reversed(range(500))):
+        add_block(index, i)
+        assert index.sample_count == 10 * len(index)
+        assert index.address_at(-1) == f'A{i if i >= 500 else 999}'
+    assert [index.address_at(i) for i in range(len(index))] == [
+        f'A{i}' for i in range(1000)]
+    assert index.locate_sample(5005) == ('A500', 5)
+    assert index.addresses_between(250, 450) == ['A2', 'A3', 'A4']
@@ -0,0 +1,35 @@
+from asyncio import new_event_loop, sleep
+from typing import Any, Dict, List
+
+from carbon.ledger.nodes import Node, NodePool
+from carbon.ledger.scheduler import Scheduler
+
+
+class SlowNodePool(NodePool):
+    """Pool whose first node is much slower than usual."""
+
+    def __init__(self, scheduler: Scheduler) -> None:
+        super().__init__(['http://slow', 'http://fast'], scheduler=scheduler)
+        for node in self.nodes:
+            for _ in range(20):
+                node.record_success(0.01)
+        self.running = list()  # type: List[int]
+
+    async def _send(self, node: Node, payload: Dict[str, Any],
+                    headers: Dict[str, str]) -> Dict:
+        self.running.append(self.scheduler.running)
+        await sleep(1 if node.url == 'http://slow' else 0.01)
+        return {'node': node.url}
+
+
+def test_hedged_request_takes_its_own_slot() -> None:
+    scheduler = Scheduler(max_concurrency=4)
+    pool = SlowNodePool(scheduler)
+    event_loop = new_event_loop()
+    try:
+        response = event_loop.run_until_complete(pool.request('getNodeInfo'))
+    finally:
+        event_loop.close()
+    assert response == {'node': 'http://fast'}, 'Request was not hedged'
+    assert pool.running == [1, 2], 'Hedged request did not take a slot'
+    assert scheduler.running == 0, 'Slots were not released'
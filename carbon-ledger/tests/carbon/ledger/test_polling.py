@@ -0,0 +1,30 @@
+from time import sleep
+
+from carbon.ledger.polling import PollingInterval
+
+
+def test_back_off_idle_stream() -> None:
+    polling = PollingInterval(min_interval=0.001, max_interval=1)
+    assert polling.interval == 0.001
+    polling.record_miss()
+    polling.record_miss()
+    assert polling.interval == 0.004
+
+    # A few polls per publishing period once blocks keep coming
+    polling.record_block()
+    sleep(0.04)
+    polling.record_block()
+    assert polling.period >= 0.04
+    interval = polling.interval
+    assert 0.01 <= interval < 0.02
+    # Polls that miss blocks of the current period are expected
+    for _ in range(4):
+        polling.record_miss()
+    assert polling.interval == interval
+    polling.record_miss()
+    assert polling.interval == 2 * interval
+    for _ in range(100):
+        polling.record_miss()
+    assert polling.interval == 1, 'Interval grew past its maximum'
+    polling.record_block()
+    assert polling.interval < 0.1, 'Interval kept after a new block'
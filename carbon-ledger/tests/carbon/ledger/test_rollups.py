@@ -0,0 +1,132 @@
+import logging
+from pathlib import Path
+from typing import List, Tuple
+
+from carbon.ledger.arrays import SampleBatch, TagDictionary, parse_samples
+from carbon.ledger.connectors import Block, LedgerConnector, Stream
+from carbon.ledger.protocols import HermesPlaintextParser
+from carbon.ledger.rollups import Aggregates, RollupStore
+
+
+class EmptyConnector(LedgerConnector):
+    """Ledger without any block."""
+
+    def __init__(self) -> None:
+        super().__init__(HermesPlaintextParser())
+
+    def fetch(self, address: str, log: logging.Logger) -> Block:
+        raise LedgerConnector.NoDataFetched()
+
+
+def batch(*samples: str) -> SampleBatch:
+    return parse_samples(list(samples), TagDictionary())
+
+
+def rows(aggregates: Aggregates) -> List[Tuple[str, int, int, float]]:
+    return list(zip(aggregates.keys, aggregates.timestamps.tolist(),
+                    aggregates.count.tolist(), aggregates.sum.tolist()))
+
+
+def buckets(rollups: RollupStore) -> List[Tuple[str, int, int, float]]:
+    return rows(rollups.query('A0', 0, 10 ** 10))
+
+
+def test_skip_blocks_rolled_up(tmp_path: Path) -> None:
+    path = str(tmp_path / 'rollups.db')
+    rollups = RollupStore(path, resolutions=(60,))
+    assert rollups.add('A0', 'A1', batch('metric 0 1', 'metric 30 2'))
+    assert not rollups.add('A0', 'A1', batch('metric 0 1', 'metric 30 2'))
+    assert buckets(rollups) == [('metric', 0, 2, 3.0)]
+    rollups.close()
+
+    # A block replayed after a restart
+    rollups = RollupStore(path, resolutions=(60,))
+    try:
+        assert not rollups.add('A0', 'A1', batch('metric 0 1'))
+        assert rollups.add('A0', 'A2', batch('metric 10 3'))
+        assert rollups.skipped_blocks == 1
+        assert buckets(rollups) == [('metric', 0, 3, 6.0)]
+    finally:
+        rollups.close()
+
+
+def test_flush_again(tmp_path: Path) -> None:
+    path = str(tmp_path / 'rollups.db')
+    rollups = RollupStore(path, resolutions=(60,), cache_size=2)
+    rollups.add('A0', 'A1', batch('metric 0 1', 'other 0 2'))
+    rollups.flush()
+    rollups.flush()
+    assert rollups.flushes == 1, 'Nothing to flush, but flushed again'
+    assert buckets(rollups) == [('metric', 0, 1, 1.0), ('other', 0, 1, 2.0)]
+
+    # Flushed buckets are evicted, and merged with the stored ones when
+    # they are updated again
+    rollups.add('A0', 'A2', batch(*[f'metric {60 * i} 1'
+                                    for i in range(1, 5)]))
+    assert len(rollups._buckets) == 4, 'Updated buckets evicted'
+    rollups.flush()
+    assert len(rollups._buckets) == 2
+    rollups.add('A0', 'A3', batch('metric 1 1'))
+    rollups.flush(sync=True)
+    rollups.flush(sync=True)
+    rollups.close()
+
+    rollups = RollupStore(path, resolutions=(60,))
+    try:
+        assert buckets(rollups)[:2] == [('metric', 0, 2, 2.0),
+                                        ('metric', 60, 1, 1.0)]
+        assert len(buckets(rollups)) == 6
+    finally:
+        rollups.close()
+
+
+def test_query_intervals(tmp_path: Path) -> None:
+    rollups = RollupStore(str(tmp_path / 'rollups.db'),
+                          resolutions=(60, 3600))
+    # One sample every 30 minutes for two hours, and one of another key
+    rollups.add('A0', 'A1', batch(*[f'metric {1800 * i} {i}'
+                                    for i in range(4)], 'other 4000 10'))
+    try:
+        for flush in (False, True):
+            if flush:
+                rollups.flush()
+            assert rows(rollups.query('A0', 0, 7200, keys=['metric'])) == [
+                ('metric', 0, 1, 0.0), ('metric', 1800, 1, 1.0),
+                ('metric', 3600, 1, 2.0), ('metric', 5400, 1, 3.0)]
+            hours = rollups.query('A0', 0, 7200, interval=3600)
+            assert rows(hours) == [('metric', 0, 2, 1.0),
+                                   ('metric', 3600, 2, 5.0),
+                                   ('other', 3600, 1, 10.0)]
+            assert (hours.min.tolist(), hours.max.tolist(),
+                    hours.mean.tolist()) == ([0, 2, 10], [1, 3, 10],
+                                             [0.5, 2.5, 10])
+            # Longer intervals are merged from the coarsest resolution
+            assert rows(rollups.query('A0', 0, 7200, interval=7200,
+                                      keys=['metric'])) == [
+                ('metric', 0, 4, 6.0)]
+            # Buckets that don't fit are merged into the one they start in
+            assert rows(rollups.query('A0', 0, 7200, interval=5400,
+                                      keys=['metric'])) == [
+                ('metric', 0, 3, 3.0), ('metric', 5400, 1, 3.0)]
+            assert rollups.query('A0', 7200, 10 ** 10).count.tolist() == []
+            assert rollups.keys('A0') == {'metric', 'other'}
+    finally:
+        rollups.close()
+
+
+def test_roll_up_stream_blocks(tmp_path: Path) -> None:
+    rollups = RollupStore(str(tmp_path / 'rollups.db'), resolutions=(60,))
+    stream = Stream(EmptyConnector(), 'A0', logging.getLogger(__name__),
+                    rollups=rollups)
+    blocks = [Block(address=f'A{i}', next_link=f'A{i + 1}',
+                    previous_link=f'A{i - 1}' if i else '',
+                    data={'samples': [f'metric {30 * i} {i}']}, metadata={})
+              for i in range(4)]
+    try:
+        for block in blocks + blocks[:2]:
+            stream.replay(block)
+        assert buckets(rollups) == [('metric', 0, 2, 1.0),
+                                    ('metric', 60, 2, 5.0)], \
+            'Samples of replayed blocks rolled up twice'
+    finally:
+        rollups.close()
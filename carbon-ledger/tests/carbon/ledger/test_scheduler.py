@@ -0,0 +1,67 @@
+from asyncio import gather, new_event_loop, sleep
+from time import monotonic
+from typing import Any, List, Tuple
+
+from carbon.ledger.scheduler import Priority, RateLimiter, Scheduler
+
+
+def test_follow_during_backfill() -> None:
+    scheduler = Scheduler(max_concurrency=4, follow_reserve=1)
+    started = list()  # type: List[Tuple[Priority, Any]]
+
+    async def request(priority: Priority, owner: Any,
+                      duration: float = 0.02) -> None:
+        await scheduler.acquire(priority, owner)
+        started.append((priority, owner))
+        try:
+            await sleep(duration)
+        finally:
+            scheduler.release(priority)
+
+    async def run_requests() -> float:
+        backfill = [request(Priority.BACKFILL, 'A') for _ in range(20)]
+        tasks = gather(*backfill, request(Priority.BACKFILL, 'B'))
+        await sleep(0.005)
+        assert scheduler.stats['backfill_running'] == 3, \
+            'Backfill used the slots kept for following'
+        # Every slot is taken once the reserve is used
+        start = monotonic()
+        await gather(request(Priority.FOLLOW, 'C', 0.05),
+                     request(Priority.FOLLOW, 'D'))
+        waited = monotonic() - start
+        await tasks
+        return waited
+
+    event_loop = new_event_loop()
+    try:
+        waited = event_loop.run_until_complete(run_requests())
+    finally:
+        event_loop.close()
+    assert waited < 0.1, 'Follow request waited for the backfill'
+    # The second follow request got the first slot that was released
+    assert started[4] == (Priority.FOLLOW, 'D')
+    # The other stream didn't wait for the whole burst of the first one
+    assert started.index((Priority.BACKFILL, 'B')) < 8
+    assert scheduler.running == 0
+
+
+def test_rate_limit() -> None:
+    limiter = RateLimiter(rate=100, burst=5)
+
+    async def send_requests() -> List[float]:
+        times = list()  # type: List[float]
+        for _ in range(30):
+            await limiter.acquire()
+            times.append(monotonic())
+        return times
+
+    event_loop = new_event_loop()
+    try:
+        start = monotonic()
+        times = event_loop.run_until_complete(send_requests())
+    finally:
+        event_loop.close()
+    # The burst goes right away, then one request every 10 ms
+    assert times[4] - start < 0.01
+    assert times[-1] - start >= 0.24, 'Rate limit exceeded'
+    assert times[-1] - start < 0.5
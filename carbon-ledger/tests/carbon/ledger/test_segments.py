@@ -0,0 +1,122 @@
+import os
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+from carbon.ledger.arrays import SampleBatch, TagDictionary, parse_samples
+from carbon.ledger.segments import (SegmentArchive, SegmentReader,
+                                    SegmentWriter, decode_timestamps,
+                                    decode_values, encode_timestamps,
+                                    encode_values, pack_words, unpack_words)
+
+
+def write_segment(path: Path, samples: List[str]) -> str:
+    with SegmentWriter(str(path), 'stream') as writer:
+        writer.add(parse_samples(samples, TagDictionary()))
+    return str(path)
+
+
+def test_pack_words() -> None:
+    words = np.array([0, 1, 0xff00, 2 ** 64 - 1, 0x0100000000000000, 0],
+                     dtype=np.uint64)
+    headers, payload = pack_words(words)
+    assert headers.tolist() == [0x00, 0x71, 0x61, 0x08, 0x01, 0x00]
+    assert len(payload) == 11, 'Zero bytes around the words not dropped'
+    assert unpack_words(headers, payload).tolist() == words.tolist()
+
+
+def test_timestamps_round_trip() -> None:
+    for timestamps in ([1600000000],
+                       [1600000000 + 60 * i for i in range(100)],
+                       [5, 5, 5, 7, 7, 100],
+                       # Negative deltas and delta of deltas
+                       [100, 90, 95, -2 ** 40, 2 ** 40, 0]):
+        timestamps = np.array(timestamps, dtype=np.int64)
+        headers, payload = encode_timestamps(timestamps)
+        assert len(headers) == len(timestamps) - 1
+        assert decode_timestamps(int(timestamps[0]), headers,
+                                 payload).tolist() == timestamps.tolist()
+    # Samples taken at a fixed interval only take their headers
+    _, payload = encode_timestamps(np.arange(0, 6000, 60, dtype=np.int64))
+    assert len(payload) == 1
+
+
+def test_values_round_trip() -> None:
+    values = np.array([21.5, 21.5, -0.0, 0.0, np.nan, np.inf, -np.inf,
+                       1e-310, -1.7976931348623157e308], dtype=np.float64)
+    headers, payload = encode_values(values)
+    decoded = decode_values(headers, payload)
+    # Compare the bits, so that NaN and the sign of zero are checked too
+    assert decoded.view(np.uint64).tolist() == \
+        values.view(np.uint64).tolist()
+    assert headers[1] == 0, 'Repeated value not packed to its header'
+
+
+def test_segment_round_trip(tmp_path: Path) -> None:
+    samples = ['metric;room=a 100 1.5', 'metric;room=a 160 2.5',
+               'metric;room=a 220 nan', 'metric;room=b 160 inf',
+               'other 300 -1', 'other 300 -2', 'single 50 7']
+    path = write_segment(tmp_path / 'segment.seg', samples)
+    with SegmentReader(path) as reader:
+        assert reader.stream_id == 'stream'
+        assert len(reader) == 7
+        assert (reader.first_timestamp, reader.last_timestamp) == (50, 300)
+        index = {reader.keys[entry['tag_id']]: (
+            int(entry['count']), int(entry['first_timestamp']),
+            int(entry['last_timestamp'])) for entry in reader.series}
+        assert index == {'metric;room=a': (3, 100, 220),
+                         'metric;room=b': (1, 160, 160),
+                         'other': (2, 300, 300), 'single': (1, 50, 50)}
+        batch = reader.to_arrays()
+        assert sorted(zip(batch.keys, batch.timestamps.tolist(),
+                          batch.values.astype(str).tolist())) == sorted(
+            (key, int(timestamp), str(float(value))) for key, timestamp, value
+            in (sample.split(' ') for sample in samples))
+        assert reader.has_counts is False
+
+        # Only the series of the keys with samples in the range are decoded
+        dictionary = TagDictionary()
+        batches = list(reader.read(['metric;room=a', 'other'], 150, 300,
+                                   dictionary))
+        assert [(batch.keys[0], batch.timestamps.tolist())
+                for batch in batches] == [('metric;room=a', [160, 220])]
+
+
+def test_segment_counts(tmp_path: Path) -> None:
+    dictionary = TagDictionary()
+    batch = parse_samples(['metric 0 1', 'metric 10 2'], dictionary)
+    with SegmentWriter(str(tmp_path / 'segment.seg')) as writer:
+        writer.add(SampleBatch(batch.timestamps, batch.values,
+                               batch.tag_ids, dictionary,
+                               np.array([3, 1], dtype=np.int64)))
+    with SegmentReader(str(tmp_path / 'segment.seg')) as reader:
+        assert reader.has_counts
+        assert reader.to_arrays().sample_counts.tolist() == [3, 1]
+
+
+def test_read_removed_segment(tmp_path: Path) -> None:
+    path = write_segment(tmp_path / 'segment.seg',
+                         ['metric 0 1', 'metric 1 2'])
+    with SegmentReader(path) as reader:
+        # A compaction removes the segment while it's read
+        os.remove(path)
+        assert reader.to_arrays().values.tolist() == [1, 2]
+    assert not list(SegmentArchive.read_segments([path]))
+
+
+def test_archive_latest(tmp_path: Path) -> None:
+    archive = SegmentArchive(str(tmp_path), 'stream')
+    for samples in (['metric 0 1', 'other 5 2'], ['metric 10 3'],
+                    ['metric 3 4']):
+        archive.add(parse_samples(samples, TagDictionary()))
+        archive.flush()
+    archive.add(parse_samples(['other 1 5', 'new 0 6'], TagDictionary()))
+    # The series are decoded after the footers they were found in are closed
+    latest = archive.latest()
+    assert list(zip(latest.keys, latest.timestamps.tolist(),
+                    latest.values.tolist())) == [
+        ('metric', 10, 3), ('new', 0, 6), ('other', 5, 2)]
+    latest = archive.latest(['metric'])
+    assert latest.keys == ['metric']
+    assert archive.keys() == {'metric', 'new', 'other'}
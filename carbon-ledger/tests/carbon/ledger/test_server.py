@@ -0,0 +1,131 @@
+import json
+import logging
+from asyncio import new_event_loop
+from pathlib import Path
+from typing import Any, Dict, List
+
+from aiohttp import ClientSession
+
+from carbon.ledger.arrays import TagDictionary, parse_samples
+from carbon.ledger.connectors import AsyncLedgerConnector, Block, Stream
+from carbon.ledger.protocols import HermesPlaintextParser
+from carbon.ledger.scheduler import Priority
+from carbon.ledger.segments import SegmentArchive
+from carbon.ledger.server import QueryServer
+
+
+class RecordingConnector(AsyncLedgerConnector):
+    """Ledger without any block, that records what is fetched from it."""
+
+    def __init__(self) -> None:
+        super().__init__(HermesPlaintextParser())
+        self.fetched = list()  # type: List[str]
+
+    async def fetch(self, address: str, log: logging.Logger,
+                    priority: Priority = Priority.FOLLOW) -> Block:
+        self.fetched.append(address)
+        raise AsyncLedgerConnector.NoDataFetched()
+
+
+def block(i: int) -> Block:
+    return Block(address=f'A{i}', next_link=f'A{i + 1}',
+                 previous_link=f'A{i - 1}' if i else '',
+                 data={'samples': [f'metric;room=a {1600000000 + i} {i}',
+                                   f'other {1600000000 + i} {-i}']},
+                 metadata={})
+
+
+async def query(server: QueryServer, path: str) -> List[Dict[str, Any]]:
+    host, port = server._runner.addresses[0][:2]
+    async with ClientSession() as session:
+        async with session.get(f'http://{host}:{port}{path}') as response:
+            assert response.status == 200
+            return [json.loads(line)
+                    for line in (await response.text()).splitlines()]
+
+
+def test_query_history_after_restart(tmp_path: Path) -> None:
+    logger = logging.getLogger(__name__)
+    stream = Stream(RecordingConnector(), 'A0', logger,
+                    archive=SegmentArchive(str(tmp_path), 'A0'))
+    for i in range(5):
+        stream.replay(block(i))
+    stream.archive.flush()
+
+    # The new process only knows the blocks stored since it started
+    connector = RecordingConnector()
+    stream = Stream(connector, 'A0', logger,
+                    archive=SegmentArchive(str(tmp_path), 'A0'))
+    stream.replay(block(5))
+    server = QueryServer([stream], logger, port=0)
+
+    async def run_queries() -> Dict[str, List[Dict[str, Any]]]:
+        await server.start()
+        try:
+            return {
+                'samples': await query(
+                    server, '/streams/A0/samples?start=1600000001&key=metric'),
+                'latest': await query(server, '/streams/A0/latest'),
+                'aggregates': await query(
+                    server, '/streams/A0/aggregates?interval=86400'
+                            '&key=metric')}
+        finally:
+            await server.close()
+
+    event_loop = new_event_loop()
+    try:
+        results = event_loop.run_until_complete(run_queries())
+    finally:
+        event_loop.close()
+    assert [(sample['time'], sample['value'])
+            for sample in results['samples']] == [
+        (1600000000 + i, i) for i in range(1, 6)], 'Archived samples missing'
+    assert [(sample['what'], sample['time'], sample['value'])
+            for sample in results['latest']] == [
+        ('metric', 1600000005, 5), ('other', 1600000005, -5)]
+    aggregates, = results['aggregates']
+    assert (aggregates['count'], aggregates['sum']) == (6, 15)
+    assert not connector.fetched, 'Queries fetched blocks from the ledger'
+
+
+def test_query_overlapping_segments(tmp_path: Path) -> None:
+    logger = logging.getLogger(__name__)
+    archive = SegmentArchive(str(tmp_path), 'A0')
+    stream = Stream(RecordingConnector(), 'A0', logger, archive=archive)
+    for samples in ([f'metric {i} {i}' for i in range(10)],
+                    [f'metric {i} {i}' for i in range(5, 15)],
+                    [f'metric {i} {i}' for i in range(100, 106)]):
+        archive.add(parse_samples(samples, TagDictionary()))
+        archive.flush()
+    # Buffered samples, repeating some archived ones
+    archive.add(parse_samples([f'metric {i} {i}' for i in range(103, 111)],
+                              TagDictionary()))
+    assert [(len(paths), len(buffered)) for paths, buffered
+            in archive.windows(['metric'])] == [(2, 0), (1, 8)]
+    server = QueryServer([stream], logger, port=0)
+
+    async def run_queries() -> Dict[str, List[Dict[str, Any]]]:
+        await server.start()
+        try:
+            samples = await query(server, '/streams/A0/samples?key=metric')
+            aggregates = await query(
+                server, '/streams/A0/aggregates?interval=100&key=metric')
+            archive.add(parse_samples(['new 200 1'], TagDictionary()))
+            archive.flush()
+            return {'samples': samples, 'aggregates': aggregates,
+                    'new': await query(server, '/streams/A0/samples?key=new')}
+        finally:
+            await server.close()
+
+    event_loop = new_event_loop()
+    try:
+        results = event_loop.run_until_complete(run_queries())
+    finally:
+        event_loop.close()
+    assert [sample['time'] for sample in results['samples']] == \
+        list(range(15)) + list(range(100, 111)), \
+        'Archived samples repeated or out of order'
+    assert [(bucket['time'], bucket['count'])
+            for bucket in results['aggregates']] == [(0, 15), (100, 11)]
+    assert [sample['time'] for sample in results['new']] == [200], \
+        'Segment written after the first query not listed'
@@ -0,0 +1,116 @@
+from typing import List
+
+import numpy as np
+import pytest
+from iota import (Address, BundleHash, Fragment, Nonce, Tag, Transaction,
+                  TransactionHash, TryteString)
+
+from carbon.ledger.trytes import (FRAGMENT_LENGTH, MessageAssembler,
+                                  TransactionBatch, TryteDecoder,
+                                  decode_integers, trytes_to_bytes)
+
+ADDRESSES = ['A' * 81, 'B' * 81]
+# Multi-byte characters end up across the fragments of the messages
+MESSAGES = ['digest::é€ metric 1600000000 1::' * 200,
+            'other 1600000000 ☃\t']
+
+
+def fragments(message: str) -> List[str]:
+    trytes = str(TryteString.from_unicode(message))
+    return [trytes[i:i + FRAGMENT_LENGTH].ljust(FRAGMENT_LENGTH, '9')
+            for i in range(0, len(trytes), FRAGMENT_LENGTH)]
+
+
+def transactions(address: str, message: str, bundle: str) -> List[str]:
+    message_fragments = fragments(message)
+    return [str(Transaction(
+        hash_=TransactionHash(''),
+        signature_message_fragment=Fragment(fragment),
+        address=Address(address), value=0, timestamp=0, current_index=index,
+        last_index=len(message_fragments) - 1,
+        bundle_hash=BundleHash(bundle),
+        trunk_transaction_hash=TransactionHash(''),
+        branch_transaction_hash=TransactionHash(''), tag=Tag(''),
+        attachment_timestamp=0, attachment_timestamp_lower_bound=0,
+        attachment_timestamp_upper_bound=0, nonce=Nonce(''),
+        legacy_tag=Tag('')).as_tryte_string())
+        for index, fragment in enumerate(message_fragments)]
+
+
+def as_array(trytes: str) -> np.ndarray:
+    return np.frombuffer(trytes.encode('ascii'), dtype=np.uint8)
+
+
+def rows(batch: TransactionBatch, indexes: List[int]) -> TransactionBatch:
+    subset = TransactionBatch(())
+    subset.trytes = batch.trytes[indexes]
+    return subset
+
+
+def test_decode_integers() -> None:
+    trytes = np.stack([as_array(value.ljust(9, '9')) for value in
+                       ['9', 'A', 'Z', 'M', 'N', '9A', 'MMMMMMMMM']])
+    assert decode_integers(trytes).tolist() == [
+        0, 1, -1, 13, -13, 27, (27 ** 9 - 1) // 2]
+    with pytest.raises(ValueError):
+        decode_integers(as_array('A!'))
+
+
+def test_trytes_to_bytes() -> None:
+    data = bytes(range(256))
+    out = np.empty(256, dtype=np.uint8)
+    trytes_to_bytes(as_array(str(TryteString.from_bytes(data))), out)
+    assert out.tobytes() == data
+    with pytest.raises(ValueError):
+        # Z and Z encode 26 + 26 * 27, past the largest byte
+        trytes_to_bytes(as_array('ZZ'), out[:1])
+
+
+def test_decode_messages() -> None:
+    batch = TransactionBatch(
+        transactions(ADDRESSES[0], MESSAGES[0], 'C' * 81)
+        + transactions(ADDRESSES[1], MESSAGES[1], 'D' * 81)
+        # A reattachment of the second message
+        + transactions(ADDRESSES[1], MESSAGES[1], 'D' * 81))
+    assert batch.addresses[0] == ADDRESSES[0]
+    assert batch.current_index.tolist()[:3] == [0, 1, 2]
+    groups = batch.group_by_address()
+    assert [len(groups[address]) for address in ADDRESSES] == [
+        len(fragments(MESSAGES[0])), 1], 'Reattachment not dropped'
+
+    # The buffer of the decoder grows to fit the messages
+    decoder = TryteDecoder(capacity=16)
+    decoded = decoder.decode(batch.fragments,
+                             [groups[address] for address in ADDRESSES])
+    assert [str(message, 'utf-8') for message in decoded] == MESSAGES
+    assert decoder.decode(batch.fragments, []) == []
+
+    with pytest.raises(ValueError):
+        TransactionBatch(['9' * 10])
+    assert len(TransactionBatch.concatenate([batch, batch])) == \
+        2 * len(batch)
+
+
+def test_assemble_message_in_pieces() -> None:
+    batch = TransactionBatch(transactions(ADDRESSES[0], MESSAGES[0],
+                                          'C' * 81))
+    assert len(batch) > 2
+    assembler = MessageAssembler()
+    pieces = list()  # type: List[str]
+    # The fragments arrive in reverse order, and some of them twice
+    for row in reversed(range(len(batch))):
+        pieces.append(assembler.add(rows(batch, [row, row])))
+    assert pieces[:-1] == [''] * (len(batch) - 1), \
+        'Fragments decoded before the ones preceding them'
+    assert pieces[-1] == MESSAGES[0]
+    assert assembler.complete
+    assert assembler.add(batch) == '' and assembler.finish() == ''
+
+    # Fragments in order are decoded right away, up to the last character
+    # that they complete
+    assembler = MessageAssembler()
+    text = assembler.add(rows(batch, [0]))
+    assert text and MESSAGES[0].startswith(text)
+    text += assembler.add(rows(batch, list(range(1, len(batch)))))
+    assert text == MESSAGES[0]
+
@@ -0,0 +1,92 @@
+import hashlib
+import logging
+from asyncio import new_event_loop
+from typing import Iterator, Tuple
+
+import pytest
+from ecdsa import SECP256k1, SigningKey
+
+from carbon.ledger.connectors import Block, Stream
+from carbon.ledger.verification import (DIGEST_PREFIX, DigestVerifier,
+                                        verify_signature)
+
+
+def client_encoding(component: int) -> bytes:
+    """First 32 bytes of the two's complement of a component, like the
+    Android client."""
+    encoded = component.to_bytes((component.bit_length() + 8) // 8, 'big')
+    return encoded[:32].rjust(32, b'\0')
+
+
+def signatures(key: SigningKey) -> Iterator[Tuple[bytes, int, int]]:
+    """Checksums of messages and the components of their signatures."""
+    for i in range(10000):
+        checksum = hashlib.sha256(f'message {i}'.encode()).digest()
+        r, s = key.sign_digest_deterministic(
+            checksum, hashfunc=hashlib.sha256,
+            sigencode=lambda r, s, order: (r, s))
+        yield checksum, r, s
+
+
+@pytest.fixture(scope='module')
+def signing_key() -> SigningKey:
+    return SigningKey.from_secret_exponent(0xc0ffee, curve=SECP256k1)
+
+
+@pytest.fixture(scope='module')
+def public_key(signing_key: SigningKey) -> str:
+    return signing_key.get_verifying_key().to_string('uncompressed').hex()
+
+
+@pytest.mark.parametrize('r_truncated,s_truncated', [
+    (False, False), (True, False), (False, True), (True, True)])
+def test_verify_client_signatures(signing_key: SigningKey, public_key: str,
+                                  r_truncated: bool,
+                                  s_truncated: bool) -> None:
+    checksum, r, s = next(
+        (checksum, r, s) for checksum, r, s in signatures(signing_key)
+        if bool(r >> 255) == r_truncated and bool(s >> 255) == s_truncated
+        and r >> 248 and s >> 248)
+    signature = (client_encoding(r) + client_encoding(s)).hex()
+    assert verify_signature(public_key, signature, checksum.hex()) is True, \
+        'Valid signature rejected'
+    other = hashlib.sha256(b'another message').hexdigest()
+    assert verify_signature(public_key, signature, other) is False, \
+        'Signature of another message accepted'
+
+
+def test_reject_forged_truncated_signature(public_key: str) -> None:
+    checksum = hashlib.sha256(b'forged message').hexdigest()
+    # Both components start with a zero byte, as if both were truncated
+    signature = ('00' + 'ab' * 31) * 2
+    assert verify_signature(public_key, signature, checksum) is False, \
+        'Forged signature accepted'
+
+
+def test_stream_drops_forged_truncated_block(signing_key: SigningKey,
+                                             public_key: str) -> None:
+    checksum, r, s = next(
+        (checksum, r, s) for checksum, r, s in signatures(signing_key)
+        if r >> 255 and s >> 255)
+    valid_signature = client_encoding(r) + client_encoding(s)
+    forged_signature = (valid_signature[:31] + b'\x42'
+                        + valid_signature[32:63] + b'\x42')
+    blocks = {
+        address: Block(address=address, next_link='', previous_link='',
+                       data={'samples': []},
+                       metadata={'digest': DIGEST_PREFIX + signature.hex(),
+                                 'checksum': checksum.hex()})
+        for address, signature in [('VALID', valid_signature),
+                                   ('FORGED', forged_signature)]}
+    verifier = DigestVerifier(processes=1)
+    stream = Stream(None, 'VALID', logging.getLogger(__name__),
+                    verifier=verifier, public_key=public_key)
+    event_loop = new_event_loop()
+    try:
+        verified = event_loop.run_until_complete(
+            stream._verify_many(blocks))
+    finally:
+        verifier.close()
+        event_loop.close()
+    assert list(verified) == ['VALID'], 'Forged block was not dropped'
+    assert verifier.stats['invalid'] == 1
@@ -0,0 +1,110 @@
+import importlib.util
+import logging
+import os
+from asyncio import gather, new_event_loop
+from pathlib import Path
+from typing import List
+
+from carbon.ledger.backends import SQLite
+from carbon.ledger.connectors import Block
+from carbon.ledger.wal import WriteAheadLog
+
+# The daemon is a script, not a module of the package
+_spec = importlib.util.spec_from_file_location(
+    'carbon_ledger_daemon',
+    str(Path(__file__).parents[3] / 'bin' / 'carbon-ledger.py'))
+daemon = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(daemon)
+
+
+class UnsyncedSQLite(SQLite):
+    """Block store whose commits can't be synced to disk."""
+
+    def flush(self) -> None:
+        raise OSError('No space left on device')
+
+
+def block(i: int) -> Block:
+    return Block(address=f'A{i}', next_link=f'A{i + 1}',
+                 previous_link=f'A{i - 1}' if i else '',
+                 data={'samples': [f'metric {1600000000 + i} {i}']},
+                 metadata={})
+
+
+def log_files(path: Path) -> List[str]:
+    return sorted(os.listdir(str(path)))
+
+
+def test_share_syncs(tmp_path: Path) -> None:
+    wal = WriteAheadLog(str(tmp_path))
+
+    async def log_block(i: int) -> None:
+        await wal.commit(wal.append('A0', block(i)))
+
+    async def log_blocks() -> None:
+        await gather(*[log_block(i) for i in range(10)])
+
+    event_loop = new_event_loop()
+    try:
+        event_loop.run_until_complete(log_blocks())
+    finally:
+        event_loop.close()
+        wal.close()
+    assert wal.records == 10
+    assert wal.syncs == 1, 'Appends did not share a sync'
+
+
+def test_replay_after_crash(tmp_path: Path) -> None:
+    wal = WriteAheadLog(str(tmp_path))
+    event_loop = new_event_loop()
+    try:
+        for i in range(3):
+            event_loop.run_until_complete(
+                wal.commit(wal.append('A0', block(i))))
+    finally:
+        event_loop.close()
+    # The process dies halfway through the next append
+    wal._file.write(b'\x40\x00\x00\x00\x00')
+    wal._file.close()
+
+    wal = WriteAheadLog(str(tmp_path))
+    replayed = list(wal.replay())
+    assert [(stream_id, logged.address, logged.raw_samples)
+            for stream_id, logged in replayed] == [
+        ('A0', f'A{i}', [f'metric {1600000000 + i} {i}']) for i in range(3)]
+    wal.append('A0', block(3))
+    wal.close()
+    # The torn record is gone and new blocks go to a new file
+    assert log_files(tmp_path) == ['000000000001.log', '000000000002.log']
+    assert len(list(WriteAheadLog(str(tmp_path)).replay())) == 4
+
+
+def test_truncate_persisted_blocks_only(tmp_path: Path) -> None:
+    logger = logging.getLogger(__name__)
+    wal = WriteAheadLog(str(tmp_path / 'wal'))
+    path = str(tmp_path / 'blocks.db')
+
+    async def truncate_wal(backend: SQLite) -> None:
+        try:
+            await daemon.truncate_wal(wal, [], logger, backend=backend)
+        finally:
+            backend.close()
+
+    event_loop = new_event_loop()
+    try:
+        position = wal.append('A0', block(0))
+        event_loop.run_until_complete(wal.commit(position))
+        wal.applied(position)
+        event_loop.run_until_complete(truncate_wal(UnsyncedSQLite(path)))
+        assert log_files(tmp_path / 'wal') == ['000000000001.log'], \
+            'Log removed before the stored blocks were synced'
+
+        # A block that was logged but not stored yet
+        event_loop.run_until_complete(
+            wal.commit(wal.append('A0', block(1))))
+        event_loop.run_until_complete(truncate_wal(SQLite(path)))
+        assert log_files(tmp_path / 'wal') == ['000000000002.log'], \
+            'Log of a block that was not stored removed'
+    finally:
+        event_loop.close()
+        wal.close()
@@ -0,0 +1,64 @@
+import os
+import signal
+from multiprocessing import Queue
+from pathlib import Path
+
+from carbon.ledger.workers import HashRing, Supervisor, merge_metrics, shard
+
+KEYS = [f'ROOT{i}' for i in range(1000)]
+
+
+def test_stable_assignment() -> None:
+    assignment = [HashRing(range(4)).node_for(key) for key in KEYS]
+    assert assignment == [HashRing(range(4)).node_for(key) for key in KEYS]
+    # Workers of different releases must agree on the assignment
+    assert assignment[:8] == [1, 0, 2, 3, 1, 2, 3, 0]
+    shards = shard(KEYS, lambda key: key, 4)
+    assert sorted(key for keys in shards.values() for key in keys) == \
+        sorted(KEYS)
+    assert all(150 < len(keys) < 350 for keys in shards.values()), \
+        'Keys not spread evenly'
+
+
+def test_minimal_movement() -> None:
+    before = HashRing(range(4))
+    added = HashRing(range(5))
+    moved = [key for key in KEYS
+             if before.node_for(key) != added.node_for(key)]
+    assert all(added.node_for(key) == 4 for key in moved), \
+        'Keys moved between workers that were already there'
+    assert len(moved) < 300
+    removed = HashRing(range(3))
+    assert all(before.node_for(key) == removed.node_for(key)
+               for key in KEYS if before.node_for(key) != 3), \
+        'Keys of the remaining workers moved'
+
+
+def test_merge_metrics() -> None:
+    assert merge_metrics([{'blocks': 1, 'cache': {'hits': 2}, 'up': True},
+                          {'blocks': 2, 'cache': {'hits': 3}}]) == {
+        'blocks': 3, 'cache': {'hits': 5}}
+
+
+def crash_once(worker_id: int, workers: int, metrics_queue: Queue,
+               directory: str) -> None:
+    marker = os.path.join(directory, f'worker-{worker_id}')
+    if worker_id == 0 and not os.path.exists(marker):
+        open(marker, 'w').close()
+        os._exit(1)
+    metrics_queue.put((worker_id, {'blocks': 1}))
+
+
+def test_restart_dead_worker(tmp_path: Path) -> None:
+    handlers = [signal.getsignal(signal.SIGTERM),
+                signal.getsignal(signal.SIGINT)]
+    supervisor = Supervisor(2, crash_once, (str(tmp_path),), max_backoff=0.1)
+    try:
+        supervisor.run()
+    finally:
+        signal.signal(signal.SIGTERM, handlers[0])
+        signal.signal(signal.SIGINT, handlers[1])
+    metrics = supervisor.metrics
+    assert metrics['restarts'] == 1, 'Dead worker not restarted'
+    assert metrics['blocks'] == 2, 'Metrics of the workers not merged'
+    assert metrics['workers'] == 0